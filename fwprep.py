@@ -1,6 +1,9 @@
 import sys
 import zlib
+import mmap
+import struct
 import logging
+import contextlib
 import re
 import os
 
@@ -9,20 +12,44 @@ import os
 DEFAULT_FIRMWARE_FILE = "build/jade.bin"
 DEFAULT_OUTPUT_DIR = "build"
 
+# Delta (patch) format - see main/process/ota.h
+PATCH_MAGIC = b"JDP1"
+PATCH_OP_ADD = b"A"
+PATCH_OP_INSERT = b"I"
+
+# Offset of the app_elf_sha256 in the firmware image (in the esp_app_desc_t which
+# follows the image and first segment headers)
+APP_ELF_SHA256_OFFSET = 24 + 8 + 144
+APP_ELF_SHA256_LEN = 32
+
+# Patch generation - the base is indexed by blocks of PATCH_BLOCK_SIZE bytes at every
+# PATCH_INDEX_STEP bytes, and matches are extended while the bytes mostly match (ie.
+# until the mismatches exceed the matches by PATCH_MAX_MISMATCH).
+PATCH_BLOCK_SIZE = 32
+PATCH_INDEX_STEP = 4
+PATCH_MAX_MISMATCH = 64
+
+# Streaming compression reads the firmware in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
 # Enable logging
 logger = logging.getLogger('jade')
 logger.setLevel(logging.DEBUG)
 
 
+# Get the version string - first printable string in the
+# firmware binary file of length 6 or more.
+# FIXME: improve regex when we know what the version labels will look like
+def get_version(firmware):
+    match = re.search(u'[^\x00-\x1F\x7F-\xFF]{6,}'.encode('utf8'), firmware)
+    assert match and match.group() and match.group().decode('utf8')
+    return match.group().decode('utf8')
+
+
 # Generate compressed image filename based on version, ble-config and size of
 # the uncompressed firmware (as deduced from the passed firmware image)
 def get_compressed_filepath(firmware, outputdir):
-    # Get the version string - first printable string in the
-    # firmware binary file of length 6 or more.
-    # FIXME: improve regex when we know what the version labels will look like
-    match = re.search(u'[^\x00-\x1F\x7F-\xFF]{6,}'.encode('utf8'), firmware)
-    assert match and match.group() and match.group().decode('utf8')
-    ver = match.group().decode('utf8')
+    ver = get_version(firmware)
 
     # Look for the 'NORADIO' value in the binary
     match = re.search('NORADIO'.encode(), firmware)
@@ -39,6 +66,121 @@ def get_compressed_filepath(firmware, outputdir):
     return filepath
 
 
+# Generate the patch filename for the compressed firmware filename passed, and
+# the version of the base firmware the patch applies to.
+# ie. <ver>_<config>_<uncompressed-size>_<base-ver>_patch.bin
+def get_patch_filename(fwfilename, basever):
+    assert fwfilename.endswith("_fw.bin")
+    return fwfilename[:-len("fw.bin")] + basever + "_patch.bin"
+
+
+# Generate compressed patch filename, as for get_compressed_filepath() but
+# with the version of the base firmware embedded
+def get_patch_filepath(firmware, base, outputdir):
+    filepath = get_patch_filename(get_compressed_filepath(firmware, outputdir), get_version(base))
+    logger.info("Deduced patch filepath: {}".format(filepath))
+    return filepath
+
+
+# Length of the (approximate) match of target at 't' against base at 'b' - ie. the
+# length which maximises the number of matching bytes less the number of mismatches.
+def _extend_match(base, target, b, t):
+    limit = min(len(base) - b, len(target) - t)
+    score = best_score = best_len = 0
+    i = 0
+    while i < limit:
+        score += 1 if base[b + i] == target[t + i] else -1
+        i += 1
+        if score > best_score:
+            best_score, best_len = score, i
+        elif score < best_score - PATCH_MAX_MISMATCH:
+            break
+    return best_len
+
+
+# Create a patch from the base firmware to the target firmware.
+# Sections of the target which (approximately) match the base are 'add' ops - the
+# differences from the base, which are mostly zeros and so compress well - and other
+# sections are 'insert' ops.
+def create_patch(base, target):
+    base = bytearray(base)
+    target = bytearray(target)
+
+    index = {}
+    for offset in range(0, len(base) - PATCH_BLOCK_SIZE + 1, PATCH_INDEX_STEP):
+        index.setdefault(bytes(base[offset:offset + PATCH_BLOCK_SIZE]), offset)
+
+    elf_sha256 = bytes(base[APP_ELF_SHA256_OFFSET:APP_ELF_SHA256_OFFSET + APP_ELF_SHA256_LEN])
+    patch = [PATCH_MAGIC, struct.pack("<I", len(base)), elf_sha256]
+
+    pos = 0
+    inserted = 0  # start of the target not yet covered by an op
+    while pos <= len(target) - PATCH_BLOCK_SIZE:
+        b = index.get(bytes(target[pos:pos + PATCH_BLOCK_SIZE]))
+        if b is None:
+            pos += 1
+            continue
+
+        # Extend the match backwards over any pending insert, then forwards
+        t = pos
+        while t > inserted and b > 0 and target[t - 1] == base[b - 1]:
+            t -= 1
+            b -= 1
+        length = _extend_match(base, target, b, t)
+
+        if t > inserted:
+            patch.append(PATCH_OP_INSERT + struct.pack("<I", t - inserted))
+            patch.append(bytes(target[inserted:t]))
+        patch.append(PATCH_OP_ADD + struct.pack("<II", b, length))
+        patch.append(bytes(bytearray((target[t + i] - base[b + i]) & 0xFF for i in range(length))))
+
+        pos = inserted = t + length
+
+    if inserted < len(target):
+        patch.append(PATCH_OP_INSERT + struct.pack("<I", len(target) - inserted))
+        patch.append(bytes(target[inserted:]))
+
+    return b"".join(patch)
+
+
+# Apply a patch (as created by create_patch()) to the base firmware - as the hw does
+# Returns the patched firmware
+def apply_patch(base, patch):
+    base = bytearray(base)
+    patch = bytearray(patch)
+    assert bytes(patch[:len(PATCH_MAGIC)]) == PATCH_MAGIC
+    pos = len(PATCH_MAGIC)
+    assert len(patch) >= pos + 4 + APP_ELF_SHA256_LEN, "Truncated patch header"
+    baselen, = struct.unpack("<I", bytes(patch[pos:pos + 4]))
+    pos += 4
+    elf_sha256 = bytes(patch[pos:pos + APP_ELF_SHA256_LEN])
+    pos += APP_ELF_SHA256_LEN
+    assert baselen == len(base), "Patch base length mismatch"
+    base_elf_sha256 = bytes(base[APP_ELF_SHA256_OFFSET:APP_ELF_SHA256_OFFSET + APP_ELF_SHA256_LEN])
+    assert elf_sha256 == base_elf_sha256, "Patch is not based on this firmware"
+
+    target = bytearray()
+    while pos < len(patch):
+        op = bytes(patch[pos:pos + 1])
+        if op == PATCH_OP_ADD:
+            assert pos + 9 <= len(patch), "Truncated patch op"
+            b, length = struct.unpack("<II", bytes(patch[pos + 1:pos + 9]))
+            pos += 9
+            assert b + length <= len(base), "Patch reads beyond the base firmware"
+        else:
+            assert op == PATCH_OP_INSERT, "Bad patch op"
+            assert pos + 5 <= len(patch), "Truncated patch op"
+            length, = struct.unpack("<I", bytes(patch[pos + 1:pos + 5]))
+            pos += 5
+        assert length > 0 and pos + length <= len(patch), "Truncated patch data"
+        if op == PATCH_OP_ADD:
+            target.extend((base[b + i] + patch[pos + i]) & 0xFF for i in range(length))
+        else:
+            target.extend(patch[pos:pos + length])
+        pos += length
+    return bytes(target)
+
+
 # Compress firmware and write to file
 # Returns compressed data
 def compress_and_write(uncompressed, filename):
@@ -93,12 +235,91 @@ def create_compressed_firmware_image(firmware, outputdir):
     return compressed
 
 
+# Compress the uncompressed firmware file in a single pass over an mmap of the file,
+# yielding the compressed data in chunks as it is produced.  The compressed data is
+# verified as it is produced (ie. decompressed and compared with the input) rather than
+# re-read and decompressed afterwards, and if passed 'hasher' (eg. hashlib.sha256()) is
+# updated with it.  If 'outputdir' is passed the compressed firmware image is also written
+# there (as create_compressed_firmware_image() - but only once complete and verified).
+def stream_compressed_firmware_image(fwfilename, hasher=None, outputdir=None,
+                                     chunksize=STREAM_CHUNK_SIZE):
+    with open(fwfilename, 'rb') as fwfile, \
+            contextlib.closing(mmap.mmap(fwfile.fileno(), 0, access=mmap.ACCESS_READ)) as firmware:
+        logger.info("Compressing {} bytes".format(len(firmware)))
+        outfile = get_compressed_filepath(firmware, outputdir) if outputdir else None
+        tmpfile = open(outfile + ".tmp", 'wb') if outfile else None
+
+        try:
+            compressor = zlib.compressobj(9)
+            decompressor = zlib.decompressobj()
+            verified = 0
+            compressed_size = 0
+            # Compress each chunk, and then flush the compressor (ie. offset None)
+            for offset in list(range(0, len(firmware), chunksize)) + [None]:
+                if offset is None:
+                    compressed = compressor.flush()
+                else:
+                    compressed = compressor.compress(firmware[offset:offset + chunksize])
+                if not compressed:
+                    continue
+
+                # Verify the compressed data decompresses to the input consumed so far
+                checkfw = decompressor.decompress(compressed)
+                assert checkfw == firmware[verified:verified + len(checkfw)], \
+                    "Verification failed at offset {}".format(verified)
+                verified += len(checkfw)
+
+                if hasher:
+                    hasher.update(compressed)
+                if tmpfile:
+                    tmpfile.write(compressed)
+                compressed_size += len(compressed)
+                yield compressed
+
+            assert verified == len(firmware) and not decompressor.flush() and \
+                not decompressor.unused_data, "Verification failed - unexpected length"
+            logger.info("Compressed to {} bytes, verified OK".format(compressed_size))
+
+            if tmpfile:
+                tmpfile.close()
+                os.rename(outfile + ".tmp", outfile)
+                logger.info("Written file {}".format(outfile))
+        finally:
+            if tmpfile and not tmpfile.closed:
+                tmpfile.close()
+                os.remove(outfile + ".tmp")
+
+
+# Function to create a patch from the base firmware to the firmware, compress it,
+# and write the compressed patch image
+def create_compressed_patch_image(firmware, base, outputdir):
+
+    # Get compressed patch filename
+    outfile = get_patch_filepath(firmware, base, outputdir)
+
+    # Create patch, compress and write
+    logger.info("Creating patch from {} byte base firmware".format(len(base)))
+    patch = create_patch(base, firmware)
+    compressed = compress_and_write(patch, outfile)
+
+    # Uncompress, apply and check contents
+    logger.info("Verifying...")
+    checkfw = apply_patch(base, read_and_decompress(outfile))
+    assert len(firmware) == len(checkfw)
+    assert firmware == checkfw
+    logger.info("OK")
+
+    # Return compressed data
+    return compressed
+
+
 # Can be run as a utility
 if __name__ == "__main__":
     jadehandler = logging.StreamHandler()
     logger.addHandler(jadehandler)
 
-    # Uncompressed firmware (ie. input) file
+    # Uncompressed firmware (ie. input) file, output directory, and optionally
+    # the base firmware file to create a patch from
     fwfilename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FIRMWARE_FILE
     outputdir = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_OUTPUT_DIR
 
@@ -116,3 +337,15 @@ if __name__ == "__main__":
 
     # Compress firmware and write file
     create_compressed_firmware_image(firmware, outputdir)
+
+    # If passed a base firmware file, also create the patch from that firmware
+    if len(sys.argv) > 3:
+        basefilename = sys.argv[3]
+        assert os.path.exists(basefilename) and os.path.isfile(
+            basefilename), "Base firmware file '{}' not found.".format(basefilename)
+
+        logger.info("Reading base file: {}".format(basefilename))
+        with open(basefilename, 'rb') as basefile:
+            base = basefile.read()
+
+        create_compressed_patch_image(firmware, base, outputdir)
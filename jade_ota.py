@@ -1,11 +1,20 @@
 import os
 import sys
+import json
+import mmap
 import time
+import hashlib
 import logging
+import tempfile
 import argparse
+import asyncio
+import functools
+import threading
+import contextlib
 import subprocess
+import concurrent.futures
 
-from jadepy import JadeAPI
+from jadepy import JadeAPI, JadeError
 import fwprep
 
 TEST_MNEMONIC = 'fish inner face ginger orchard permit useful method fence \
@@ -17,8 +26,30 @@ BLE_TEST_PASSKEYFILE = 'ble_test_passkey.txt'
 
 FWSERVER_URL_ROOT = 'https://jadefw.blockstream.com/bin'
 FWSERVER_CERTIFICATE_FILE = './jade_services_certificate.pem'
+FWSERVER_TIMEOUT = 30
+
+# Local cache of files downloaded from the firmware server
+DEFAULT_FW_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.jade', 'fwcache')
+DEFAULT_FW_CACHE_SIZE_MB = 256
+
+# Streamed downloads are fetched as concurrent range requests - at most RANGES_AHEAD ranges
+# are held in memory, awaiting earlier ranges before being written out in order.
+DEFAULT_RANGE_SIZE = 64 * 1024
+DEFAULT_RANGE_WORKERS = 4
+RANGES_AHEAD = 16
+RANGE_RETRIES = 3
 
 DEFAULT_FIRMWARE_FILE = 'build/jade.bin'
+DEFAULT_OTA_WINDOW = 4
+DEFAULT_MAX_OTA_CHUNK = 128 * 1024
+DEFAULT_OTA_RETRIES = 3
+RECONNECT_DELAY = 5
+
+# How often to log the aggregated progress of a fleet ota
+FLEET_PROGRESS_INTERVAL = 5
+
+# Ota errors after which the upload can be resumed (ie. the upload was interrupted)
+RESUMABLE_OTA_ERRORS = [b'ERROR_TIMEOUT', b'ERROR_BADDATA']
 COMP_FW_DIR = 'build'
 
 # Enable jade debug logging
@@ -87,43 +118,473 @@ def write_cmpfwfile(fwname, fwcmpdata):
     logger.info(f'Written file {cmpfilename}')
 
 
-# Download firmware file from Firmware Server
-def download_file(hw_target, write_compressed, index_file, auto_select_fw):
-    import requests
+# Local cache of files downloaded from the firmware server, keyed by their name (ie. their
+# path under FWSERVER_URL_ROOT, eg. 'jade/LATEST', so mirrors of the server share entries).
+# File content is stored content-addressed (ie. named by its sha256 hash, so files with the
+# same content are only stored once), and is verified against that hash when read.
+# Cached files are revalidated with the server using conditional GET requests (ie. using the
+# ETag/Last-Modified headers), and are used as-is if the server cannot be reached, or if
+# 'offline' is set.  The least recently used files are evicted when over 'max_size' bytes.
+# Writes are atomic and the index is updated under a file lock, so the cache directory can
+# be shared between several stations (eg. on a network mount).
+# NOTE: the file lock (fcntl) is unix-only - elsewhere (ie. Windows) the index is only locked
+# within this process, so the cache directory must not be shared between processes.
+class FirmwareCache:
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'index.lock'
+
+    # Used in place of the file lock where fcntl is not available
+    process_lock = threading.Lock()
+
+    def __init__(self, cachedir, max_size=DEFAULT_FW_CACHE_SIZE_MB * 1024 * 1024, offline=False):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.offline = offline
+        os.makedirs(cachedir, exist_ok=True)
+
+    def _path(self, filename):
+        return os.path.join(self.cachedir, filename)
+
+    # Write to temp file and rename, so concurrent readers never see partial data
+    def _write_file(self, filename, data):
+        tmpfile = self._path(f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmpfile, 'wb') as f:
+            f.write(data)
+        os.replace(tmpfile, self._path(filename))
+
+    # Hold the (cross-process, where supported) lock on the index
+    @contextlib.contextmanager
+    def _lock(self):
+        try:
+            import fcntl
+        except ImportError:
+            with self.process_lock:
+                yield
+            return
+
+        with open(self._path(self.LOCK_FILE), 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    # Yields the index (dict of name to entry), and writes it back afterwards, holding
+    # the lock throughout
+    @contextlib.contextmanager
+    def _locked_index(self):
+        with self._lock():
+            try:
+                with open(self._path(self.INDEX_FILE), 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+
+            yield index
+            self._write_file(self.INDEX_FILE, json.dumps(index, indent=2).encode())
+
+    # Read the cached content for the name, or None if not present (or corrupt)
+    def _read(self, index, name):
+        entry = index.get(name)
+        if not entry:
+            return None
+
+        try:
+            with open(self._path(entry['sha256']), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+
+        if data is None or hashlib.sha256(data).hexdigest() != entry['sha256']:
+            logger.warning(f'Discarding missing or corrupt cached file {name}')
+            for corrupt in [k for k, v in index.items() if v['sha256'] == entry['sha256']]:
+                del index[corrupt]
+            with contextlib.suppress(OSError):
+                os.remove(self._path(entry['sha256']))
+            return None
+
+        entry['last_used'] = time.time()
+        return data
+
+    # Evict the least recently used files until the cache is within its size limit
+    # (never evicting the most recently used file)
+    def _evict(self, index):
+        blobs = {}
+        for name, entry in index.items():
+            blob = blobs.setdefault(entry['sha256'], {'size': entry['size'], 'last_used': 0,
+                                                      'names': []})
+            blob['last_used'] = max(blob['last_used'], entry['last_used'])
+            blob['names'].append(name)
+
+        total = sum(blob['size'] for blob in blobs.values())
+        lru = sorted(blobs.items(), key=lambda kv: kv[1]['last_used'])
+        for sha256, blob in lru[:-1]:
+            if total <= self.max_size:
+                break
+            logger.info(f'Evicting cached file {sha256} ({blob["size"]}b)')
+            with contextlib.suppress(OSError):
+                os.remove(self._path(sha256))
+            for name in blob['names']:
+                del index[name]
+            total -= blob['size']
+
+    # Get the cached content for the name without revalidating it, or None if not cached
+    def lookup(self, name):
+        with self._locked_index() as index:
+            return self._read(index, name)
+
+    # Store the content of the name (with any validators from the response headers)
+    def put(self, name, data, etag=None, last_modified=None):
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._locked_index() as index:
+            if not os.path.isfile(self._path(sha256)):
+                self._write_file(sha256, data)
+            self._add_entry(index, name, sha256, len(data), etag, last_modified)
+
+    # As put(), but moving the passed file (created with spool_file()) into the cache, rather
+    # than passing the content in memory - the caller provides its hash and size.
+    def put_file(self, name, filename, sha256, size, etag=None, last_modified=None):
+        with self._locked_index() as index:
+            os.replace(filename, self._path(sha256))
+            self._add_entry(index, name, sha256, size, etag, last_modified)
+
+    # Create a temporary file in the cache directory (so it can be moved into the cache)
+    def spool_file(self):
+        return tempfile.NamedTemporaryFile(dir=self.cachedir, suffix='.tmp', delete=False)
+
+    def _add_entry(self, index, name, sha256, size, etag, last_modified):
+        index[name] = {'sha256': sha256, 'size': size, 'etag': etag,
+                       'last_modified': last_modified, 'last_used': time.time()}
+        self._evict(index)
+
+    # Get the content of the name, using the cached copy if still valid (or if the server
+    # cannot be reached) - otherwise downloading and caching it.  Returns None if the file
+    # is not available.
+    def get(self, name):
+        import requests
+
+        url = f'{FWSERVER_URL_ROOT}/{name}'
+        with self._locked_index() as index:
+            cached = self._read(index, name)
+            entry = index.get(name, {})
+
+        if self.offline:
+            logger.info(f'Using cached {url}' if cached is not None else f'Not cached: {url}')
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            rslt = requests.get(url, headers=headers, timeout=FWSERVER_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            if cached is None:
+                raise
+            logger.warning(f'Cannot revalidate {url}, using cached copy: {e}')
+            return cached
+
+        if rslt.status_code == 304 and cached is not None:
+            logger.info(f'Cached {url} is up to date')
+            return cached
+
+        if rslt.status_code != 200:
+            logger.info(f'Cannot download {url}: {rslt.status_code}')
+            return None
+
+        logger.info(f'Downloaded {url} - caching {len(rslt.content)}b')
+        self.put(name, rslt.content, rslt.headers.get('ETag'), rslt.headers.get('Last-Modified'))
+        return rslt.content
+
+
+# GET the named file from the firmware server (via the cache, if passed)
+# Returns None if the file is not available.
+def fetch_file(name, cache=None):
+    if cache:
+        return cache.get(name)
 
+    import requests
+    url = f'{FWSERVER_URL_ROOT}/{name}'
+    rslt = requests.get(url, timeout=FWSERVER_TIMEOUT)
+    if rslt.status_code != 200:
+        logger.info(f'Cannot download {url}: {rslt.status_code}')
+        return None
+    return rslt.content
+
+
+class DownloadError(Exception):
+    pass
+
+
+# Downloads a file from the firmware server as concurrent http range requests, so it can be
+# consumed (eg. uploaded to the hw) while the download proceeds.  Supports len() and slicing
+# (which blocks until the data is available), so can be passed to JadeAPI.ota_update().
+# Ranges are hashed as they are written out (in order) to a temporary file - which is moved
+# into the cache (if passed) when complete - so memory use is bounded by RANGES_AHEAD ranges,
+# not by the size of the file.  All ranges must be of the same version of the file (If-Range).
+class StreamedDownload:
+    def __init__(self, name, cache=None, range_size=DEFAULT_RANGE_SIZE,
+                 workers=DEFAULT_RANGE_WORKERS):
+        self.name = name
+        self.url = f'{FWSERVER_URL_ROOT}/{name}'
+        self.cache = cache
+        self.range_size = range_size
+        self.workers = workers
+
+        self.cond = threading.Condition()
+        self.sha = hashlib.sha256()
+        self.pending = {}
+        self.next_range = 0
+        self.written_ranges = 0
+        self.written = 0
+        self.error = None
+        self.spool = None
+        self.start_time = None
+
+    # Start the download - returns False if the server does not support range requests
+    def start(self):
+        import requests
+
+        rslt = requests.head(self.url, allow_redirects=True, timeout=FWSERVER_TIMEOUT)
+        if rslt.status_code != 200:
+            raise DownloadError(f'Cannot download {self.url}: {rslt.status_code}')
+        if rslt.headers.get('Accept-Ranges') != 'bytes' or 'Content-Length' not in rslt.headers:
+            logger.info(f'Server does not support range requests for {self.url}')
+            return False
+
+        self.size = int(rslt.headers['Content-Length'])
+        self.etag = rslt.headers.get('ETag')
+        self.last_modified = rslt.headers.get('Last-Modified')
+        self.num_ranges = (self.size + self.range_size - 1) // self.range_size
+
+        self.spool = self.cache.spool_file() if self.cache else tempfile.TemporaryFile()
+        self.start_time = time.time()
+        logger.info(f'Streaming {self.size}b from {self.url} in {self.num_ranges} ranges')
+        for _ in range(min(self.workers, self.num_ranges)):
+            threading.Thread(target=self._worker, daemon=True).start()
+        return True
+
+    def __len__(self):
+        return self.size
+
+    # Wait until the file has been downloaded up to 'offset' (must hold self.cond)
+    def _await_written(self, offset):
+        while self.written < offset and not self.error:
+            self.cond.wait()
+        if self.written < offset:
+            raise DownloadError(f'Download of {self.url} failed: {self.error}')
+
+    def __getitem__(self, key):
+        start, stop, step = key.indices(self.size)
+        assert step == 1
+        with self.cond:
+            self._await_written(stop)
+            self.spool.seek(start)
+            return self.spool.read(stop - start)
+
+    @property
+    def complete(self):
+        with self.cond:
+            return self.written == self.size
+
+    # Get the hash of the file - waiting for the download to complete
+    def digest(self):
+        with self.cond:
+            self._await_written(self.size)
+            return self.sha.digest()
+
+    def _fetch_range(self, session, index):
+        import requests
+
+        start = index * self.range_size
+        end = min(start + self.range_size, self.size) - 1
+        headers = {'Range': f'bytes={start}-{end}'}
+        if self.etag or self.last_modified:
+            headers['If-Range'] = self.etag or self.last_modified
+
+        for attempt in range(RANGE_RETRIES):
+            try:
+                rslt = session.get(self.url, headers=headers, timeout=FWSERVER_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f'Range {start}-{end} of {self.url} failed: {e}')
+                continue
+
+            # Anything other than the requested range implies the file has changed
+            if rslt.status_code != 206 or len(rslt.content) != end + 1 - start:
+                raise DownloadError(f'Unexpected reply to range request: {rslt.status_code} '
+                                    f'with {len(rslt.content)}b - has the file changed?')
+            return rslt.content
+
+        raise DownloadError(f'Failed to download range {start}-{end}')
+
+    def _worker(self):
+        import requests
+
+        with requests.Session() as session:
+            while True:
+                # Fetch the next range, unless too far ahead of the data written out
+                with self.cond:
+                    while not self.error and self.next_range < self.num_ranges and \
+                            self.next_range >= self.written_ranges + RANGES_AHEAD:
+                        self.cond.wait()
+                    if self.error or self.next_range >= self.num_ranges:
+                        return
+                    index = self.next_range
+                    self.next_range += 1
+
+                try:
+                    data = self._fetch_range(session, index)
+                except Exception as e:
+                    logger.error(f'Download of {self.url} failed: {e}')
+                    with self.cond:
+                        self.error = self.error or e
+                        self._discard_spool()
+                        self.cond.notify_all()
+                    return
+
+                # Hash and write out any ranges now available in order
+                with self.cond:
+                    self.pending[index] = data
+                    while self.written_ranges in self.pending:
+                        data = self.pending.pop(self.written_ranges)
+                        self.sha.update(data)
+                        self.spool.seek(0, os.SEEK_END)
+                        self.spool.write(data)
+                        self.written_ranges += 1
+                        self.written += len(data)
+
+                    if self.written == self.size:
+                        self._finish()
+                    self.cond.notify_all()
+
+    def _finish(self):
+        self.spool.flush()
+        secs = time.time() - self.start_time
+        logger.info(f'Downloaded {self.size}b in {secs:.2f}s ({self.size / secs:.2f} b/s)')
+        if self.cache:
+            try:
+                self.cache.put_file(self.name, self.spool.name, self.sha.hexdigest(), self.size,
+                                    self.etag, self.last_modified)
+            except OSError as e:
+                logger.warning(f'Failed to cache {self.url}: {e}')
+
+    def _discard_spool(self):
+        if self.cache and self.spool:
+            with contextlib.suppress(OSError):
+                os.remove(self.spool.name)
+
+
+# Compresses a local firmware file in a background thread, in a single pass (see
+# fwprep.stream_compressed_firmware_image()), so compression overlaps connecting to (and
+# authenticating with) the hw.  Supports len() and slicing as for StreamedDownload - but as
+# the hw needs the compressed size when the ota starts, these wait for compression to finish.
+class StreamedCompression:
+    def __init__(self, fwfilename, outputdir=None):
+        self.sha = hashlib.sha256()
+        self.data = bytearray()
+        self.error = None
+        self.done = threading.Event()
+        threading.Thread(target=self._compress, args=(fwfilename, outputdir), daemon=True).start()
+
+    def _compress(self, fwfilename, outputdir):
+        try:
+            for chunk in fwprep.stream_compressed_firmware_image(fwfilename, self.sha, outputdir):
+                self.data += chunk
+        except Exception as e:
+            logger.error(f'Compression of {fwfilename} failed: {e}')
+            self.error = e
+        finally:
+            self.done.set()
+
+    def _await_done(self):
+        self.done.wait()
+        if self.error:
+            raise self.error
+
+    def __len__(self):
+        self._await_done()
+        return len(self.data)
+
+    def __getitem__(self, key):
+        self._await_done()
+        return bytes(self.data[key])
+
+    def digest(self):
+        self._await_done()
+        return self.sha.digest()
+
+
+# Get the named file from the firmware server as a started StreamedDownload, so it can be
+# uploaded while it downloads - or as bytes if it is already cached (or the server does not
+# support range requests).
+def stream_file(name, cache=None):
+    if cache and (cache.offline or cache.lookup(name) is not None):
+        return cache.get(name)
+
+    download = StreamedDownload(name, cache)
+    return download if download.start() else fetch_file(name, cache)
+
+
+# Download firmware file from Firmware Server (via the local cache, if passed)
+# If 'stream' is set (and not writing a compressed copy) the firmware is returned as a
+# StreamedDownload (unless cached), so the ota can start before the download completes.
+def download_file(hw_target, write_compressed, index_file, auto_select_fw, cache=None,
+                  stream=False):
     # GET the index file from the firmware server which lists the
     # available firmwares
     url = f'{FWSERVER_URL_ROOT}/{hw_target}/{index_file}'
     logger.info(f'Downloading firmware index file {url}')
-    rslt = requests.get(url)
-    assert rslt.status_code == 200, f'Cannot download index file {url}: {rslt.status_code}'
+    fwindex = fetch_file(f'{hw_target}/{index_file}', cache)
+    assert fwindex is not None, f'Cannot download index file {url}'
 
     # Get the filename of the firmware to download
-    fwname = get_fw_filename(rslt.text, auto_select_fw)
+    fwname = get_fw_filename(fwindex.decode(), auto_select_fw)
     fwlen = get_expected_fw_length(fwname)
 
     # GET the selected firmware from the server
     url = f'{FWSERVER_URL_ROOT}/{hw_target}/{fwname}'
-    logger.info(f'Downloading firmware {url}')
-    rslt = requests.get(f'{FWSERVER_URL_ROOT}/{hw_target}/{fwname}')
-    assert rslt.status_code == 200, f'Cannot download firmware file {url}: {rslt.status_code}'
-
-    fwcmp = rslt.content
-    logger.info(f'Downloaded {len(fwcmp)} byte firmware')
+    if stream and not write_compressed:
+        logger.info(f'Streaming firmware {url}')
+        fwcmp = stream_file(f'{hw_target}/{fwname}', cache)
+    else:
+        logger.info(f'Downloading firmware {url}')
+        fwcmp = fetch_file(f'{hw_target}/{fwname}', cache)
+    assert fwcmp is not None, f'Cannot download firmware file {url}'
+    if not isinstance(fwcmp, StreamedDownload):
+        logger.info(f'Downloaded {len(fwcmp)} byte firmware')
 
     # If passed --write-compressed we write a copy of the compressed file
     if write_compressed:
         write_cmpfwfile(fwname, fwcmp)
 
     # Return
-    return fwcmp, fwlen
+    return fwcmp, fwlen, fwname
+
+
+# Download the compressed patch from the given base version to the firmware, if available
+def download_patch(hw_target, fwname, basever, cache=None):
+    patchname = fwprep.get_patch_filename(fwname, basever)
+    url = f'{FWSERVER_URL_ROOT}/{hw_target}/{patchname}'
+    logger.info(f'Downloading patch {url}')
+    patchcmp = fetch_file(f'{hw_target}/{patchname}', cache)
+    if patchcmp is None:
+        logger.info(f'No patch available {url}')
+        return None
+
+    logger.info(f'Downloaded {len(patchcmp)} byte patch')
+    return patchcmp
 
 
 # Download firmware file from Firmware Server using GDK
-def download_file_gdk(hw_target, write_compressed, index_file, auto_select_fw):
+# gdk does not expose the response headers needed to revalidate cached files, so if a cache
+# is passed the index is only read from it if it cannot be downloaded, and firmware files
+# (whose names are unique to their content) are used from the cache if present.
+def download_file_gdk(hw_target, write_compressed, index_file, auto_select_fw, cache=None):
     import greenaddress as gdk
     import base64
-    import json
 
     # We need to pass the relevant root certificate
     with open(FWSERVER_CERTIFICATE_FILE, 'r') as cf:
@@ -141,53 +602,77 @@ def download_file_gdk(hw_target, write_compressed, index_file, auto_select_fw):
               'urls': [url]}
     rslt = gdk.http_request(session.session_obj, json.dumps(params))
     rslt = json.loads(rslt)
-    assert 'body' in rslt, f'Cannot download index file {url}: {rslt.get("error")}'
+    if 'body' in rslt:
+        fwindex = rslt['body']
+        if cache:
+            cache.put(f'{hw_target}/{index_file}', fwindex.encode())
+    else:
+        cached = cache.lookup(f'{hw_target}/{index_file}') if cache else None
+        assert cached is not None, f'Cannot download index file {url}: {rslt.get("error")}'
+        logger.warning(f'Cannot download index file {url}, using cached copy')
+        fwindex = cached.decode()
 
     # Get the filename of the firmware to download
-    fwname = get_fw_filename(rslt['body'], auto_select_fw)
+    fwname = get_fw_filename(fwindex, auto_select_fw)
     fwlen = get_expected_fw_length(fwname)
 
     # GET the selected firmware from the server in base64 encoding
     url = f'{FWSERVER_URL_ROOT}/{hw_target}/{fwname}'
-    logger.info(f'Downloading firmware {url} using gdk')
-    params['urls'] = [url]
-    params['accept'] = 'base64'
+    fwcmp = cache.lookup(f'{hw_target}/{fwname}') if cache else None
+    if fwcmp is not None:
+        logger.info(f'Using cached firmware {url}')
+    else:
+        logger.info(f'Downloading firmware {url} using gdk')
+        params['urls'] = [url]
+        params['accept'] = 'base64'
 
-    rslt = gdk.http_request(session.session_obj, json.dumps(params))
-    rslt = json.loads(rslt)
-    assert 'body' in rslt, f'Cannot download firmware file {url}: {rslt.get("error")}'
+        rslt = gdk.http_request(session.session_obj, json.dumps(params))
+        rslt = json.loads(rslt)
+        assert 'body' in rslt, f'Cannot download firmware file {url}: {rslt.get("error")}'
 
-    fw_b64 = rslt['body']
-    fwcmp = base64.b64decode(fw_b64)
-    logger.info('Downloaded {len(fwcmp)} byte firmware')
+        fw_b64 = rslt['body']
+        fwcmp = base64.b64decode(fw_b64)
+        logger.info(f'Downloaded {len(fwcmp)} byte firmware')
+        if cache:
+            cache.put(f'{hw_target}/{fwname}', fwcmp)
 
     # If passed --write-compressed we write a copy of the compressed file
     if write_compressed:
         write_cmpfwfile(fwname, fwcmp)
 
     # Return
-    return fwcmp, fwlen
+    return fwcmp, fwlen, fwname
 
 
 # Use a local firmware file - uses the uncompressed firmware file and can
 # either deduce the compressed firmware filename to use, or can create it.
-def get_local_fwfile(fwfilename, write_compressed):
+# If 'stream' is set and the compressed file is to be created (or does not exist) the
+# firmware is instead compressed in the background, returning a StreamedCompression - and
+# the compressed file is only written if 'write_compressed' is set.
+def get_local_fwfile(fwfilename, write_compressed, stream=False):
     # Load the uncompressed firmware file
     assert os.path.exists(fwfilename) and os.path.isfile(
             fwfilename), f'Uncompressed firmware file not found: {fwfilename}'
 
-    logger.info(f'Reading file: {fwfilename}')
-    with open(fwfilename, 'rb') as fwfile:
-        firmware = fwfile.read()
-    fwlen = len(firmware)
-
-    # Use fwprep to deduce the filename used for the compressed firmware
-    cmpfilename = fwprep.get_compressed_filepath(firmware, COMP_FW_DIR)
+    # Use fwprep to deduce the filename used for the compressed firmware - mapping the
+    # file rather than reading it, as if streaming the compression it need not be read here
+    with open(fwfilename, 'rb') as fwfile, \
+            contextlib.closing(mmap.mmap(fwfile.fileno(), 0, access=mmap.ACCESS_READ)) as firmware:
+        fwlen = len(firmware)
+        cmpfilename = fwprep.get_compressed_filepath(firmware, COMP_FW_DIR)
     expected_suffix = f'_{fwlen}_fw.bin'
     assert cmpfilename.endswith(expected_suffix)
 
+    if stream and (write_compressed or not os.path.isfile(cmpfilename)):
+        logger.info('Compressing firmware')
+        fwcmp = StreamedCompression(fwfilename, COMP_FW_DIR if write_compressed else None)
+        return fwcmp, fwlen, cmpfilename
+
     # If passed --write-compressed we create the compressed file now
     if write_compressed:
+        logger.info(f'Reading file: {fwfilename}')
+        with open(fwfilename, 'rb') as fwfile:
+            firmware = fwfile.read()
         logger.info('Writing compressed firmware file')
         fwprep.create_compressed_firmware_image(firmware, COMP_FW_DIR)
 
@@ -198,12 +683,82 @@ def get_local_fwfile(fwfilename, write_compressed):
     with open(cmpfilename, 'rb') as cmpfile:
         fwcmp = cmpfile.read()
 
-    return fwcmp, fwlen
+    return fwcmp, fwlen, cmpfilename
+
+
+# Read the local compressed patch from the given base version to the compressed
+# firmware file, if present (see fwprep.py to create)
+def get_local_patch(cmpfilename, basever):
+    patchfilename = fwprep.get_patch_filename(cmpfilename, basever)
+    if not os.path.isfile(patchfilename):
+        logger.info(f'No patch file found: {patchfilename}')
+        return None
+
+    logger.info(f'Reading file: {patchfilename}')
+    with open(patchfilename, 'rb') as patchfile:
+        return patchfile.read()
+
+
+# Auto-tunes the ota chunk size from the measured throughput - starting at the hw
+# default, doubles the chunk size (up to the size granted by the hw) while that improves
+# the throughput, then settles on the best size seen.
+class ChunkSizeTuner:
+    # Measure the throughput of each chunk size over at least this much data
+    SAMPLE_BYTES = 32 * 1024
+    # Required improvement to keep increasing the chunk size
+    MIN_IMPROVEMENT = 1.05
+
+    def __init__(self, initial_size):
+        self.size = initial_size
+        self.best_size = initial_size
+        self.best_rate = 0
+        self.tuning = True
+        self.sample_bytes = 0
+        self.sample_secs = 0
+        self.max_size = None
+
+    # Called by JadeAPI.ota_update() with the granted chunk size, to get the next chunk size
+    def __call__(self, max_size):
+        self.max_size = max_size
+        self.size = min(self.size, max_size)
+        return self.size
+
+    # Record the time taken to upload a chunk
+    def record(self, length, secs):
+        # Only measure chunks of the current size (not any sent before the last change)
+        if not self.tuning or length != self.size:
+            return
+
+        self.sample_bytes += length
+        self.sample_secs += secs
+        if self.sample_bytes < max(self.SAMPLE_BYTES, self.size * 2):
+            return
+
+        rate = self.sample_bytes / self.sample_secs
+        logger.info(f'Chunk size {self.size}b: {rate:.2f} b/s')
+        self.sample_bytes = 0
+        self.sample_secs = 0
+
+        if rate > self.best_rate * self.MIN_IMPROVEMENT:
+            self.best_size, self.best_rate = self.size, rate
+            if self.max_size and self.size < self.max_size:
+                self.size = min(self.size * 2, self.max_size)
+                return
+
+        self.size = self.best_size
+        self.tuning = False
+        logger.info(f'Using chunk size {self.size}b')
 
 
 # Takes the compressed firmware data, and the expected length of the
 # uncompressed firmware image.
-def ota(jade, fwcompressed, fwlength, pushmnemonic, authnetwork):
+# 'window' is the number of chunks to keep in flight (1 for stop-and-wait).
+# 'get_patch' is an optional function to get the compressed patch from the given (running)
+# firmware version to the new firmware - if available it is uploaded instead (if supported).
+# 'progress' is an optional callback(written, compressed_size) to report the upload progress
+# (initially with the offset the upload starts from) instead of logging each chunk.
+def ota(jade, fwcompressed, fwlength, pushmnemonic, authnetwork, window=DEFAULT_OTA_WINDOW,
+        max_chunksize=DEFAULT_MAX_OTA_CHUNK, get_patch=None, progress=None):
     info = jade.get_version_info()
     logger.info(f'Running OTA on: {info}')
     has_pin = info['JADE_HAS_PIN']
@@ -213,6 +768,23 @@ def ota(jade, fwcompressed, fwlength, pushmnemonic, authnetwork):
     chunksize = int(info['JADE_OTA_MAX_CHUNK'])
     assert chunksize > 0
 
+    # Only keep several chunks in flight if the hw supports it
+    features = info.get('JADE_FEATURES', '').split(',')
+    if window > 1 and 'OTAWINDOW' not in features:
+        logger.info('Hw does not support windowed ota upload - sending one chunk at a time')
+        window = 1
+
+    # Use a patch against the running firmware if the hw supports it and one is available
+    fwdata, patch = fwcompressed, False
+    if get_patch and 'DELTA' in features:
+        patchcmp = get_patch(info['JADE_VERSION'])
+        if patchcmp:
+            logger.info(f'Using {len(patchcmp)} byte patch from version {info["JADE_VERSION"]}')
+            fwdata, patch = patchcmp, True
+
+    # If allowed larger chunks, tune the chunk size as the upload proceeds
+    tuner = ChunkSizeTuner(chunksize) if max_chunksize and max_chunksize > chunksize else None
+
     # Can set the mnemonic in debug, to ensure OTA is allowed
     if pushmnemonic:
         ret = jade.set_mnemonic(TEST_MNEMONIC)
@@ -221,31 +793,66 @@ def ota(jade, fwcompressed, fwlength, pushmnemonic, authnetwork):
         ret = jade.auth_user(authnetwork)
         assert ret is True
 
+    # The hash of a streamed download is only known once it completes - until then it is
+    # passed with ota_complete (see JadeAPI.ota_update()).  A streamed compression must
+    # complete before the upload starts anyway (as the hw needs the compressed size).
+    cmphash = None
+    if isinstance(fwdata, StreamedDownload):
+        cmphash = fwdata.digest() if fwdata.complete else fwdata.digest
+    elif isinstance(fwdata, StreamedCompression):
+        cmphash = fwdata.digest()
+
     start_time = time.time()
     last_time = start_time
+    start_offset = None
     last_written = 0
+    num_chunks = 0
 
-    # Callback to log progress
+    # Callback to log progress, and the timing of each chunk
     def _log_progress(written, compressed_size):
         nonlocal last_time
+        nonlocal start_offset
         nonlocal last_written
+        nonlocal num_chunks
 
         current_time = time.time()
+        if progress:
+            progress(written, compressed_size)
+
+        # Initial call, with the offset the upload starts from (ie. if resumed)
+        if start_offset is None:
+            if written:
+                logger.info(f'Resuming upload from {written}b')
+            start_offset = written
+            last_time = current_time
+            last_written = written
+            return
+
         secs = current_time - last_time
         total_secs = current_time - start_time
         bytes_ = written - last_written
+        num_chunks += 1
         last_rate = bytes_ / secs
-        avg_rate = written / total_secs
-        progress = (written / compressed_size) * 100
+        avg_rate = (written - start_offset) / total_secs
+        percent = (written / compressed_size) * 100
         secs_remaining = (compressed_size - written) / avg_rate
-        template = '{0:.2f} b/s - progress {1:.2f}% - {2:.2f} seconds left'
-        logger.info(template.format(last_rate, progress, secs_remaining))
-        logger.info('Written {0}b in {1:.2f}s'.format(written, total_secs))
+        if not progress:
+            logger.info(f'Chunk {num_chunks}: {bytes_}b in {secs * 1000:.1f}ms '
+                        f'({last_rate:.2f} b/s)')
+            template = '{0:.2f} b/s - progress {1:.2f}% - {2:.2f} seconds left'
+            logger.info(template.format(avg_rate, percent, secs_remaining))
+            logger.info('Written {0}b in {1:.2f}s'.format(written, total_secs))
+
+        if tuner:
+            tuner.record(bytes_, secs)
 
         last_time = current_time
         last_written = written
 
-    result = jade.ota_update(fwcompressed, fwlength, chunksize, _log_progress)
+    # Limit hw logging during the upload (no need to restore as the hw reboots)
+    with jade.quiet_logs(restore=False):
+        result = jade.ota_update(fwdata, fwlength, chunksize, _log_progress, window,
+                                 max_chunksize, tuner, patch, cmphash)
     assert result is True
 
     logger.info(f'Total ota time in secs: {time.time() - start_time}')
@@ -257,6 +864,181 @@ def ota(jade, fwcompressed, fwlength, pushmnemonic, authnetwork):
     return has_radio, id
 
 
+# Runs the ota, reconnecting (with the passed 'connect' function) and resuming the upload
+# if it is interrupted - eg. by the connection dropping - up to 'retries' times.
+# 'on_retry' is an optional callback(attempt, error) called before each retry.
+def resumable_ota(connect, retries, *args, on_retry=None):
+    attempt = 0
+    while True:
+        try:
+            with connect() as jade:
+                return ota(jade, *args)
+        except JadeError as e:
+            if attempt >= retries or e.data not in RESUMABLE_OTA_ERRORS:
+                raise
+            logger.warning(f'OTA interrupted: {e}')
+            error = e
+        except (EOFError, OSError) as e:
+            if attempt >= retries:
+                raise
+            logger.warning(f'OTA connection lost: {e}')
+            error = e
+
+        attempt += 1
+        if on_retry:
+            on_retry(attempt, error)
+        logger.info(f'Reconnecting to resume OTA (retry {attempt} of {retries})')
+        time.sleep(RECONNECT_DELAY)
+
+
+# Get the firmware version from a compressed firmware (or patch) filename
+def get_fw_version(fwname):
+    return os.path.basename(fwname).split('_')[0]
+
+
+# Aggregates the upload progress of the devices in a fleet ota, and logs the combined
+# progress and throughput (at most every FLEET_PROGRESS_INTERVAL seconds).
+class FleetProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.start_time = time.time()
+        self.last_log = self.start_time
+
+    # Total bytes uploaded to all devices (excluding any skipped when resuming)
+    def uploaded(self):
+        with self.lock:
+            return sum(device['uploaded'] for device in self.devices.values())
+
+    # Called from the per-device ota threads, as each chunk is acknowledged
+    def update(self, name, written, total):
+        with self.lock:
+            device = self.devices.setdefault(name, {'written': written, 'uploaded': 0})
+            device['uploaded'] += max(written - device['written'], 0)
+            device['written'] = written
+            device['total'] = total
+
+            current_time = time.time()
+            if current_time - self.last_log < FLEET_PROGRESS_INTERVAL:
+                return
+            self.last_log = current_time
+
+            written = sum(device['written'] for device in self.devices.values())
+            total = sum(device['total'] for device in self.devices.values())
+            uploaded = sum(device['uploaded'] for device in self.devices.values())
+            rate = uploaded / (current_time - self.start_time)
+            logger.info(f'Fleet: {len(self.devices)} devices uploading, progress '
+                        f'{written * 100 / total:.2f}% - {rate:.2f} b/s aggregate')
+
+
+# Runs the ota on one device in a fleet ota, unless it is already running the target version.
+# Returns a dict describing the outcome - status 'updated', 'skipped' or 'failed', the number
+# of retries (ie. resumes), the errors which interrupted the upload, and the time taken.
+def fleet_ota_device(device, target_version, reflash, retries, progress, *args):
+    name = device['name']
+    threading.current_thread().name = name
+    result = {'name': name, 'status': None, 'retries': 0, 'errors': []}
+    start_time = time.time()
+
+    def _on_retry(attempt, error):
+        result['retries'] = attempt
+        result['errors'].append(str(error))
+
+    try:
+        version = device.get('version')
+        if not reflash and version is None:
+            with device['connect']() as jade:
+                version = jade.get_version_info()['JADE_VERSION']
+
+        if not reflash and version == target_version:
+            logger.info(f'Already running version {version} - skipping')
+            result['status'] = 'skipped'
+        else:
+            resumable_ota(device['connect'], retries, *args,
+                          functools.partial(progress.update, name), on_retry=_on_retry)
+            result['status'] = 'updated'
+    except Exception as e:
+        logger.error(f'OTA failed: {e}')
+        result['status'] = 'failed'
+        result['errors'].append(str(e))
+
+    result['secs'] = time.time() - start_time
+    return result
+
+
+def log_fleet_results(results, uploaded, secs):
+    counts = {status: sum(r['status'] == status for r in results)
+              for status in ['updated', 'skipped', 'failed']}
+    logger.info(f'Fleet OTA of {len(results)} devices in {secs:.2f}s: {counts["updated"]} '
+                f'updated, {counts["skipped"]} skipped, {counts["failed"]} failed')
+    logger.info(f'Uploaded {uploaded}b - {uploaded / secs:.2f} b/s aggregate')
+
+    for result in results:
+        retries = f' after {result["retries"]} retries' if result['retries'] else ''
+        msg = f'  {result["name"]}: {result["status"]}{retries} in {result["secs"]:.2f}s'
+        if result['status'] == 'failed':
+            logger.error(f'{msg} - {result["errors"][-1]}')
+        else:
+            logger.info(msg)
+        for error in result['errors'][:result['retries']]:
+            logger.info(f'    interrupted: {error}')
+
+
+# Runs the ota on many devices concurrently - each is a dict with a 'name' for logging, a
+# 'connect' function to create the JadeAPI, and optionally the 'version' running (if known).
+# The firmware (and any patches) are shared between all devices.
+# Devices already running 'target_version' are skipped unless 'reflash' is set.
+# Returns the list of per-device results (see fleet_ota_device()).
+def fleet_ota(devices, target_version, reflash, retries, fwcompressed, fwlength,
+              pushmnemonic, authnetwork, window, max_chunksize, get_patch):
+    # Only fetch each patch once, however many devices are running its base version
+    if get_patch:
+        get_patch = functools.lru_cache(maxsize=None)(get_patch)
+
+    # Prefix log lines with the device they relate to
+    jadehandler.setFormatter(logging.Formatter('%(threadName)s: %(message)s'))
+
+    progress = FleetProgress()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        futures = [executor.submit(fleet_ota_device, device, target_version, reflash, retries,
+                                   progress, fwcompressed, fwlength, pushmnemonic, authnetwork,
+                                   window, max_chunksize, get_patch)
+                   for device in devices]
+        results = [future.result() for future in futures]
+
+    log_fleet_results(results, progress.uploaded(), time.time() - progress.start_time)
+    return results
+
+
+# Get the devices for a fleet ota, from the passed serial ports and ble ids, and/or by
+# discovering attached serial devices and advertising ble devices.
+def get_fleet_devices(serialports, bleids, discover):
+    from jadepy import discovery
+
+    devices = [{'name': port, 'connect': functools.partial(JadeAPI.create_serial, device=port)}
+               for port in serialports or []]
+
+    if 'serial' in discover:
+        known = set(serialports or [])
+        for entry in discovery.probe_ports().values():
+            if entry['port'] not in known:
+                devices.append({'name': entry['port'], 'version': entry['JADE_VERSION'],
+                                'connect': functools.partial(JadeAPI.create_serial,
+                                                             device=entry['port'])})
+
+    bleids = list(bleids or [])
+    if 'ble' in discover:
+        bleids.extend(bleid for bleid in discovery.discover_ble() if bleid not in bleids)
+
+    # Each BLE device is driven from its own thread, so needs its own loop
+    def _create_ble(bleid):
+        return JadeAPI.create_ble(serial_number=bleid, loop=asyncio.new_event_loop())
+
+    devices.extend({'name': f'BLE {bleid}', 'connect': functools.partial(_create_ble, bleid)}
+                   for bleid in bleids)
+    return devices
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
@@ -339,6 +1121,38 @@ if __name__ == '__main__':
                         dest='autoselectfw',
                         help='Index of firmware to download (skips interactive prompt)',
                         default=None)
+    parser.add_argument('--fwserver-url',
+                        action='store',
+                        dest='fwserverurl',
+                        help='Root url of the firmware server (or a mirror of it)',
+                        default=FWSERVER_URL_ROOT)
+    parser.add_argument('--fw-cache-dir',
+                        action='store',
+                        dest='fwcachedir',
+                        help='Directory of the local (and possibly shared) download cache',
+                        default=DEFAULT_FW_CACHE_DIR)
+    parser.add_argument('--fw-cache-size',
+                        action='store',
+                        type=int,
+                        dest='fwcachesize',
+                        help='Maximum size of the download cache in MB',
+                        default=DEFAULT_FW_CACHE_SIZE_MB)
+    cachegrp = parser.add_mutually_exclusive_group()
+    cachegrp.add_argument('--no-fw-cache',
+                          action='store_true',
+                          dest='nofwcache',
+                          help='Do not use the download cache',
+                          default=False)
+    cachegrp.add_argument('--offline',
+                          action='store_true',
+                          dest='offline',
+                          help='Only use cached downloads - do not contact the firmware server',
+                          default=False)
+    parser.add_argument('--no-stream',
+                        action='store_true',
+                        dest='nostream',
+                        help='Download (or compress) the whole firmware before starting the ota',
+                        default=False)
     parser.add_argument('--beta',
                         action='store_const',
                         const='BETA',
@@ -352,6 +1166,54 @@ if __name__ == '__main__':
                         dest='writecompressed',
                         help='Create/write copy of compressed firmware file',
                         default=False)
+    parser.add_argument('--window',
+                        action='store',
+                        type=int,
+                        dest='window',
+                        help='Number of ota chunks to keep in flight (1 awaits each reply in turn)',
+                        default=DEFAULT_OTA_WINDOW)
+    parser.add_argument('--max-chunk-size',
+                        action='store',
+                        type=int,
+                        dest='maxchunksize',
+                        help='Largest ota chunk size to request (0 uses the hw default size)',
+                        default=DEFAULT_MAX_OTA_CHUNK)
+    parser.add_argument('--retries',
+                        action='store',
+                        type=int,
+                        dest='retries',
+                        help='Number of times to reconnect and resume an interrupted ota',
+                        default=DEFAULT_OTA_RETRIES)
+    parser.add_argument('--no-delta',
+                        action='store_true',
+                        dest='nodelta',
+                        help='Upload the full firmware, not a patch against the running firmware',
+                        default=False)
+
+    # Fleet mode - ota many devices concurrently
+    parser.add_argument('--fleet-serialports',
+                        action='store',
+                        nargs='+',
+                        dest='fleetserialports',
+                        help='Serial ports of devices to OTA concurrently',
+                        default=None)
+    parser.add_argument('--fleet-bleids',
+                        action='store',
+                        nargs='+',
+                        dest='fleetbleids',
+                        help='BLE serial numbers or ids of devices to OTA concurrently',
+                        default=None)
+    parser.add_argument('--fleet-discover',
+                        action='append',
+                        dest='fleetdiscover',
+                        help='Discover attached serial and/or advertising BLE devices to OTA',
+                        choices=['serial', 'ble'],
+                        default=[])
+    parser.add_argument('--reflash',
+                        action='store_true',
+                        dest='reflash',
+                        help='OTA fleet devices already running the firmware version',
+                        default=False)
     parser.add_argument('--log',
                         action='store',
                         dest='loglevel',
@@ -364,6 +1226,10 @@ if __name__ == '__main__':
     logger.debug(f'args: {args}')
     manage_agents = args.agentkeyfile and not args.skipble and not args.noagent
     downloading = args.downloadfw or args.downloadgdk
+    fleet = args.fleetserialports or args.fleetbleids or args.fleetdiscover
+    if fleet:
+        manage_agents = args.agentkeyfile and not args.noagent and \
+            (args.fleetbleids or 'ble' in args.fleetdiscover)
 
     if args.skipserial and args.skipble:
         logger.error('Can only skip one of Serial or BLE test, not both!')
@@ -373,6 +1239,14 @@ if __name__ == '__main__':
         logger.error('Can only supply ble-id when skipping serial tests')
         sys.exit(1)
 
+    if fleet and (args.skipserial or args.skipble or args.bleid):
+        logger.error('Cannot skip serial/BLE or supply ble-id in fleet mode')
+        sys.exit(1)
+
+    if args.reflash and not fleet:
+        logger.error('Can only request reflash in fleet mode')
+        sys.exit(1)
+
     if args.autoselectfw and not downloading:
         logger.error('Can only provide auto-select index when downloading fw from server')
         sys.exit(1)
@@ -385,6 +1259,10 @@ if __name__ == '__main__':
         logger.error('Can only supply hardware target when downloading fw from server')
         sys.exit(1)
 
+    if (args.offline or args.nofwcache) and not downloading:
+        logger.error('Can only use offline/no cache options when downloading fw from server')
+        sys.exit(1)
+
     if downloading and not args.hwtarget:
         args.hwtarget = 'jade'  # default to prod jade
 
@@ -392,16 +1270,33 @@ if __name__ == '__main__':
         args.indexfile = 'LATEST'  # default to stable versions
 
     # Get the file to OTA
-    if args.downloadfw:
-        fwcmp, fwlen = download_file(args.hwtarget, args.writecompressed,
-                                     args.indexfile, args.autoselectfw)
+    # (and how to get a patch from the running firmware, where supported)
+    FWSERVER_URL_ROOT = args.fwserverurl.rstrip('/')
+    cache = None
+    if downloading and not args.nofwcache:
+        cache = FirmwareCache(args.fwcachedir, args.fwcachesize * 1024 * 1024, args.offline)
+
+    # (nb. offline downloads are served from the cache, so need not go via gdk)
+    if args.downloadfw or (args.downloadgdk and args.offline):
+        fwcmp, fwlen, fwname = download_file(args.hwtarget, args.writecompressed,
+                                             args.indexfile, args.autoselectfw, cache,
+                                             not args.nostream)
+        get_patch = functools.partial(download_patch, args.hwtarget, fwname, cache=cache)
     elif args.downloadgdk:
-        fwcmp, fwlen = download_file_gdk(args.hwtarget, args.writecompressed,
-                                         args.indexfile, args.autoselectfw)
+        fwcmp, fwlen, fwname = download_file_gdk(args.hwtarget, args.writecompressed,
+                                                 args.indexfile, args.autoselectfw, cache)
+        get_patch = None
     else:
-        fwcmp, fwlen = get_local_fwfile(args.fwfilename, args.writecompressed)
+        fwcmp, fwlen, fwname = get_local_fwfile(args.fwfilename, args.writecompressed,
+                                                not args.nostream)
+        get_patch = functools.partial(get_local_patch, fwname)
+
+    if args.nodelta:
+        get_patch = None
 
-    logger.info(f'Got fw file of length {len(fwcmp)} with expected uncompressed length {fwlen}')
+    # (nb. the length of a streamed compression is not known until it completes)
+    if not isinstance(fwcmp, StreamedCompression):
+        logger.info(f'Got fw file of length {len(fwcmp)} with expected uncompressed length {fwlen}')
 
     # If ble, start the agent to supply the required passkey for authentication
     # and encryption - don't bother if not.
@@ -412,18 +1307,37 @@ if __name__ == '__main__':
         btagent = start_agent(args.agentkeyfile)
 
     try:
+        if fleet:
+            devices = get_fleet_devices(args.fleetserialports, args.fleetbleids,
+                                        args.fleetdiscover)
+            if not devices:
+                logger.error('No devices found for fleet OTA')
+                sys.exit(1)
+
+            logger.info(f'Jade fleet OTA of {len(devices)} devices')
+            results = fleet_ota(devices, get_fw_version(fwname), args.reflash, args.retries,
+                                fwcmp, fwlen, args.pushmnemonic, args.authnetwork,
+                                args.window, args.maxchunksize, get_patch)
+            if any(result['status'] == 'failed' for result in results):
+                sys.exit(1)
+            sys.exit(0)
+
         has_radio = True
         bleid = args.bleid
         if not args.skipserial:
             logger.info(f'Jade OTA over serial {args.serialport}')
-            with JadeAPI.create_serial(device=args.serialport) as jade:
-                has_radio, bleid = ota(jade, fwcmp, fwlen, args.pushmnemonic, args.authnetwork)
+            has_radio, bleid = resumable_ota(
+                lambda: JadeAPI.create_serial(device=args.serialport), args.retries,
+                fwcmp, fwlen, args.pushmnemonic, args.authnetwork, args.window, args.maxchunksize,
+                get_patch)
 
         if not args.skipble:
             if has_radio:
                 logger.info(f'Jade OTA over BLE {bleid}')
-                with JadeAPI.create_ble(serial_number=bleid) as jade:
-                    ota(jade, fwcmp, fwlen, args.pushmnemonic, args.authnetwork)
+                resumable_ota(
+                    lambda: JadeAPI.create_ble(serial_number=bleid), args.retries,
+                    fwcmp, fwlen, args.pushmnemonic, args.authnetwork,
+                    args.window, args.maxchunksize, get_patch)
             else:
                 msg = 'Skipping BLE tests - not enabled on the hardware'
                 logger.warning(msg)
@@ -1 +1,2 @@
 from .jade import JadeAPI, JadeError
+from .fleet import JadeFleet
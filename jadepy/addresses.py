@@ -0,0 +1,338 @@
+import os
+import cbor
+import random
+import sqlite3
+import logging
+import threading
+import concurrent.futures
+
+from .jade import JadeError
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# Address parameters per network - mirrors the firmware's utils/network.c
+# (p2pkh prefix, p2sh prefix, bech32 hrp, confidential prefix, blech32 hrp)
+# NOTE: the prefixes are wally's WALLY_ADDRESS_VERSION_* and WALLY_CA_PREFIX_* values,
+# as literals so the module can be imported without wallycore.
+NETWORK_PARAMS = {
+    'mainnet': (0x00, 0x05, 'bc', None, None),
+    'testnet': (0x6f, 0xc4, 'tb', None, None),
+    'regtest': (0x6f, 0xc4, 'bcrt', None, None),
+    'localtest': (0x6f, 0xc4, 'bcrt', None, None),
+    'liquid': (0x39, 0x27, 'ex', 0x0c, 'lq'),
+    'localtest-liquid': (0xeb, 0x4b, 'ert', 0x04, 'el')
+}
+
+# Supported single-sig script variants
+VARIANT_P2PKH = 'pkh(k)'
+VARIANT_P2WPKH = 'wpkh(k)'
+VARIANT_P2WPKH_P2SH = 'sh(wpkh(k))'
+VARIANTS = [VARIANT_P2PKH, VARIANT_P2WPKH, VARIANT_P2WPKH_P2SH]
+
+# Ranges at least this large are derived in a process pool
+PROCESS_POOL_THRESHOLD = 2000
+PROCESS_POOL_CHUNK_SIZE = 500
+
+# Address index defaults
+DEFAULT_INDEX_FILE = os.path.join(os.path.expanduser('~'), '.jade', 'address_index.sqlite')
+DEFAULT_GAP_LIMIT = 20
+DEFAULT_INDEX_BRANCHES = [[0], [1]]  # receive and change
+
+
+def is_liquid(network):
+    return NETWORK_PARAMS[network][3] is not None
+
+
+# Build the scriptpubkey for the passed pubkey and single-sig script variant
+def script_for_pubkey(pubkey, variant):
+    import wallycore as wally
+
+    if variant == VARIANT_P2PKH:
+        return wally.scriptpubkey_p2pkh_from_bytes(pubkey, wally.WALLY_SCRIPT_HASH160)
+    elif variant == VARIANT_P2WPKH:
+        return wally.witness_program_from_bytes(pubkey, wally.WALLY_SCRIPT_HASH160)
+    elif variant == VARIANT_P2WPKH_P2SH:
+        redeem_script = wally.witness_program_from_bytes(pubkey, wally.WALLY_SCRIPT_HASH160)
+        return wally.scriptpubkey_p2sh_from_bytes(redeem_script, wally.WALLY_SCRIPT_HASH160)
+    raise ValueError('Unsupported script variant: {}'.format(variant))
+
+
+# Convert the passed scriptpubkey into an address string (confidential if a
+# blinding key is passed) - mirrors the firmware's utils/address.c
+def script_to_address(network, script, blinding_key=None):
+    import wallycore as wally
+
+    p2pkh_prefix, p2sh_prefix, hrp, ca_prefix, blech32_hrp = NETWORK_PARAMS[network]
+    script_type = wally.scriptpubkey_get_type(script)
+
+    if script_type in (wally.WALLY_SCRIPT_TYPE_P2WPKH, wally.WALLY_SCRIPT_TYPE_P2WSH):
+        address = wally.addr_segwit_from_bytes(script, hrp, 0)
+        if blinding_key:
+            address = wally.confidential_addr_from_addr_segwit(address, hrp, blech32_hrp,
+                                                               blinding_key)
+        return address
+
+    if script_type == wally.WALLY_SCRIPT_TYPE_P2PKH:
+        prefix, script_hash = p2pkh_prefix, script[3:23]
+    elif script_type == wally.WALLY_SCRIPT_TYPE_P2SH:
+        prefix, script_hash = p2sh_prefix, script[2:22]
+    else:
+        raise ValueError('Unsupported script type: {}'.format(script_type))
+
+    address = wally.base58_from_bytes(bytearray([prefix]) + script_hash,
+                                      wally.BASE58_FLAG_CHECKSUM)
+    if blinding_key:
+        address = wally.confidential_addr_from_addr(address, ca_prefix, blinding_key)
+    return address
+
+
+# Derive the scripts for a contiguous range of (unhardened) child indexes of
+# 'branch' below the passed account xpub.  Returns a list of (path, script).
+# NOTE: module-level (and takes base58 xpub) so can be run in a process pool.
+def derive_scripts(xpub, variant, branch, start, count):
+    import wallycore as wally
+
+    account = wally.bip32_key_from_base58(xpub)
+    parent = account
+    if branch:
+        parent = wally.bip32_key_from_parent_path(account, branch, wally.BIP32_FLAG_KEY_PUBLIC)
+
+    results = []
+    for child in range(start, start + count):
+        key = wally.bip32_key_from_parent_path(parent, [child],
+                                               wally.BIP32_FLAG_KEY_PUBLIC |
+                                               wally.BIP32_FLAG_SKIP_HASH)
+        pubkey = wally.bip32_key_get_pub_key(key)
+        results.append((branch + [child], script_for_pubkey(pubkey, variant)))
+    return results
+
+
+#
+# Derives single-sig receive addresses locally from a cached account xpub.
+#
+# The account-level xpub is fetched from the hw once (via get_xpub), then any
+# number of pkh/wpkh/sh(wpkh) addresses below it are derived on the host.
+# Paths passed are relative to the account path, and must be unhardened.
+# NOTE: on liquid networks the blinding key for each script is still fetched
+# from the hw (via get_blinding_key), as the master blinding key never leaves it.
+#
+# 'spot_check_rate' is the fraction (0.0 - 1.0) of derived addresses which
+# are cross-checked against the hw get_receive_address() call.  Note that
+# those calls require the user to confirm the address on the hw screen.
+#
+class JadeAddressDeriver:
+    def __init__(self, jade, network, account_path, variant, spot_check_rate=0.0,
+                 max_workers=None):
+        assert network in NETWORK_PARAMS
+        assert variant in VARIANTS
+        assert 0.0 <= spot_check_rate <= 1.0
+        self.jade = jade
+        self.network = network
+        self.account_path = list(account_path)
+        self.variant = variant
+        self.spot_check_rate = spot_check_rate
+        self.max_workers = max_workers
+        self.xpub = None
+
+    # Fetch (once) the account xpub from the hw
+    def get_account_xpub(self):
+        if self.xpub is None:
+            self.xpub = self.jade.get_xpub(self.network, self.account_path)
+        return self.xpub
+
+    def _to_address(self, script):
+        blinding_key = None
+        if is_liquid(self.network):
+            blinding_key = self.jade.get_blinding_key(script)
+        return script_to_address(self.network, script, blinding_key)
+
+    # Derive the (path, scriptpubkey) tuples for child indexes [start, start+count)
+    # of 'branch' locally
+    def get_scripts(self, branch, start, count):
+        import wallycore as wally
+
+        assert start >= 0 and count > 0
+        assert start + count <= wally.BIP32_INITIAL_HARDENED_CHILD
+        assert all(i < wally.BIP32_INITIAL_HARDENED_CHILD for i in branch), \
+            'Cannot derive hardened paths from account xpub'
+
+        xpub = self.get_account_xpub()
+        branch = list(branch)
+
+        if count < PROCESS_POOL_THRESHOLD:
+            return derive_scripts(xpub, self.variant, branch, start, count)
+
+        scripts = []
+        starts = range(start, start + count, PROCESS_POOL_CHUNK_SIZE)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(derive_scripts, xpub, self.variant, branch, s,
+                                   min(PROCESS_POOL_CHUNK_SIZE, start + count - s))
+                       for s in starts]
+            for future in futures:
+                scripts.extend(future.result())
+        return scripts
+
+    # Derive the (path, address) tuples locally, without any spot-checks
+    def _derive_addresses(self, branch, start, count):
+        return [(path, self._to_address(script))
+                for path, script in self.get_scripts(branch, start, count)]
+
+    # Get the addresses for child indexes [start, start+count) of 'branch'
+    # eg. branch [0] for receive and [1] for change addresses
+    # Returns a list of (relative path, address) tuples.
+    def get_addresses(self, branch, start, count):
+        results = self._derive_addresses(branch, start, count)
+
+        if self.spot_check_rate:
+            for path, address in results:
+                if random.random() < self.spot_check_rate:
+                    self.verify_on_device(path, address)
+
+        return results
+
+    # Get the address for a single path (relative to the account)
+    def get_address(self, path):
+        path = list(path)
+        return self.get_addresses(path[:-1], path[-1], 1)[0][1]
+
+    # Get the hw to generate (and display, for user confirmation) the address
+    # for the passed path - and check it matches the expected address.
+    def verify_on_device(self, path, expected=None):
+        path = list(path)
+        expected = expected or self._derive_addresses(path[:-1], path[-1], 1)[0][1]
+        address = self.jade.get_receive_address(self.network, self.account_path + path,
+                                                variant=self.variant)
+        if address != expected:
+            logger.error('Address mismatch for path {}: device {} host {}'.format(
+                path, address, expected))
+            raise JadeError(1, 'Locally derived address does not match hw',
+                            {'path': path, 'device': address, 'host': expected})
+        return address
+
+
+#
+# Persistent, incremental index of the scripts of a single-sig account, for
+# mapping scriptpubkeys (eg. of tx outputs or prevouts) back to wallet paths
+# in O(1) - eg. to fill the 'change' and input 'path' entries for sign_tx.
+#
+# Takes a JadeAddressDeriver for the account, and indexes the scripts of the
+# passed branches (by default receive [0] and change [1]).  Each branch is kept
+# derived 'gap_limit' addresses beyond the highest index seen used - so as
+# scripts are observed (see observe()) the index extends itself.
+# Scripts are derived locally from the account xpub (via get_xpub).
+#
+# The index is persisted in an sqlite db, keyed by network, variant and account
+# xpub, and loaded into memory when opened.
+#
+class JadeAddressIndex:
+    def __init__(self, deriver, filename=None, gap_limit=None, branches=None):
+        self.deriver = deriver
+        self.filename = filename or DEFAULT_INDEX_FILE
+        self.gap_limit = gap_limit or DEFAULT_GAP_LIMIT
+        self.branches = [list(branch) for branch in (branches or DEFAULT_INDEX_BRANCHES)]
+        self.lock = threading.RLock()
+
+        indexdir = os.path.dirname(self.filename)
+        if indexdir and not os.path.isdir(indexdir):
+            os.makedirs(indexdir)
+
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS scripts ('
+                            'account TEXT, script BLOB, path BLOB, '
+                            'PRIMARY KEY (account, script))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS branches ('
+                            'account TEXT, branch BLOB, derived INTEGER, used INTEGER, '
+                            'PRIMARY KEY (account, branch))')
+
+        self.account = '{}:{}:{}'.format(deriver.network, deriver.variant,
+                                         deriver.get_account_xpub())
+        self._load()
+        self.extend()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _load(self):
+        self.paths = {}
+        for script, path in self.db.execute('SELECT script, path FROM scripts WHERE account = ?',
+                                            (self.account,)):
+            self.paths[bytes(script)] = cbor.loads(path)
+
+        # Per branch: number of children derived, and the number used (highest used + 1)
+        self.derived, self.used = {}, {}
+        for branch, derived, used in self.db.execute('SELECT branch, derived, used FROM branches '
+                                                     'WHERE account = ?', (self.account,)):
+            key = tuple(cbor.loads(branch))
+            self.derived[key], self.used[key] = derived, used
+        logger.info('Loaded {} indexed scripts for {}'.format(len(self.paths), self.account))
+
+    # Ensure each branch is derived 'gap_limit' beyond its highest used index
+    def extend(self):
+        with self.lock, self.db:
+            for branch in self.branches:
+                key = tuple(branch)
+                derived = self.derived.get(key, 0)
+                used = self.used.get(key, 0)
+                required = used + self.gap_limit
+                if derived < required:
+                    logger.debug('Indexing {} scripts for branch {}'.format(required - derived,
+                                                                            branch))
+                    scripts = self.deriver.get_scripts(branch, derived, required - derived)
+                    self.db.executemany('INSERT OR REPLACE INTO scripts (account, script, path) '
+                                        'VALUES (?, ?, ?)',
+                                        [(self.account, bytes(script), cbor.dumps(path))
+                                         for path, script in scripts])
+                    self.paths.update((bytes(script), path) for path, script in scripts)
+                    derived = required
+
+                self.derived[key], self.used[key] = derived, used
+                self.db.execute('INSERT OR REPLACE INTO branches (account, branch, derived, used) '
+                                'VALUES (?, ?, ?, ?)',
+                                (self.account, cbor.dumps(branch), derived, used))
+
+    def _mark_used(self, path):
+        key = tuple(path[:-1])
+        if path[-1] >= self.used.get(key, 0):
+            self.used[key] = path[-1] + 1
+            return True
+        return False
+
+    # Record the passed scripts as seen used (eg. in the wallet's tx history), so
+    # each branch is extended by the gap limit beyond the highest used index.
+    # Returns the paths found (relative to the account), or None for unknown scripts.
+    def observe(self, scripts):
+        scripts = [bytes(script) for script in scripts]
+        with self.lock:
+            while True:
+                marked = False
+                for script in scripts:
+                    path = self.paths.get(script)
+                    if path is not None:
+                        marked = self._mark_used(path) or marked
+                if not marked:
+                    break
+                # Extending may find scripts beyond the previously indexed range
+                self.extend()
+            return [self.paths.get(script) for script in scripts]
+
+    # Get the path (relative to the account) for a script, or None if not known
+    def get_path(self, script):
+        return self.paths.get(bytes(script))
+
+    # Get the full path (including the account path) for a script, or None if not known
+    def get_full_path(self, script):
+        path = self.get_path(script)
+        return self.deriver.account_path + path if path is not None else None
+
+    # Get the sign_tx 'change' entries for the passed tx output scripts - an entry
+    # (full path and variant) for each output paying to this account, None otherwise.
+    def get_change(self, scripts):
+        change = [None] * len(scripts)
+        for i, script in enumerate(scripts):
+            path = self.get_full_path(script)
+            if path is not None:
+                change[i] = {'path': path, 'variant': self.deriver.variant}
+        return change
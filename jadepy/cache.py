@@ -0,0 +1,149 @@
+import os
+import cbor
+import time
+import sqlite3
+import logging
+import threading
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.jade', 'cache.sqlite')
+DEFAULT_MAX_ENTRIES = 100000
+
+# Entry last-used times are held in memory and written in batches of this size
+# (or when entries are added or the cache is closed), rather than on every hit.
+TOUCH_FLUSH_SIZE = 256
+
+
+# Network-independent wallet fingerprint from the root xpub, as per bip32
+# (ie. first 4 bytes of the hash160 of the root pubkey) - as hex string.
+def wallet_fingerprint(root_xpub):
+    import wallycore as wally
+
+    key = wally.bip32_key_from_base58(root_xpub)
+    return wally.hex_from_bytes(wally.hash160(wally.bip32_key_get_pub_key(key))[:4])
+
+
+#
+# Persistent on-disk (sqlite) cache of public data derived by Jade devices
+#
+# Entries are keyed by the device (EFUSEMAC), the wallet fingerprint, the
+# method and the (cbor-serialised) method parameters (eg. network and path).
+# Only public data should be cached (eg. xpubs and public blinding keys).
+#
+# The last wallet seen on each device is recorded - when a different wallet
+# is seen on a device all entries for its prior wallet are discarded.
+# The cache is bounded to 'max_entries', evicting least-recently-used entries.
+# NOTE: the entry count is read when the cache is opened and then tracked in
+# memory, so the bound is approximate if the file is shared between processes.
+#
+# Pass to JadeAPI.create_[serial|ble]() (or the ctor) to enable caching.
+#
+class JadeCache:
+    def __init__(self, filename=None, max_entries=None):
+        self.filename = filename or DEFAULT_CACHE_FILE
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self.lock = threading.Lock()
+
+        cachedir = os.path.dirname(self.filename)
+        if cachedir and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                            'device TEXT, wallet TEXT, method TEXT, params BLOB, '
+                            'result BLOB, last_used REAL, '
+                            'PRIMARY KEY (device, wallet, method, params))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_last_used '
+                            'ON entries (last_used)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS wallets ('
+                            'device TEXT PRIMARY KEY, wallet TEXT)')
+            self.count = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+        # Pending last-used updates, {(device, wallet, method, params): time}
+        self.touched = {}
+
+    # Wallet fingerprint from root xpub - see wallet_fingerprint() above
+    @staticmethod
+    def wallet_fingerprint(root_xpub):
+        return wallet_fingerprint(root_xpub)
+
+    def close(self):
+        with self.lock:
+            with self.db:
+                self._flush_touched()
+            self.db.close()
+
+    @staticmethod
+    def _key(params):
+        return cbor.dumps(params, sort_keys=True)
+
+    # Write any pending last-used times - call with the lock held, in a transaction
+    def _flush_touched(self):
+        if self.touched:
+            self.db.executemany('UPDATE entries SET last_used = ? WHERE device = ? '
+                                'AND wallet = ? AND method = ? AND params = ?',
+                                [(last_used,) + entry for entry, last_used in self.touched.items()])
+            self.touched = {}
+
+    # Record the wallet currently on a device - if it differs from the
+    # wallet previously seen on that device, its entries are invalidated.
+    def set_device_wallet(self, device, wallet):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT wallet FROM wallets WHERE device = ?',
+                                  (device,)).fetchone()
+            if row and row[0] != wallet:
+                logger.info('Wallet changed on {} - invalidating cache'.format(device))
+                self.count -= self.db.execute('DELETE FROM entries WHERE device = ? AND wallet = ?',
+                                              (device, row[0])).rowcount
+            self.db.execute('INSERT OR REPLACE INTO wallets (device, wallet) VALUES (?, ?)',
+                            (device, wallet))
+
+    # Explicitly invalidate all entries for a device, or for one wallet on a device
+    def invalidate(self, device, wallet=None):
+        with self.lock, self.db:
+            if wallet is None:
+                self.count -= self.db.execute('DELETE FROM entries WHERE device = ?',
+                                              (device,)).rowcount
+                self.db.execute('DELETE FROM wallets WHERE device = ?', (device,))
+            else:
+                self.count -= self.db.execute('DELETE FROM entries WHERE device = ? AND wallet = ?',
+                                              (device, wallet)).rowcount
+
+    # Returns the cached result, or None if not present
+    def get(self, device, wallet, method, params):
+        entry = (device, wallet, method, self._key(params))
+        with self.lock:
+            row = self.db.execute('SELECT result FROM entries WHERE device = ? AND wallet = ? '
+                                  'AND method = ? AND params = ?', entry).fetchone()
+            if row is None:
+                return None
+
+            # Record the hit, only writing last-used times in batches
+            self.touched[entry] = time.time()
+            if len(self.touched) >= TOUCH_FLUSH_SIZE:
+                with self.db:
+                    self._flush_touched()
+            return cbor.loads(row[0])
+
+    def put(self, device, wallet, method, params, result):
+        entry = (device, wallet, method, self._key(params))
+        with self.lock, self.db:
+            self.touched.pop(entry, None)
+            values = (cbor.dumps(result), time.time()) + entry
+            if not self.db.execute('UPDATE entries SET result = ?, last_used = ? WHERE device = ? '
+                                   'AND wallet = ? AND method = ? AND params = ?',
+                                   values).rowcount:
+                self.db.execute('INSERT INTO entries '
+                                '(result, last_used, device, wallet, method, params) '
+                                'VALUES (?, ?, ?, ?, ?, ?)', values)
+                self.count += 1
+
+            # Evict least-recently-used entries if over size
+            if self.count > self.max_entries:
+                self._flush_touched()
+                self.count -= self.db.execute('DELETE FROM entries WHERE rowid IN (SELECT rowid '
+                                              'FROM entries ORDER BY last_used LIMIT ?)',
+                                              (self.count - self.max_entries,)).rowcount
@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+import concurrent.futures
+
+from .jade import JadeError
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+
+#
+# Coordinates signing the same (multisig) transaction on several Jades at once.
+#
+# 'cosigners' is a dict of name -> JadeAPI instance (connected).
+# Each cosigner is passed the shared transaction and input data (scripts,
+# input_tx/satoshi, etc.) with its own signing paths for the inputs.
+# The sign_tx calls are all started at once, and the signatures collected as they
+# arrive - returning as soon as 'threshold' cosigners have signed.
+#
+# NOTE: by default a straggler already prompting its user is left to complete (or be
+# declined) on the hw in the background.  Until it does the cosigner is 'busy', and
+# cannot be used for another request - nor should its JadeAPI instance be used directly.
+# Stragglers can instead be cancelled (see cancel()) - which disconnects them, so
+# their call fails on the host.  A cancelled cosigner must be reconnected (and its
+# user will likely need to dismiss the prompt on the hw) before it is used again.
+#
+class JadeCosigningCoordinator:
+    def __init__(self, cosigners, threshold):
+        assert cosigners
+        assert 0 < threshold <= len(cosigners)
+        self.cosigners = dict(cosigners)
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.busy = set()
+
+    # The names of the cosigners still completing an earlier call
+    def busy_cosigners(self):
+        with self.lock:
+            return set(self.busy)
+
+    def _done(self, name):
+        with self.lock:
+            self.busy.discard(name)
+
+    # Cancel the calls of busy cosigners (by default all of them) by disconnecting them.
+    # Returns the names of the cosigners disconnected.
+    def cancel(self, names=None):
+        with self.lock:
+            names = self.busy if names is None else self.busy.intersection(names)
+            names = sorted(names)
+
+        for name in names:
+            logger.warning('Cancelling cosigner {}'.format(name))
+            try:
+                self.cosigners[name].disconnect()
+            except Exception as e:
+                logger.error('Cosigner {} disconnect error: {}'.format(name, e))
+        return names
+
+    # Build the tx_input parameters for one cosigner from the shared inputs
+    # 'paths' has an entry per input (None for inputs the cosigner does not sign)
+    @staticmethod
+    def _cosigner_inputs(inputs, paths):
+        assert len(paths) == len(inputs)
+        cosigner_inputs = []
+        for txinput, path in zip(inputs, paths):
+            txinput = dict(txinput)
+            if path:
+                txinput['path'] = path
+            else:
+                txinput.pop('path', None)
+            cosigner_inputs.append(txinput)
+        return cosigner_inputs
+
+    def _sign(self, name, network, txn, inputs, change):
+        start = time.time()
+        signatures = self.cosigners[name].sign_tx(network, txn, inputs, change)
+        logger.info('Cosigner {} signed in {:.2f}s'.format(name, time.time() - start))
+        return signatures
+
+    # Sign the tx on the cosigners concurrently.
+    # 'inputs' are the shared tx_input parameters (as for JadeAPI.sign_tx(), without paths).
+    # 'paths' is a dict of cosigner name -> list of signing paths (one per input).
+    # 'change' is as for JadeAPI.sign_tx() - either shared, or a dict of name -> change.
+    # 'timeout' (seconds) limits the wait for the threshold to be met.
+    # Returns a dict of cosigner name -> signatures for the first 'threshold'
+    # cosigners to sign.  Raises JadeError if the threshold cannot be met (or is not
+    # met within the timeout), or if any of the cosigners is still busy with an earlier call.
+    # If 'cancel_stragglers' is set any cosigners still signing when this returns (or
+    # raises) are cancelled - see cancel().
+    def sign_tx(self, network, txn, inputs, paths, change=None, timeout=None,
+                cancel_stragglers=False):
+        assert set(paths.keys()) <= set(self.cosigners.keys())
+        assert len(paths) >= self.threshold
+
+        with self.lock:
+            busy = self.busy.intersection(paths.keys())
+            if busy:
+                raise JadeError(1, 'Cosigners still busy with an earlier request', sorted(busy))
+            self.busy.update(paths.keys())
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(paths))
+        futures = {}
+        try:
+            for name, cosigner_paths in paths.items():
+                cosigner_change = change.get(name) if isinstance(change, dict) else change
+                future = executor.submit(self._sign, name, network, txn,
+                                         self._cosigner_inputs(inputs, cosigner_paths),
+                                         cosigner_change)
+                future.add_done_callback(lambda _, name=name: self._done(name))
+                futures[future] = name
+
+            signed, errors = {}, {}
+            try:
+                for future in concurrent.futures.as_completed(futures, timeout):
+                    name = futures[future]
+                    try:
+                        signed[name] = future.result()
+                    except Exception as e:
+                        logger.error('Cosigner {} failed: {}'.format(name, e))
+                        errors[name] = e
+
+                    if len(signed) >= self.threshold:
+                        return signed
+                    if len(paths) - len(errors) < self.threshold:
+                        raise JadeError(1, 'Cosigning threshold cannot be met',
+                                        {name: repr(e) for name, e in errors.items()})
+            except concurrent.futures.TimeoutError:
+                pending = sorted(name for future, name in futures.items() if not future.done())
+                raise JadeError(1, 'Cosigning timed out', {'signed': sorted(signed),
+                                                           'pending': pending})
+        finally:
+            if cancel_stragglers:
+                self.cancel(name for future, name in futures.items() if not future.done())
+
+            # Do not wait for any stragglers - they remain busy until their call completes
+            executor.shutdown(wait=False)
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import bleak
+import logging
+import asyncio
+import concurrent.futures
+
+from serial.tools import list_ports
+
+from .jade import JadeAPI, DEFAULT_BLE_DEVICE_NAME
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# USB (vendor-id, product-id) of the usb-serial bridges used by Jade hw
+# CP210x (Jade, esp32 dev boards) and CH9102 (M5Stack)
+JADE_USB_IDS = [(0x10c4, 0xea60), (0x1a86, 0x55d4)]
+
+# Short timeout for probing ports - a Jade replies to get_version_info promptly
+DEFAULT_PROBE_TIMEOUT = 3
+DEFAULT_PROBE_WORKERS = 16
+
+# How long to scan for advertising BLE devices
+DEFAULT_BLE_SCAN_TIME = 10
+
+# Default location of the cached inventory, and how long it is trusted
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.jade', 'inventory.json')
+DEFAULT_CACHE_MAX_AGE = 600
+
+# The version-info fields recorded in the inventory
+INVENTORY_FIELDS = ['JADE_VERSION', 'JADE_CONFIG', 'BOARD_TYPE', 'JADE_HAS_PIN',
+                    'JADE_FREE_HEAP', 'JADE_FREE_DRAM', 'JADE_FREE_SPIRAM']
+
+
+# Get the serial ports which look like they may have a Jade attached, each with the
+# 'hwid' of the usb-serial bridge (usb ids, serial number and location) - as a port name
+# may be reused by a different device.  Returns a sorted list of [port, hwid].
+def _get_candidate_port_ids(usb_ids=None):
+    usb_ids = usb_ids or JADE_USB_IDS
+    return sorted([port.device, port.hwid] for port in list_ports.comports()
+                  if (port.vid, port.pid) in usb_ids)
+
+
+# Get the serial ports which look like they may have a Jade attached
+def get_candidate_ports(usb_ids=None):
+    return [device for device, hwid in _get_candidate_port_ids(usb_ids)]
+
+
+# Connect to the passed serial port and fetch the version info
+# Returns None if the port does not respond as a Jade
+def probe_port(device, timeout=None):
+    try:
+        with JadeAPI.create_serial(device, timeout=timeout or DEFAULT_PROBE_TIMEOUT) as jade:
+            return jade.get_version_info()
+    except Exception as e:
+        logger.info('No Jade found on {}: {}'.format(device, e))
+        return None
+
+
+# Probe the passed (or all candidate) serial ports in parallel, and return an
+# inventory dict keyed by EFUSEMAC.  eg:
+# { '246F288F6364': { 'port': '/dev/ttyUSB0', 'JADE_VERSION': '0.1.21', ... } }
+def probe_ports(devices=None, timeout=None, max_workers=None):
+    devices = get_candidate_ports() if devices is None else devices
+    inventory = {}
+    if not devices:
+        return inventory
+
+    workers = min(len(devices), max_workers or DEFAULT_PROBE_WORKERS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        infos = executor.map(lambda device: probe_port(device, timeout), devices)
+
+        for device, info in zip(devices, infos):
+            if info and 'EFUSEMAC' in info:
+                entry = {field: info.get(field) for field in INVENTORY_FIELDS}
+                entry['port'] = device
+                inventory[info['EFUSEMAC']] = entry
+                logger.info('Found Jade {} on {}'.format(info['EFUSEMAC'], device))
+
+    return inventory
+
+
+# Scan for advertising Jade BLE devices, and return the serial numbers of those found
+# (ie. the suffix of the advertised name, as passed to JadeAPI.create_ble())
+def discover_ble(device_name=None, scan_time=None):
+    device_name = device_name or DEFAULT_BLE_DEVICE_NAME
+    loop = asyncio.new_event_loop()
+    try:
+        devices = loop.run_until_complete(bleak.discover(scan_time or DEFAULT_BLE_SCAN_TIME))
+    finally:
+        loop.close()
+
+    serial_numbers = set()
+    for dev in devices:
+        if dev.name and dev.name.startswith(device_name):
+            serial_number = dev.name[len(device_name):].strip()
+            if serial_number:
+                logger.info('Found Jade {} advertising as {}'.format(serial_number, dev.name))
+                serial_numbers.add(serial_number)
+    return sorted(serial_numbers)
+
+
+def _load_cached_inventory(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cached_inventory(cache_file, port_ids, inventory):
+    cachedir = os.path.dirname(cache_file)
+    if cachedir and not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+
+    # Write to temp file and rename, so concurrent readers never see partial data
+    tmpfile = cache_file + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump({'timestamp': time.time(), 'ports': port_ids, 'inventory': inventory},
+                  f, indent=2)
+    os.replace(tmpfile, cache_file)
+
+
+# Discover attached Jade devices, returning an inventory keyed by EFUSEMAC.
+# A cached inventory is returned if it is recent and the candidate ports, and the
+# usb-serial bridges attached to them, are unchanged - otherwise all candidate ports
+# are re-probed and the cache updated.
+# NOTE: a device swapped for another whose bridge has the same serial number (eg. an
+# unprogrammed default) on the same usb port is only detected once the cache expires -
+# pass refresh=True after changing devices (or reflashing) if in doubt.
+# Pass cache_file=False to disable caching.
+def discover(refresh=False, cache_file=None, max_age=None, timeout=None, usb_ids=None):
+    port_ids = _get_candidate_port_ids(usb_ids)
+    cache_file = DEFAULT_CACHE_FILE if cache_file is None else cache_file
+    max_age = DEFAULT_CACHE_MAX_AGE if max_age is None else max_age
+
+    if cache_file and not refresh:
+        cached = _load_cached_inventory(cache_file)
+        if cached and time.time() - cached.get('timestamp', 0) < max_age:
+            if cached.get('ports') == port_ids:
+                logger.info('Using cached Jade inventory from {}'.format(cache_file))
+                return cached.get('inventory', {})
+
+    inventory = probe_ports([device for device, hwid in port_ids], timeout)
+    if cache_file:
+        _save_cached_inventory(cache_file, port_ids, inventory)
+    return inventory
@@ -0,0 +1,259 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+import traceback
+import concurrent.futures
+
+from .jade import JadeAPI, JadeError
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+
+#
+# A single device within a JadeFleet
+# Wraps a JadeAPI instance and tracks load, health and latency.
+# A device is only ever used by one worker thread at a time.
+#
+class JadeFleetDevice:
+    def __init__(self, name, jade):
+        assert jade is not None
+        self.name = name
+        self.jade = jade
+        self.info = None
+        self.connected = False
+        self.healthy = False
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+        self.busy_secs = 0.0
+        self.last_latency = None
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    # Average call latency in seconds, or None if not yet used
+    def avg_latency(self):
+        return self.busy_secs / self.calls if self.calls else None
+
+    def stats(self):
+        return {'name': self.name,
+                'healthy': self.healthy,
+                'inflight': self.inflight,
+                'calls': self.calls,
+                'errors': self.errors,
+                'busy_secs': self.busy_secs,
+                'avg_latency': self.avg_latency(),
+                'last_latency': self.last_latency,
+                'last_error': self.last_error}
+
+
+#
+# Pool of Jade devices with load-balanced dispatch of calls
+#
+# Each call is routed to the least-loaded healthy device (fewest calls
+# in-flight, then lowest average latency) and is run on a worker thread.
+# An optional 'compatible' predicate, passed the JadeFleetDevice, can be
+# used to restrict the devices eligible for a call (eg. by 'JADE_CONFIG'
+# or version in the cached device.info).
+#
+# Calls return concurrent.futures.Future objects.
+# A device which fails with anything other than a JadeError (ie. an error
+# reported by the hw itself) is marked as unhealthy and receives no more work
+# until it is reconnected (see reconnect() and recover()).
+#
+# Either:
+#  a) use with JadeFleet.create_[serial|ble]() as fleet:
+# (recommended)
+# or:
+#  b) use ctor to wrap existing JadeAPI instances, then call connect()
+#     before using and disconnect() when finished
+# (caveat cranium)
+#
+class JadeFleet:
+    def __init__(self, jades, names=None):
+        assert jades
+        names = names or [str(i) for i in range(len(jades))]
+        assert len(names) == len(jades)
+        self.devices = [JadeFleetDevice(name, jade) for name, jade in zip(names, jades)]
+        self.lock = threading.Lock()
+        self.executor = None
+        self.start_time = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if (exc_type):
+            logger.error("Exception causing JadeFleet context exit.")
+            logger.error(exc_type)
+            logger.error(exc)
+            traceback.print_tb(tb)
+        self.disconnect(exc_type is not None)
+
+    @staticmethod
+    def create_serial(devices, baud=None, timeout=None):
+        jades = [JadeAPI.create_serial(device, baud, timeout) for device in devices]
+        return JadeFleet(jades, devices)
+
+    @staticmethod
+    def create_ble(serial_numbers, device_name=None, scan_timeout=None):
+        # Each BLE device is driven from a worker thread, so needs its own loop
+        jades = [JadeAPI.create_ble(device_name, serial_number, scan_timeout,
+                                    loop=asyncio.new_event_loop())
+                 for serial_number in serial_numbers]
+        return JadeFleet(jades, serial_numbers)
+
+    # Connect the device and fetch its version info - marking it healthy if successful
+    # Returns whether the device is now healthy.
+    def _connect_device(self, device):
+        try:
+            device.jade.connect()
+            device.connected = True
+            device.info = device.jade.get_version_info()
+            device.healthy = True
+            logger.info('Fleet device {} connected: {}'.format(device.name, device.info))
+        except Exception as e:
+            logger.error('Fleet device {} failed to connect: {}'.format(device.name, e))
+            device.last_error = repr(e)
+            device.healthy = False
+        return device.healthy
+
+    # Connect all devices and fetch their version info
+    # Devices which fail to connect are logged and marked unhealthy
+    def connect(self):
+        assert self.executor is None
+
+        for device in self.devices:
+            self._connect_device(device)
+
+        if not any(device.healthy for device in self.devices):
+            raise JadeError(1, 'No fleet devices connected', [d.name for d in self.devices])
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.devices))
+        self.start_time = time.time()
+
+    # Wait for outstanding calls, then disconnect all devices
+    def disconnect(self, drain=False):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        for device in self.devices:
+            if device.connected:
+                try:
+                    device.jade.disconnect(drain)
+                except Exception as e:
+                    logger.warn('Fleet device {} disconnect error: {}'.format(device.name, e))
+                device.connected = False
+                device.healthy = False
+
+    def _get_device(self, name):
+        device = next((d for d in self.devices if d.name == name), None)
+        assert device, 'Unknown fleet device: {}'.format(name)
+        return device
+
+    # Reconnect a device by name (eg. after it was marked unhealthy, once it has been
+    # reset or replugged) - disconnecting it first if connected.  Waits for any call
+    # running on the device.  Returns whether the device is now healthy.
+    def reconnect(self, name):
+        assert self.executor, 'JadeFleet not connected'
+        device = self._get_device(name)
+        with device.lock:
+            device.healthy = False
+            if device.connected:
+                try:
+                    device.jade.disconnect()
+                except Exception as e:
+                    logger.warn('Fleet device {} disconnect error: {}'.format(device.name, e))
+                device.connected = False
+            return self._connect_device(device)
+
+    # Try to reconnect all unhealthy devices
+    # Returns the names of the devices recovered.
+    def recover(self):
+        return [device.name for device in self.devices
+                if not device.healthy and self.reconnect(device.name)]
+
+    # Pick the least-loaded healthy compatible device, and reserve it
+    def _select_device(self, compatible):
+        with self.lock:
+            candidates = [d for d in self.devices
+                          if d.healthy and (compatible is None or compatible(d))]
+            if not candidates:
+                raise JadeError(1, 'No healthy compatible fleet device available', None)
+
+            # Unused devices sort as fastest, random tie-break to spread load
+            device = min(candidates, key=lambda d: (d.inflight, d.avg_latency() or 0,
+                                                    random.random()))
+            device.inflight += 1
+            return device
+
+    def _run_on_device(self, device, method, args, kwargs):
+        try:
+            with device.lock:
+                start = time.time()
+                try:
+                    return getattr(device.jade, method)(*args, **kwargs)
+                except JadeError as e:
+                    # Error reported by the hw - device still healthy
+                    device.errors += 1
+                    device.last_error = repr(e)
+                    raise
+                except Exception as e:
+                    logger.error('Fleet device {} failed: {}'.format(device.name, e))
+                    device.errors += 1
+                    device.last_error = repr(e)
+                    device.healthy = False
+                    raise
+                finally:
+                    device.last_latency = time.time() - start
+                    device.busy_secs += device.last_latency
+                    device.calls += 1
+        finally:
+            with self.lock:
+                device.inflight -= 1
+
+    # Submit a JadeAPI call to the least-loaded compatible device
+    # Returns a Future for the result.
+    def submit(self, method, *args, compatible=None, **kwargs):
+        assert self.executor, 'JadeFleet not connected'
+        assert hasattr(JadeAPI, method), 'Unknown JadeAPI method: {}'.format(method)
+        device = self._select_device(compatible)
+        logger.debug('Fleet dispatching {} to {}'.format(method, device.name))
+        return self.executor.submit(self._run_on_device, device, method, args, kwargs)
+
+    # Submit a call per item in 'argslist' and return the results in order
+    def map(self, method, argslist, compatible=None):
+        futures = [self.submit(method, *args, compatible=compatible) for args in argslist]
+        return [future.result() for future in futures]
+
+    # Convenience wrappers for common calls - see JadeAPI
+    def get_xpub(self, network, path, compatible=None):
+        return self.submit('get_xpub', network, path, compatible=compatible)
+
+    def sign_message(self, path, message, compatible=None):
+        return self.submit('sign_message', path, message, compatible=compatible)
+
+    def sign_tx(self, network, txn, inputs, change, compatible=None):
+        return self.submit('sign_tx', network, txn, inputs, change, compatible=compatible)
+
+    def sign_liquid_tx(self, network, txn, inputs, commitments, change, compatible=None):
+        return self.submit('sign_liquid_tx', network, txn, inputs, commitments, change,
+                           compatible=compatible)
+
+    # Per-device and aggregate statistics
+    def stats(self):
+        with self.lock:
+            devices = [device.stats() for device in self.devices]
+
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        calls = sum(d['calls'] for d in devices)
+        return {'devices': devices,
+                'healthy': sum(1 for d in devices if d['healthy']),
+                'calls': calls,
+                'errors': sum(d['errors'] for d in devices),
+                'elapsed_secs': elapsed,
+                'calls_per_sec': calls / elapsed if elapsed else 0.0}
@@ -6,12 +6,15 @@ import logging
 import asyncio
 import aioitertools
 import collections
+import collections.abc
 import subprocess
 import traceback
 import platform
 import requests
 import random
 import bleak
+import contextlib
+import concurrent.futures
 
 # Default serial connection
 DEFAULT_SERIAL_DEVICE = '/dev/ttyUSB0'
@@ -23,6 +26,21 @@ DEFAULT_BLE_DEVICE_NAME = 'Jade'
 DEFAULT_BLE_SERIAL_NUMBER = None
 DEFAULT_BLE_SCAN_TIMEOUT = 60
 
+# Maximum number of requests sent in a single 'batch' message
+DEFAULT_BATCH_MAX_REQUESTS = 16
+
+# Maximum number of green addresses returned by the hw in a single call
+MAX_RECEIVE_ADDRESS_RANGE = 20
+
+# Maximum number of outputs in a single (multi-output) get_shared_nonce call
+MAX_SHARED_NONCE_OUTPUTS = 64
+
+# Txns larger than this are uploaded to the hw in chunks (if the hw supports it)
+DEFAULT_TXN_CHUNK_THRESHOLD = 1024 * 16
+
+# Hw log levels (as esp_log_level_t) for set_log_level()
+LOG_LEVELS = {'none': 0, 'error': 1, 'warn': 2, 'info': 3, 'debug': 4, 'verbose': 5}
+
 # 'jade' logger
 logger = logging.getLogger('jade')
 device_logger = logging.getLogger('jade-device')
@@ -30,6 +48,12 @@ device_logger = logging.getLogger('jade-device')
 
 # Exception
 class JadeError(Exception):
+    # Error returned by hw which does not support the method called
+    UNKNOWN_METHOD = -32601
+
+    # Error returned by hw when a request interrupts an ota upload - the request should be resent
+    OTA_INTERRUPTED = -32005
+
     def __init__(self, code, message, data):
         self.code = code
         self.message = message
@@ -58,10 +82,16 @@ class JadeError(Exception):
 #  c) use ctor to wrap existing JadeInterface instance
 # (caveat cranium)
 #
+# Optionally pass a JadeCache instance to cache public data (eg. xpubs) on
+# disk, keyed by device and wallet, to save repeated calls to the hw.
+#
 class JadeAPI:
-    def __init__(self, jade):
+    def __init__(self, jade, cache=None):
         assert jade is not None
         self.jade = jade
+        self.cache = cache
+        self.txn_chunk_threshold = DEFAULT_TXN_CHUNK_THRESHOLD
+        self._reset_cache_keys()
 
     def __enter__(self):
         self.connect()
@@ -76,23 +106,25 @@ class JadeAPI:
         self.disconnect(exc_type is not None)
 
     @staticmethod
-    def create_serial(device=None, baud=None, timeout=None):
+    def create_serial(device=None, baud=None, timeout=None, cache=None):
         impl = JadeInterface.create_serial(device, baud, timeout)
-        return JadeAPI(impl)
+        return JadeAPI(impl, cache)
 
     @staticmethod
     def create_ble(device_name=None, serial_number=None,
-                   scan_timeout=None, loop=None):
+                   scan_timeout=None, loop=None, cache=None):
         impl = JadeInterface.create_ble(device_name, serial_number,
                                         scan_timeout, loop)
-        return JadeAPI(impl)
+        return JadeAPI(impl, cache)
 
     # Connect underlying interface
     def connect(self):
+        self._reset_cache_keys()
         self.jade.connect()
 
     # Disconnect underlying interface
     def disconnect(self, drain=False):
+        self._reset_cache_keys()
         self.jade.disconnect(drain)
 
     # Drain all output from the interface
@@ -140,6 +172,11 @@ class JadeAPI:
         newid = inputid if inputid else str(random.randint(100000, 999999))
         request = self.jade.build_request(newid, method, params)
         reply = self.jade.make_rpc_call(request, long_timeout)
+        if reply.get('error', {}).get('code') == JadeError.OTA_INTERRUPTED:
+            # The request interrupted an ota upload still awaiting data on the hw (eg. after
+            # reconnecting) - the hw retains the upload for resumption, and the request is resent.
+            logger.info('Request interrupted an active ota upload - retrying')
+            reply = self.jade.make_rpc_call(request, long_timeout)
         result = self._get_result_or_raise_error(reply)
 
         # The Jade can respond with a request for interaction with a remote
@@ -148,7 +185,7 @@ class JadeAPI:
         # forwards the response back to the Jade.
         # Note: the function called to make the http-request can be passed in,
         # or defaults to the simple _http_request() function above.
-        if isinstance(result, collections.Mapping) and 'http_request' in result:
+        if isinstance(result, collections.abc.Mapping) and 'http_request' in result:
             make_http_request = http_request_fn or self._http_request
             http_request = result['http_request']
             http_response = make_http_request(http_request['params'])
@@ -160,6 +197,48 @@ class JadeAPI:
 
         return result
 
+    # Forget the device and wallet ids used to key the cache
+    # (eg. on reconnection, or when the wallet may have changed)
+    def _reset_cache_keys(self):
+        self._cache_device = None
+        self._cache_wallets = {}
+        self._cache_network = None
+
+    # Make a call, or return the cached result if the cache is enabled
+    # and a result is held for this device, wallet and parameters.
+    # A network is needed to fetch the root xpub to identify the wallet - calls which
+    # do not take one (eg. get_blinding_key) use the network of the last auth_user or
+    # cached call, and are not cached if there has been none.
+    def _cachedJadeRpc(self, method, params, network=None):
+        network = network or self._cache_network
+        if self.cache is None:
+            return self._jadeRpc(method, params)
+        if network is None:
+            logger.debug('Not caching {} - no network to identify the wallet'.format(method))
+            return self._jadeRpc(method, params)
+
+        if self._cache_device is None:
+            self._cache_device = self.get_version_info()['EFUSEMAC']
+
+        wallet = self._cache_wallets.get(network)
+        if wallet is None:
+            root_xpub = self._jadeRpc('get_xpub', {'network': network, 'path': []})
+            wallet = self.cache.wallet_fingerprint(root_xpub)
+            self.cache.set_device_wallet(self._cache_device, wallet)
+            self._cache_wallets[network] = wallet
+        self._cache_network = network
+
+        result = self.cache.get(self._cache_device, wallet, method, params)
+        if result is None:
+            result = self._jadeRpc(method, params)
+            self.cache.put(self._cache_device, wallet, method, params, result)
+        return result
+
+    # Get a batch to which requests can be added, to be sent to the hw
+    # in one message (round trip) - see JadeBatch below.
+    def batch(self, max_requests=None):
+        return JadeBatch(self, max_requests)
+
     # Get version information from the hw
     def get_version_info(self):
         return self._jadeRpc('get_version_info')
@@ -169,25 +248,122 @@ class JadeAPI:
         params = {'entropy': entropy}
         return self._jadeRpc('add_entropy', params)
 
+    # Set the hw runtime log level (a LOG_LEVELS name or value), and the maximum
+    # number of log messages the hw sends per second (0 = unlimited).
+    # NOTE: log messages are only sent over serial, and only by debug builds.
+    # Returns the prior settings, as a dict with 'level' and 'max_rate'.
+    def set_log_level(self, level, max_rate=0):
+        params = {'level': LOG_LEVELS.get(level, level), 'max_rate': max_rate}
+        return self._jadeRpc('set_log_level', params)
+
+    # Context manager to reduce the hw logging for the duration of bulk operations
+    # (eg. ota, or signing large txns), so log messages do not compete with the rpc
+    # messages for the link.  The prior settings are restored on exit, unless 'restore'
+    # is False (eg. for ota, as the hw reboots with its default settings).
+    # Does nothing if the hw does not support set_log_level.
+    @contextlib.contextmanager
+    def quiet_logs(self, level='error', max_rate=0, restore=True):
+        try:
+            prior = self.set_log_level(level, max_rate)
+        except JadeError as e:
+            if e.code != JadeError.UNKNOWN_METHOD:
+                raise
+            logger.warning('Hw does not support set_log_level')
+            prior = None
+
+        try:
+            yield
+        finally:
+            if restore and prior is not None:
+                self.set_log_level(prior['level'], prior['max_rate'])
+
     # OTA new firmware
-    def ota_update(self, fwcmp, fwlen, chunksize, cb):
+    # 'chunksize' is the hw's default ota_data chunk size (JADE_OTA_MAX_CHUNK).
+    # 'window' is the number of ota_data chunks to keep in flight - the hw queues the
+    # chunks and acks each in turn, so with a window > 1 the upload does not idle for a
+    # round trip per chunk (significant over ble).  Only if the hw JADE_FEATURES include
+    # 'OTAWINDOW' - older hw must be passed a window of 1.
+    # If 'max_chunksize' is passed the hw is asked to accept chunks up to that size, and
+    # grants the largest it can (older hw ignores this, and the default is used).
+    # Chunks are then of the granted size, unless a 'tuner' is passed - called with the
+    # granted size before each chunk is sent, to return the size of that chunk.
+    # The hash of the compressed image is passed, so if an upload is interrupted (eg. the
+    # connection drops) calling again with the same image resumes the upload where it left
+    # off (if the hw supports it).  'cb' is called with the offset the upload starts from,
+    # and then as each chunk is acked.
+    # If 'patch' is True 'fwcmp' is a compressed patch against the running firmware (see
+    # fwprep.create_patch()) rather than the full firmware - only if the hw JADE_FEATURES
+    # include 'DELTA'.  'fwlen' is still the length of the (patched) uncompressed firmware.
+    # 'fwcmp' need not be bytes - any object supporting len() and slicing will do (eg. a
+    # download in progress, whose slices block until available).  In that case the hash of
+    # the image can be passed as 'cmphash' - or, if not yet known, a function to get it once
+    # all the data is uploaded, which is passed with ota_complete (and may raise to abandon
+    # the ota).  Such an upload cannot be resumed.
+    def ota_update(self, fwcmp, fwlen, chunksize, cb, window=1, max_chunksize=None, tuner=None,
+                   patch=False, cmphash=None):
+        import hashlib
+        assert window > 0
 
         compressed_size = len(fwcmp)
+        if cmphash is None and isinstance(fwcmp, (bytes, bytearray, memoryview)):
+            cmphash = hashlib.sha256(fwcmp).digest()
 
         # Initiate OTA
         params = {'fwsize': fwlen,
                   'cmpsize': compressed_size}
+        if callable(cmphash):
+            params['cmphash_on_complete'] = True
+        elif cmphash is not None:
+            params['cmphash'] = cmphash
+        if max_chunksize:
+            params['otachunk'] = max_chunksize
+        if patch:
+            params['patch'] = True
 
         result = self._jadeRpc('ota', params)
-        assert result is True
 
-        # Write binary chunks
-        written = 0
+        offset = 0
+        if isinstance(result, dict):
+            # Hw has granted a chunk size, and returned the offset to continue from
+            chunksize = result['otachunk']
+            offset = result['offset']
+            assert 0 < chunksize and 0 <= offset < compressed_size
+            if offset:
+                logger.info('Resuming ota upload from offset {}'.format(offset))
+        elif result is not True:
+            # Hw has granted a chunk size
+            assert isinstance(result, int) and 0 < result <= max_chunksize
+            chunksize = result
+        logger.info('Uploading ota in chunks of up to {} bytes'.format(chunksize))
+
+        if (cb):
+            cb(offset, compressed_size)
+
+        # Write binary chunks, keeping up to 'window' chunks awaiting their ack
+        base_id = 10000 * random.randint(100000, 999999)
+        inflight = collections.deque()
+        sent = offset
+        written = offset
         while written < compressed_size:
-            remaining = compressed_size - written
-            length = min(remaining, chunksize)
-            chunk = bytes(fwcmp[written:written + length])
-            result = self._jadeRpc('ota_data', chunk)
+            while sent < compressed_size and len(inflight) < window:
+                length = tuner(chunksize) if tuner else chunksize
+                assert 0 < length <= chunksize
+                length = min(compressed_size - sent, length)
+                chunk = bytes(fwcmp[sent:sent + length])
+                request = self.jade.build_request(str(base_id + sent), 'ota_data', chunk)
+                self.jade.write_request(request)
+                inflight.append((request, length))
+                sent += length
+
+            # Await the ack for the oldest chunk in flight
+            request, length = inflight.popleft()
+            reply = self.jade.read_response()
+            self.jade.validate_reply(request, reply)
+            try:
+                result = self._get_result_or_raise_error(reply)
+            except JadeError:
+                self._drain_replies(inflight)
+                raise
             assert result is True
             written += length
 
@@ -195,34 +371,72 @@ class JadeAPI:
                 cb(written, compressed_size)
 
         # All binary data uploaded
+        if callable(cmphash):
+            return self._jadeRpc('ota_complete', {'cmphash': cmphash()})
         return self._jadeRpc('ota_complete')
 
+    # Read and discard the replies to any requests still in flight after an error reply,
+    # so they are not taken as replies to subsequent requests.
+    # NOTE: older hw firmware only replies to these once the error has been acknowledged
+    # on the hw, in which case we give up when the read times-out.
+    def _drain_replies(self, inflight):
+        for request, _ in inflight:
+            try:
+                reply = self.jade.read_response()
+            except EOFError:
+                logger.warning('No reply for in-flight message {}'.format(request['id']))
+                break
+            logger.debug('Discarding reply to in-flight message: {}'.format(reply))
+
     # Run (debug) healthcheck on the hw
     def run_remote_selfcheck(self):
         return self._jadeRpc('debug_selfcheck')
 
+    # Get the (debug) hw performance counters - cumulative since boot
+    # See perf.diff_perf_stats() to get the counters for an interval.
+    def get_perf_stats(self):
+        return self._jadeRpc('debug_get_perf_stats')
+
+    # Context manager to collect the (debug) hw performance counters for a block of
+    # work - yields a dict, which is populated with the diffed counters on exit.
+    @contextlib.contextmanager
+    def perf_stats(self):
+        from .perf import diff_perf_stats
+        stats = {}
+        before = self.get_perf_stats()
+        yield stats
+        stats.update(diff_perf_stats(before, self.get_perf_stats()))
+
     # Set the (debug) mnemonic
     def set_mnemonic(self, mnemonic):
+        self._reset_cache_keys()
         params = {'mnemonic': mnemonic}
         return self._jadeRpc('debug_set_mnemonic', params)
 
     # Set the (debug) seed
     def set_seed(self, seed):
+        self._reset_cache_keys()
         params = {'seed': seed}
         return self._jadeRpc('debug_set_mnemonic', params)
 
     # Trigger user authentication on the hw
     # Involves pinserver handshake
     def auth_user(self, network, http_request_fn=None):
+        self._reset_cache_keys()
         params = {'network': network}
-        return self._jadeRpc('auth_user', params,
-                             http_request_fn=http_request_fn,
-                             long_timeout=True)
+        result = self._jadeRpc('auth_user', params,
+                               http_request_fn=http_request_fn,
+                               long_timeout=True)
+
+        # The network the wallet is unlocked for then identifies the wallet for any
+        # cached calls which do not take a network (eg. get_blinding_key)
+        self._cache_network = network
+        return result
 
     # Get xpub given a path
     def get_xpub(self, network, path):
         params = {'network': network, 'path': path}
-        return self._jadeRpc('get_xpub', params)
+        return self._cachedJadeRpc('get_xpub', params, network)
 
     # Get receive-address for parameters
     def get_receive_address(self, *args, recovery_xpub=None, csv_blocks=0, variant=None):
@@ -236,15 +450,35 @@ class JadeAPI:
             args += (recovery_xpub, csv_blocks)
         return self._jadeRpc('get_receive_address', dict(zip(keys, args)))
 
+    # Get green-multisig receive-addresses for a range of pointers [pointer, pointer+count)
+    # Returns a list of addresses.
+    # NOTE: the hw returns at most MAX_RECEIVE_ADDRESS_RANGE addresses per call, so
+    # larger ranges are fetched in several calls (each confirmed by the user).
+    def get_receive_addresses(self, network, subaccount, branch, pointer, count,
+                              recovery_xpub=None, csv_blocks=0):
+        addresses = []
+        while len(addresses) < count:
+            params = {'network': network,
+                      'subaccount': subaccount,
+                      'branch': branch,
+                      'pointer': pointer + len(addresses),
+                      'num_addresses': min(count - len(addresses), MAX_RECEIVE_ADDRESS_RANGE),
+                      'recovery_xpub': recovery_xpub,
+                      'csv_blocks': csv_blocks}
+            addresses.extend(self._jadeRpc('get_receive_address', params))
+        return addresses
+
     # Sign a message
     def sign_message(self, path, message):
         params = {'path': path, 'message': message}
         return self._jadeRpc('sign_message', params)
 
     # Get a Liquid public blinding key for a given script
-    def get_blinding_key(self, script):
+    # If caching, 'network' can be passed to identify the wallet - otherwise that of the
+    # last auth_user or cached call is used (see _cachedJadeRpc() above).
+    def get_blinding_key(self, script, network=None):
         params = {'script': script}
-        return self._jadeRpc('get_blinding_key', params)
+        return self._cachedJadeRpc('get_blinding_key', params, network)
 
     # Get the shared secret to unblind a tx, given the receiving script on
     # our side and the pubkey of the sender (sometimes called "nonce" in
@@ -253,6 +487,18 @@ class JadeAPI:
         params = {'script': script, 'their_pubkey': their_pubkey}
         return self._jadeRpc('get_shared_nonce', params)
 
+    # Get the shared secrets for several outputs - 'outputs' is a list of
+    # (script, their_pubkey) tuples.  Returns a list of nonces, one per output.
+    # NOTE: larger lists are split across several calls.
+    def get_shared_nonces(self, outputs):
+        nonces = []
+        for i in range(0, len(outputs), MAX_SHARED_NONCE_OUTPUTS):
+            chunk = outputs[i:i + MAX_SHARED_NONCE_OUTPUTS]
+            params = {'outputs': [{'script': script, 'their_pubkey': their_pubkey}
+                                  for script, their_pubkey in chunk]}
+            nonces.extend(self._jadeRpc('get_shared_nonce', params))
+        return nonces
+
     # Get a "trusted" blinding factor to blind an output. Normally the blinding
     # factors are generated and returned in the `get_commitments` call, but
     # for the last output the VBF must be generated on the host side, so this
@@ -294,7 +540,13 @@ class JadeAPI:
         return self._jadeRpc('get_commitments', params)
 
     # Sign a Liquid txn
-    def sign_liquid_tx(self, network, txn, inputs, commitments, change):
+    # If 'validate' is set the parameters are checked on the host before
+    # anything is sent to the hw - see validate.validate_sign_liquid_tx().
+    def sign_liquid_tx(self, network, txn, inputs, commitments, change, validate=False):
+        if validate:
+            from .validate import validate_sign_liquid_tx
+            validate_sign_liquid_tx(network, txn, inputs, commitments, change)
+
         # Protocol:
         # 1st message contains txn and number of inputs we are going to send.
         # Reply ok if that corresponds to the expected number of inputs (n).
@@ -306,11 +558,10 @@ class JadeAPI:
 
         base_id = 100 * random.randint(1000, 9999)
         params = {'network': network,
-                  'txn': txn,
                   'num_inputs': len(inputs),
                   'trusted_commitments': commitments,
                   'change': change}
-        reply = self._jadeRpc('sign_liquid_tx', params, str(base_id))
+        reply = self._send_txn('sign_liquid_tx', params, txn, base_id)
         assert reply
 
         # Send all n inputs
@@ -333,8 +584,69 @@ class JadeAPI:
         assert len(signatures) == len(inputs)
         return signatures
 
+    # Get the chunk size to use to upload a txn of the passed length, or None if the
+    # txn should be sent in the sign_tx message (ie. is small, or the hw does not
+    # support chunked txn upload).
+    def _get_txn_chunk_size(self, txn_len):
+        if txn_len <= self.txn_chunk_threshold:
+            return None
+        return self.get_version_info().get('JADE_TXN_MAX_CHUNK')
+
+    # Send the initial sign_tx/sign_liquid_tx message.
+    # A large txn is uploaded in chunks: the message carries 'txn_len' rather than
+    # the txn, the hw replies when ready, then the txn is sent in 'tx_data' messages
+    # (each acknowledged).  The hw then replies to the initial message as usual.
+    def _send_txn(self, method, params, txn, base_id):
+        chunk_size = self._get_txn_chunk_size(len(txn))
+        if not chunk_size:
+            return self._jadeRpc(method, dict(params, txn=txn), str(base_id))
+
+        request = self.jade.build_request(str(base_id), method, dict(params, txn_len=len(txn)))
+        reply = self.jade.make_rpc_call(request)
+        assert self._get_result_or_raise_error(reply) is True
+
+        for offset in range(0, len(txn), chunk_size):
+            self._jadeRpc('tx_data', txn[offset:offset + chunk_size])
+
+        # Second reply to the initial message, once the tx has been confirmed
+        reply = self.jade.read_response()
+        self.jade.validate_reply(request, reply)
+        return self._get_result_or_raise_error(reply)
+
+    # Replace any 'input_tx' already sent for an earlier input with a reference to it
+    # (by txhash) - the hw reuses the amounts from the prior tx it has already verified.
+    @staticmethod
+    def _dedup_input_txs(inputs):
+        import wallycore as wally
+
+        txhashes = {}
+        deduped = []
+        for txinput in inputs:
+            input_tx = txinput.get('input_tx')
+            if input_tx is not None:
+                key = bytes(input_tx)
+                txhash = txhashes.get(key)
+                if txhash is None:
+                    txhashes[key] = wally.tx_get_txid(wally.tx_from_bytes(input_tx, 0))
+                else:
+                    txinput = {k: v for k, v in txinput.items() if k != 'input_tx'}
+                    txinput['input_txhash'] = txhash
+            deduped.append(txinput)
+        return deduped
+
     # Sign a txn
-    def sign_tx(self, network, txn, inputs, change):
+    # If 'validate' is set the parameters are checked on the host before
+    # anything is sent to the hw - see validate.validate_sign_tx().
+    # If 'dedup_input_txs' is set, an 'input_tx' spent by several inputs is only
+    # sent once (requires firmware support for 'input_txhash' references).
+    def sign_tx(self, network, txn, inputs, change, validate=False, dedup_input_txs=False):
+        if validate:
+            from .validate import validate_sign_tx
+            validate_sign_tx(network, txn, inputs, change)
+
+        if dedup_input_txs:
+            inputs = self._dedup_input_txs(inputs)
+
         # Protocol:
         # 1st message contains txn and number of inputs we are going to send.
         # Reply ok if that corresponds to the expected number of inputs (n).
@@ -346,10 +658,9 @@ class JadeAPI:
 
         base_id = 100 * random.randint(1000, 9999)
         params = {'network': network,
-                  'txn': txn,
                   'num_inputs': len(inputs),
                   'change': change}
-        reply = self._jadeRpc('sign_tx', params, str(base_id))
+        reply = self._send_txn('sign_tx', params, txn, base_id)
         assert reply
 
         # Send all n inputs
@@ -373,6 +684,117 @@ class JadeAPI:
         return signatures
 
 
+#
+# A batch of requests to be sent to Jade in a single 'batch' message (ie. one
+# round trip), rather than one message per request.
+#
+# Either:
+#  a) use with JadeAPI.batch() as batch:
+#       xpub1 = batch.get_xpub(network, path1)
+#       xpub2 = batch.get_xpub(network, path2)
+#     print(xpub1.result(), xpub2.result())
+# (recommended)
+# or:
+#  b) use JadeAPI.batch(), add requests, then call send()
+#
+# Each call returns a Future which holds the result (or raises the JadeError)
+# for that request.  The batch is sent when the context is exited.
+# Only single-message requests can be batched (eg. not sign_tx or ota).
+# NOTE: any user confirmations (eg. sign_message) are still required per-request.
+# NOTE: batched requests bypass any JadeCache.
+#
+class JadeBatch:
+    # Error returned for requests not processed as the batch reply was full
+    BATCH_FULL = -32004
+
+    def __init__(self, api, max_requests=None):
+        assert api is not None
+        self.api = api
+        self.max_requests = max_requests or DEFAULT_BATCH_MAX_REQUESTS
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            for method, params, future in self.pending:
+                future.cancel()
+            self.pending = []
+        else:
+            self.send()
+
+    # The JadeAPI methods which can be batched - these call back into
+    # _jadeRpc()/_cachedJadeRpc() below, which queue the request.
+    get_xpub = JadeAPI.get_xpub
+    get_receive_address = JadeAPI.get_receive_address
+    sign_message = JadeAPI.sign_message
+    get_blinding_key = JadeAPI.get_blinding_key
+    get_shared_nonce = JadeAPI.get_shared_nonce
+    get_blinding_factor = JadeAPI.get_blinding_factor
+    get_commitments = JadeAPI.get_commitments
+
+    # Multi-output get_shared_nonce - as a single request, so at most
+    # MAX_SHARED_NONCE_OUTPUTS outputs.  The Future holds the list of nonces.
+    def get_shared_nonces(self, outputs):
+        assert 0 < len(outputs) <= MAX_SHARED_NONCE_OUTPUTS
+        params = {'outputs': [{'script': script, 'their_pubkey': their_pubkey}
+                              for script, their_pubkey in outputs]}
+        return self._jadeRpc('get_shared_nonce', params)
+
+    # Queue the request, returning a Future for the result
+    def _jadeRpc(self, method, params=None):
+        future = concurrent.futures.Future()
+        self.pending.append((method, params, future))
+        return future
+
+    def _cachedJadeRpc(self, method, params, network=None):
+        return self._jadeRpc(method, params)
+
+    # Send all queued requests, in as many 'batch' messages as required.
+    # Returns the list of results (or JadeError instances) in request order.
+    def send(self):
+        pending, self.pending = self.pending, []
+        futures = [future for method, params, future in pending]
+
+        base_id = 100 * random.randint(1000, 9999)
+        items = [(self.api.jade.build_request(str(base_id + i), method, params), future)
+                 for i, (method, params, future) in enumerate(pending)]
+
+        max_requests = self.max_requests
+        while items:
+            chunk, items = items[:max_requests], items[max_requests:]
+            try:
+                replies = self.api._jadeRpc('batch', {'requests': [r for r, f in chunk]})
+                assert isinstance(replies, list) and len(replies) == len(chunk)
+            except Exception as e:
+                # Whole batch failed - fail all outstanding requests
+                for request, future in chunk + items:
+                    future.set_exception(e)
+                raise
+
+            # Any requests the hw could not fit into the reply must be resent
+            deferred = []
+            for (request, future), reply in zip(chunk, replies):
+                self.api.jade.validate_reply(request, reply)
+                if reply.get('error', {}).get('code') == self.BATCH_FULL:
+                    deferred.append((request, future))
+                    continue
+
+                try:
+                    future.set_result(self.api._get_result_or_raise_error(reply))
+                except JadeError as e:
+                    future.set_exception(e)
+
+            # If not even the first request fitted (alongside the others) it has a large
+            # reply, so send it on its own - as any single request fits.
+            assert len(deferred) < len(chunk) or len(chunk) > 1, 'No progress made sending batch'
+            max_requests = 1 if len(deferred) == len(chunk) else self.max_requests
+            items = deferred + items
+
+        return [future.exception() or future.result() for future in futures]
+
+
 #
 # Mid-level interface to Jade
 # Wraps either a serial or a ble connection
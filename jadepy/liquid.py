@@ -0,0 +1,257 @@
+import os
+import struct
+import logging
+import collections
+import concurrent.futures
+
+import wallycore as wally
+
+from .jade import MAX_SHARED_NONCE_OUTPUTS
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# Maximum number of batches of rangeproof rewinds queued in the process pool
+DEFAULT_MAX_PENDING_BATCHES = 8
+
+# Rangeproof parameters used when blinding outputs
+RANGEPROOF_MIN_VALUE = 1
+RANGEPROOF_EXPONENT = 0
+RANGEPROOF_MIN_BITS = 52
+
+# A blinded (confidential) output, as needed to unblind it
+BlindedOutput = collections.namedtuple('BlindedOutput', ['script', 'nonce_commitment',
+                                                         'value_commitment', 'asset_generator',
+                                                         'rangeproof'])
+
+# The secrets of an unblinded output - 'index' is as passed to the unblinder
+# (eg. the output index in the tx) and 'asset' is the asset-id in consensus
+# order (ie. reversed compared to how it is normally displayed).
+# If the output could not be unblinded the secrets are None.
+UnblindedOutput = collections.namedtuple('UnblindedOutput', ['index', 'asset', 'value',
+                                                             'abf', 'vbf'])
+
+
+# Get the blinded outputs from an (elements) transaction
+# Returns a list of (output index, BlindedOutput) - unblinded outputs (eg. fee) are skipped.
+def get_blinded_outputs(txn):
+    tx = wally.tx_from_bytes(txn, wally.WALLY_TX_FLAG_USE_ELEMENTS |
+                             wally.WALLY_TX_FLAG_USE_WITNESS)
+    outputs = []
+    for i in range(wally.tx_get_num_outputs(tx)):
+        nonce_commitment = wally.tx_get_output_nonce(tx, i)
+        rangeproof = wally.tx_get_output_rangeproof(tx, i)
+        if len(nonce_commitment) != wally.EC_PUBLIC_KEY_LEN or not rangeproof:
+            continue
+        outputs.append((i, BlindedOutput(wally.tx_get_output_script(tx, i),
+                                         nonce_commitment,
+                                         wally.tx_get_output_value(tx, i),
+                                         wally.tx_get_output_asset(tx, i),
+                                         rangeproof)))
+    return outputs
+
+
+# Rewind the rangeproofs of the passed outputs, given their (hashed) shared nonces.
+# 'items' is a list of (index, nonce, BlindedOutput) - returns a list of UnblindedOutput.
+# NOTE: module-level so can be run in a process pool.
+def unblind_outputs(items):
+    results = []
+    for index, nonce, output in items:
+        try:
+            value, asset, abf, vbf = wally.asset_unblind_with_nonce(nonce, output.rangeproof,
+                                                                    output.value_commitment,
+                                                                    output.script,
+                                                                    output.asset_generator)
+            results.append(UnblindedOutput(index, asset, value, abf, vbf))
+        except ValueError as e:
+            logger.warning('Failed to unblind output {}: {}'.format(index, e))
+            results.append(UnblindedOutput(index, None, None, None, None))
+    return results
+
+
+#
+# Unblinds Liquid outputs received by the wallet on the hw.
+#
+# The shared nonces are fetched from the hw in batches (using the multi-output
+# get_shared_nonce call), and the rangeproofs are rewound in a process pool
+# while the next batch is fetched.  The unblinded outputs are yielded as they
+# become available, in the order passed.
+#
+class JadeUnblinder:
+    def __init__(self, jade, batch_size=None, max_workers=None, max_pending=None):
+        assert batch_size is None or 0 < batch_size <= MAX_SHARED_NONCE_OUTPUTS
+        self.jade = jade
+        self.batch_size = batch_size or MAX_SHARED_NONCE_OUTPUTS
+        self.max_workers = max_workers
+        self.max_pending = max_pending or DEFAULT_MAX_PENDING_BATCHES
+
+    @staticmethod
+    def _batches(indexed_outputs, batch_size):
+        batch = []
+        for item in indexed_outputs:
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Generator - unblind the passed (index, BlindedOutput) items
+    def _unblind(self, indexed_outputs):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = collections.deque()
+            for batch in self._batches(indexed_outputs, self.batch_size):
+                nonces = self.jade.get_shared_nonces([(output.script, output.nonce_commitment)
+                                                      for index, output in batch])
+                assert len(nonces) == len(batch)
+                items = [(index, nonce, output) for (index, output), nonce in zip(batch, nonces)]
+                pending.append(pool.submit(unblind_outputs, items))
+
+                # Yield any results already available, and bound the work in flight
+                while pending and (pending[0].done() or len(pending) > self.max_pending):
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+    # Generator - unblind the passed BlindedOutputs, yielding an UnblindedOutput
+    # for each, where 'index' is the position in the passed iterable.
+    def unblind(self, outputs):
+        return self._unblind(enumerate(outputs))
+
+    # Generator - unblind the blinded outputs of the passed (elements) transaction,
+    # yielding an UnblindedOutput for each, where 'index' is the output index.
+    def unblind_tx(self, txn):
+        return self._unblind(get_blinded_outputs(txn))
+
+
+# Compute the (bip143-style) hash_prevouts for the inputs of a wally tx - as used
+# by the hw to derive the blinding factors for the tx outputs.
+def get_hash_prevouts(tx):
+    prevouts = bytearray()
+    for i in range(wally.tx_get_num_inputs(tx)):
+        prevouts += wally.tx_get_input_txhash(tx, i)
+        prevouts += struct.pack('<I', wally.tx_get_input_index(tx, i))
+    return wally.sha256d(bytes(prevouts))
+
+
+def _random_private_key():
+    while True:
+        key = os.urandom(wally.EC_PRIVATE_KEY_LEN)
+        try:
+            wally.ec_private_key_verify(key)
+            return key
+        except ValueError:
+            pass
+
+
+# Generate the nonce commitment, rangeproof and surjectionproof for a blinded output.
+# 'input_assets', 'input_abfs' and 'input_generators' are the concatenated values
+# for all the tx inputs (in that order).
+# NOTE: module-level so can be run in a process pool.
+def make_output_proofs(asset, value, abf, vbf, asset_generator, value_commitment, script,
+                       blinding_key, input_assets, input_abfs, input_generators):
+    ephemeral_key = _random_private_key()
+    nonce_commitment = wally.ec_public_key_from_private_key(ephemeral_key)
+    rangeproof = wally.asset_rangeproof(value, blinding_key, ephemeral_key, asset, abf, vbf,
+                                        value_commitment, script, asset_generator,
+                                        RANGEPROOF_MIN_VALUE, RANGEPROOF_EXPONENT,
+                                        RANGEPROOF_MIN_BITS)
+    surjectionproof = wally.asset_surjectionproof(asset, abf, asset_generator, os.urandom(32),
+                                                  input_assets, input_abfs, input_generators)
+    return nonce_commitment, rangeproof, surjectionproof
+
+
+#
+# Blinds Liquid transactions using blinding factors and commitments from the hw.
+#
+# Takes an unblinded transaction (explicit output assets and values), the secrets
+# of the inputs being spent (asset, value, abf and vbf - eg. UnblindedOutput from
+# the JadeUnblinder above) and the blinding (public) key of each output to blind.
+#
+# The blinding factors and commitments for all outputs are fetched from the hw
+# in one 'batch' message, then the final vbf (balancing the commitments) is computed
+# and the commitments for the last output fetched.  The output rangeproofs and
+# surjectionproofs are then generated in a process pool.
+#
+# Returns the blinded tx and the 'trusted_commitments' to pass to sign_liquid_tx().
+#
+class JadeBlinder:
+    def __init__(self, jade, max_workers=None):
+        self.jade = jade
+        self.max_workers = max_workers
+
+    # Fetch the commitments for all outputs except the last, and the abf for the
+    # last output, from the hw in a single (pipelined) pass.
+    def _get_initial_factors(self, hash_prevouts, outputs):
+        *others, (last_index, last_asset, last_value) = outputs
+        with self.jade.batch() as batch:
+            commitments = [batch.get_commitments(asset[::-1], value, hash_prevouts, index)
+                           for index, asset, value in others]
+            last_abf = batch.get_blinding_factor(hash_prevouts, last_index, 'ASSET')
+        return [c.result() for c in commitments], last_abf.result()
+
+    # Blind the passed tx - 'input_secrets' has an entry for each tx input, and
+    # 'blinding_keys' an entry for each output (None for outputs not to be blinded,
+    # eg. the fee output).  Assets are as in the tx (ie. not reversed for display).
+    # Returns the blinded tx bytes, and the trusted_commitments (one per output).
+    def blind_tx(self, txn, input_secrets, blinding_keys):
+        tx = wally.tx_from_bytes(txn, wally.WALLY_TX_FLAG_USE_ELEMENTS |
+                                 wally.WALLY_TX_FLAG_USE_WITNESS)
+        num_inputs = wally.tx_get_num_inputs(tx)
+        num_outputs = wally.tx_get_num_outputs(tx)
+        assert len(input_secrets) == num_inputs
+        assert len(blinding_keys) == num_outputs
+
+        # The outputs to blind - must have explicit asset and value
+        outputs = []
+        for i, blinding_key in enumerate(blinding_keys):
+            if blinding_key is not None:
+                asset = wally.tx_get_output_asset(tx, i)
+                value = wally.tx_get_output_value(tx, i)
+                assert asset[0] == 1 and value[0] == 1, 'Output {} already blinded'.format(i)
+                outputs.append((i, asset[1:], wally.tx_confidential_value_to_satoshi(value)))
+        assert outputs, 'No outputs to blind'
+
+        # Get the blinding factors and commitments from the hw
+        hash_prevouts = get_hash_prevouts(tx)
+        commitments, last_abf = self._get_initial_factors(hash_prevouts, outputs)
+
+        # Compute the final vbf which balances the inputs and outputs, and get
+        # the hw commitments using that vbf for the last output.
+        values = [secret.value for secret in input_secrets] + [v for i, a, v in outputs]
+        abfs = b''.join([secret.abf for secret in input_secrets] +
+                        [c['abf'] for c in commitments] + [last_abf])
+        vbfs = b''.join([secret.vbf for secret in input_secrets] + [c['vbf'] for c in commitments])
+        final_vbf = wally.asset_final_vbf(values, num_inputs, abfs, vbfs)
+
+        last_index, last_asset, last_value = outputs[-1]
+        commitments.append(self.jade.get_commitments(last_asset[::-1], last_value, hash_prevouts,
+                                                     last_index, vbf=final_vbf))
+
+        # Generate the proofs for all blinded outputs in parallel
+        input_assets = b''.join(secret.asset for secret in input_secrets)
+        input_abfs = b''.join(secret.abf for secret in input_secrets)
+        input_generators = b''.join(wally.asset_generator_from_bytes(secret.asset, secret.abf)
+                                    for secret in input_secrets)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(make_output_proofs, asset, value, c['abf'], c['vbf'],
+                                   c['asset_generator'], c['value_commitment'],
+                                   wally.tx_get_output_script(tx, index), blinding_keys[index],
+                                   input_assets, input_abfs, input_generators)
+                       for (index, asset, value), c in zip(outputs, commitments)]
+            proofs = [future.result() for future in futures]
+
+        # Update the tx outputs, and collect the trusted commitments
+        trusted_commitments = [None] * num_outputs
+        for (index, asset, value), c, (nonce_commitment, rangeproof, surjectionproof) in \
+                zip(outputs, commitments, proofs):
+            wally.tx_set_output_asset(tx, index, c['asset_generator'])
+            wally.tx_set_output_value(tx, index, c['value_commitment'])
+            wally.tx_set_output_nonce(tx, index, nonce_commitment)
+            wally.tx_set_output_rangeproof(tx, index, rangeproof)
+            wally.tx_set_output_surjectionproof(tx, index, surjectionproof)
+
+            trusted_commitments[index] = dict(c, blinding_key=blinding_keys[index])
+
+        return wally.tx_to_bytes(tx, wally.WALLY_TX_FLAG_USE_WITNESS), trusted_commitments
@@ -0,0 +1,61 @@
+import logging
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# Counters which cannot be diffed (ie. are maxima or sizes) - taken as at the end
+NON_CUMULATIVE_FIELDS = ('max_us', 'high_water', 'size')
+
+
+def _diff_counters(before, after):
+    diff = {}
+    for key, value in after.items():
+        prior = before.get(key) if isinstance(before, dict) else None
+        if isinstance(value, dict):
+            diff[key] = _diff_counters(prior or {}, value)
+        elif key in NON_CUMULATIVE_FIELDS:
+            diff[key] = value
+        else:
+            diff[key] = value - (prior or 0)
+
+    # Add the average time where we have a count and a total
+    if diff.get('count') and 'total_us' in diff:
+        diff['avg_us'] = diff['total_us'] / diff['count']
+    return diff
+
+
+# Diff two sets of hw perf counters (as returned by JadeAPI.get_perf_stats()), returning
+# the counters for the interval between them.  Counts and totals are subtracted (and
+# averages added), while maxima and ring buffer high-water marks are as at the end.
+# Task run times (if reported) are converted to the percentage of cpu time over the
+# interval - NOTE: on a dual-core hw these can sum to 200%.
+def diff_perf_stats(before, after):
+    stats = _diff_counters(before, {k: v for k, v in after.items() if k != 'tasks'})
+
+    if 'tasks' in after and stats.get('total_runtime'):
+        total = stats.pop('total_runtime')
+        prior_tasks = before.get('tasks', {})
+        stats['task_cpu_pct'] = {name: (runtime - prior_tasks.get(name, 0)) * 100 / total
+                                 for name, runtime in after['tasks'].items()}
+    return stats
+
+
+# Log a summary of diffed hw perf counters
+def log_perf_stats(stats):
+    logger.info('Perf stats over {:.2f}s'.format(stats['uptime_us'] / 1000000))
+    for name, timing in sorted(stats['methods'].items(), key=lambda kv: -kv[1]['total_us']):
+        if timing['count']:
+            logger.info('  {}: {} calls, avg {:.0f}us, max {}us'.format(
+                name, timing['count'], timing['avg_us'], timing['max_us']))
+    for name, counters in stats['sources'].items():
+        logger.info('  {}: {} msgs ({} bytes) in, {} msgs ({} bytes) out'.format(
+            name, counters['msgs_in'], counters['bytes_in'],
+            counters['msgs_out'], counters['bytes_out']))
+    for name, ring in stats['rings'].items():
+        logger.info('  {} ring: high-water {} of {}'.format(name, ring['high_water'], ring['size']))
+    for name, timing in stats['timers'].items():
+        if timing['count']:
+            logger.info('  {}: {} calls, total {}us, max {}us'.format(
+                name, timing['count'], timing['total_us'], timing['max_us']))
+    for name, pct in sorted(stats.get('task_cpu_pct', {}).items(), key=lambda kv: -kv[1]):
+        logger.info('  task {}: {:.1f}%'.format(name, pct))
@@ -0,0 +1,238 @@
+import logging
+import collections
+import concurrent.futures
+
+from .cache import wallet_fingerprint
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# Maximum number of PSBTs being prepared ahead of the one being signed
+DEFAULT_MAX_PENDING = 8
+
+# The sign_tx request for a PSBT - the signing parameters ready to send to the hw,
+# and the signature hash (if any) the hw will sign for each input.
+SignTxRequest = collections.namedtuple('SignTxRequest', ['txn', 'inputs', 'change', 'sighashes'])
+
+
+# Get the paths of the keypaths for the passed wallet fingerprint, for a PSBT input or
+# output (as per the passed wally getters).
+def _get_keypaths(psbt, index, fingerprint, get_keypaths_size, get_keypath):
+    import wallycore as wally
+
+    paths = []
+    for subindex in range(get_keypaths_size(psbt, index)):
+        keypath = get_keypath(psbt, index, subindex)
+        if wally.keypath_get_fingerprint(keypath) == fingerprint:
+            paths.append(wally.keypath_get_path(keypath))
+    return paths
+
+
+# Get the pubkey which made a (der, with sighash byte) signature over the passed signature
+# hash, and which is one of the PSBT input's keypaths.
+# NOTE: wally exposes the keypath fingerprints and paths but not their pubkeys, so the
+# pubkey is recovered from the signature and looked up in the input's keypaths.
+def _get_signing_pubkey(psbt, index, sighash, signature):
+    import wallycore as wally
+
+    compact = wally.ec_sig_from_der(signature[:-1])
+    for recovery_id in range(4):
+        try:
+            pubkey = wally.ec_sig_to_public_key(sighash, bytes([31 + recovery_id]) + compact)
+        except ValueError:
+            continue
+        if wally.psbt_find_input_keypath(psbt, index, pubkey):
+            return pubkey
+    raise ValueError('Signature for input {} does not match its keypaths'.format(index))
+
+
+def _get_optional(fn, psbt, index):
+    try:
+        return fn(psbt, index)
+    except ValueError:
+        return None
+
+
+# Get the script to sign for a prevout script - ie. the 'script' passed to sign_tx
+# Returns (script, is_witness)
+def _get_signing_script(prevout_script, redeem_script, witness_script):
+    import wallycore as wally
+
+    script = prevout_script
+    script_type = wally.scriptpubkey_get_type(script)
+    if script_type == wally.WALLY_SCRIPT_TYPE_P2SH:
+        assert redeem_script, 'Redeem script missing for p2sh input'
+        script = redeem_script
+        script_type = wally.scriptpubkey_get_type(script)
+
+    if script_type == wally.WALLY_SCRIPT_TYPE_P2WPKH:
+        return wally.scriptpubkey_p2pkh_from_bytes(script[2:], 0), True
+    elif script_type == wally.WALLY_SCRIPT_TYPE_P2WSH:
+        assert witness_script, 'Witness script missing for p2wsh input'
+        return witness_script, True
+    return script, False
+
+
+# Get the single-sig change variant for an output script
+def _get_change_variant(script, redeem_script):
+    import wallycore as wally
+
+    script_type = wally.scriptpubkey_get_type(script)
+    if script_type == wally.WALLY_SCRIPT_TYPE_P2PKH:
+        return 'pkh(k)'
+    elif script_type == wally.WALLY_SCRIPT_TYPE_P2WPKH:
+        return 'wpkh(k)'
+    elif script_type == wally.WALLY_SCRIPT_TYPE_P2SH and redeem_script and \
+            wally.scriptpubkey_get_type(redeem_script) == wally.WALLY_SCRIPT_TYPE_P2WPKH:
+        return 'sh(wpkh(k))'
+    return None
+
+
+# Convert a (base64, v0) PSBT into the parameters for sign_tx, signing the inputs
+# with keypaths for the passed wallet fingerprint.  Single-sig outputs with
+# keypaths for the wallet are passed as change.
+# NOTE: module-level so can be run in a process pool.
+def psbt_to_sign_tx_request(psbt_b64, fingerprint):
+    import wallycore as wally
+
+    psbt = wally.psbt_from_base64(psbt_b64, 0)
+    assert wally.psbt_get_version(psbt) == 0, 'Only v0 PSBTs supported'
+
+    tx = wally.psbt_get_global_tx(psbt)
+    num_inputs = wally.tx_get_num_inputs(tx)
+    num_outputs = wally.tx_get_num_outputs(tx)
+
+    inputs, sighashes = [], []
+    for i in range(num_inputs):
+        utxo = _get_optional(wally.psbt_get_input_utxo, psbt, i)
+        witness_utxo = _get_optional(wally.psbt_get_input_witness_utxo, psbt, i)
+        if witness_utxo:
+            prevout_script = wally.tx_output_get_script(witness_utxo)
+            satoshi = wally.tx_output_get_satoshi(witness_utxo)
+        else:
+            assert utxo, 'No utxo for input {}'.format(i)
+            vout = wally.tx_get_input_index(tx, i)
+            prevout_script = wally.tx_get_output_script(utxo, vout)
+            satoshi = wally.tx_get_output_satoshi(utxo, vout)
+
+        script, is_witness = _get_signing_script(
+            prevout_script,
+            _get_optional(wally.psbt_get_input_redeem_script, psbt, i),
+            _get_optional(wally.psbt_get_input_witness_script, psbt, i))
+
+        txinput = {'is_witness': is_witness}
+        if utxo:
+            txinput['input_tx'] = wally.tx_to_bytes(utxo, 0)
+        else:
+            txinput['satoshi'] = wally.tx_output_get_satoshi(witness_utxo)
+
+        # Sign with the first keypath for the wallet (as the hw signs SIGHASH_ALL)
+        sighash = None
+        paths = _get_keypaths(psbt, i, fingerprint, wally.psbt_get_input_keypaths_size,
+                              wally.psbt_get_input_keypath)
+        if paths:
+            txinput['script'] = script
+            txinput['path'] = paths[0]
+            flags = wally.WALLY_TX_FLAG_USE_WITNESS if is_witness else 0
+            sighash = wally.tx_get_btc_signature_hash(tx, i, script, satoshi,
+                                                      wally.WALLY_SIGHASH_ALL, flags)
+        inputs.append(txinput)
+        sighashes.append(sighash)
+
+    change = [None] * num_outputs
+    for i in range(num_outputs):
+        paths = _get_keypaths(psbt, i, fingerprint, wally.psbt_get_output_keypaths_size,
+                              wally.psbt_get_output_keypath)
+        if len(paths) == 1:
+            variant = _get_change_variant(wally.tx_get_output_script(tx, i),
+                                          _get_optional(wally.psbt_get_output_redeem_script,
+                                                        psbt, i))
+            if variant:
+                change[i] = {'path': paths[0], 'variant': variant}
+
+    txn = wally.tx_to_bytes(tx, 0)
+    return SignTxRequest(txn, inputs, change if any(change) else None, sighashes)
+
+
+# Add the signatures returned by the hw to the PSBT - returns the updated PSBT (base64)
+# NOTE: module-level so can be run in a process pool.
+def merge_psbt_signatures(psbt_b64, sighashes, signatures):
+    import wallycore as wally
+
+    psbt = wally.psbt_from_base64(psbt_b64, 0)
+    assert len(sighashes) == len(signatures) == wally.psbt_get_num_inputs(psbt)
+    for i, (sighash, signature) in enumerate(zip(sighashes, signatures)):
+        if sighash and signature:
+            pubkey = _get_signing_pubkey(psbt, i, sighash, signature)
+            wally.psbt_add_input_signature(psbt, i, pubkey, signature)
+    return wally.psbt_to_base64(psbt, 0)
+
+
+#
+# Signs a stream of PSBTs with a Jade, as a pipeline.
+#
+# Upcoming PSBTs are parsed and converted into sign_tx parameters in a process
+# pool while the hw is signing the current one, and the returned signatures are
+# merged back into the PSBTs in the pool while the hw signs the next.  At most
+# 'max_pending' PSBTs are prepared ahead.
+#
+# Inputs are signed if they have a keypath for the hw wallet (by fingerprint).
+# NOTE: Liquid PSETs are not supported.
+#
+class JadePsbtSigner:
+    def __init__(self, jade, network, max_workers=None, max_pending=None, validate=False):
+        self.jade = jade
+        self.network = network
+        self.max_workers = max_workers
+        self.max_pending = max_pending or DEFAULT_MAX_PENDING
+        self.validate = validate
+        self.fingerprint = None
+
+    # Fetch (once) the hw wallet fingerprint
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            root_xpub = self.jade.get_xpub(self.network, [])
+            self.fingerprint = bytes.fromhex(wallet_fingerprint(root_xpub))
+        return self.fingerprint
+
+    def _sign_request(self, request):
+        return self.jade.sign_tx(self.network, request.txn, request.inputs, request.change,
+                                 validate=self.validate)
+
+    # Generator - sign the passed (base64) PSBTs, yielding the updated PSBTs in order
+    def sign(self, psbts):
+        fingerprint = self.get_fingerprint()
+        psbts = iter(psbts)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            preparing = collections.deque()
+            merging = collections.deque()
+
+            def _prepare_next():
+                for psbt in psbts:
+                    preparing.append((psbt, pool.submit(psbt_to_sign_tx_request, psbt,
+                                                        fingerprint)))
+                    if len(preparing) >= self.max_pending:
+                        break
+
+            _prepare_next()
+            while preparing:
+                psbt, future = preparing.popleft()
+                _prepare_next()
+
+                request = future.result()
+                signatures = self._sign_request(request)
+                merging.append(pool.submit(merge_psbt_signatures, psbt, request.sighashes,
+                                           signatures))
+
+                # Yield any updated PSBTs already available
+                while merging and merging[0].done():
+                    yield merging.popleft().result()
+
+            while merging:
+                yield merging.popleft().result()
+
+    # Sign a single (base64) PSBT - returns the updated PSBT
+    def sign_psbt(self, psbt):
+        request = psbt_to_sign_tx_request(psbt, self.get_fingerprint())
+        return merge_psbt_signatures(psbt, request.sighashes, self._sign_request(request))
@@ -0,0 +1,218 @@
+import csv
+import json
+import time
+import logging
+import threading
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# The get_version_info memory fields sampled
+MEMORY_FIELDS = ['JADE_FREE_HEAP', 'JADE_FREE_DRAM', 'JADE_LARGEST_DRAM',
+                 'JADE_FREE_SPIRAM', 'JADE_LARGEST_SPIRAM']
+
+# Fields written per sample (before the memory fields)
+SAMPLE_FIELDS = ['time', 'rpc']
+
+
+# Fragmentation of a memory region - ie. how much of the free memory is not
+# available as the largest free block (0 = none, approaching 1 = badly fragmented)
+def _fragmentation(free, largest):
+    return 1 - (largest / free) if free else 0
+
+
+# Least-squares slope of values against times (ie. change per second)
+def _slope(times, values):
+    n = len(times)
+    if n < 2:
+        return 0
+    mean_t = sum(times) / n
+    mean_v = sum(values) / n
+    var_t = sum((t - mean_t) ** 2 for t in times)
+    if not var_t:
+        return 0
+    return sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values)) / var_t
+
+
+# Summarise a list of samples (as returned by JadeTelemetrySampler.samples):
+# per memory field the initial, minimum (and the rpc active at that point) and final
+# values, the peak use (initial - minimum) and the trend (bytes per second - a steady
+# negative trend under sustained load suggests a leak).  Also the trend in dram and
+# spiram fragmentation (per second).
+# NOTE: samples are only taken between calls, never while the hw is processing one, so
+# any transient use within a call is not captured - 'min' and 'peak_use' are the lowest
+# and highest seen between calls, not the true extremes.
+def summarise_samples(samples):
+    if not samples:
+        return {}
+
+    times = [sample['time'] for sample in samples]
+    summary = {'num_samples': len(samples), 'duration': times[-1] - times[0]}
+    for field in MEMORY_FIELDS:
+        values = [sample[field] for sample in samples if sample.get(field) is not None]
+        if not values:
+            continue
+        lowest = min((sample for sample in samples if sample.get(field) is not None),
+                     key=lambda sample: sample[field])
+        summary[field] = {'initial': values[0],
+                          'min': lowest[field],
+                          'min_rpc': lowest['rpc'],
+                          'final': values[-1],
+                          'peak_use': values[0] - lowest[field],
+                          'trend': _slope([s['time'] for s in samples if s.get(field) is not None],
+                                          values)}
+
+    for region in ['DRAM', 'SPIRAM']:
+        free, largest = 'JADE_FREE_' + region, 'JADE_LARGEST_' + region
+        fragmentation = [(s['time'], _fragmentation(s[free], s[largest]))
+                         for s in samples if s.get(free) and s.get(largest)]
+        if fragmentation:
+            summary[region.lower() + '_fragmentation'] = {
+                'initial': fragmentation[0][1],
+                'max': max(f for t, f in fragmentation),
+                'final': fragmentation[-1][1],
+                'trend': _slope([t for t, f in fragmentation], [f for t, f in fragmentation])}
+    return summary
+
+
+def log_summary(summary):
+    logger.info('Telemetry: {num_samples} samples over {duration:.1f}s'.format(**summary))
+    for field in MEMORY_FIELDS:
+        if field in summary:
+            stats = summary[field]
+            logger.info('  {}: {} -> {} (min {} during {}), peak use {}, trend {:.1f} b/s'.format(
+                field, stats['initial'], stats['final'], stats['min'], stats['min_rpc'],
+                stats['peak_use'], stats['trend']))
+    for region in ['dram', 'spiram']:
+        stats = summary.get(region + '_fragmentation')
+        if stats:
+            logger.info('  {} fragmentation: {:.3f} -> {:.3f} (max {:.3f}), trend {:.5f}/s'.format(
+                region, stats['initial'], stats['final'], stats['max'], stats['trend']))
+
+
+#
+# Samples the hw memory stats (from get_version_info) over time, while a workload runs.
+#
+# The workload should make its calls through 'sampler.api' - a proxy for the JadeAPI
+# which records the rpc being run, and ensures the sampler only calls the hw between
+# workload calls (as most calls cannot be interleaved with other messages).
+# Samples are taken every 'interval' seconds in a background thread (as soon as
+# the hw is free), and/or explicitly by calling sample().  Each sample is annotated
+# with the rpc active when it was due (or the passed label).
+#
+# If 'path' is passed the samples are also written to that file as they are taken,
+# as csv or (if the path ends in '.jsonl') json lines.
+#
+# NOTE: any direct use of the underlying JadeInterface (api.jade) is not guarded.
+#
+class JadeTelemetrySampler:
+    def __init__(self, jade, interval=None, path=None):
+        assert interval is None or interval > 0
+        self.jade = jade
+        self.interval = interval
+        self.path = path
+        self.samples = []
+
+        self.api = _SampledJadeAPI(self)
+        self.lock = threading.RLock()
+        self.state_lock = threading.Lock()
+        self.active = None
+        self.due = None
+        self.start_time = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.outfile = None
+        self.writer = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        assert self.thread is None and self.start_time is None
+        self.start_time = time.time()
+        if self.path:
+            self.outfile = open(self.path, 'w', newline='')
+            if not self.path.endswith('.jsonl'):
+                self.writer = csv.DictWriter(self.outfile, SAMPLE_FIELDS + MEMORY_FIELDS)
+                self.writer.writeheader()
+
+        self.sample('start')
+        if self.interval:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+        self.sample('end')
+        if self.outfile:
+            self.outfile.close()
+            self.outfile = None
+            self.writer = None
+
+    # If a workload call is in progress the sample is taken by the workload thread
+    # as soon as that call completes - otherwise it is taken now.
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            with self.state_lock:
+                if self.active:
+                    self.due = self.active
+                    continue
+            self.sample()
+
+    # Take a sample now (or once the current workload call completes), annotated with
+    # the passed label or the rpc currently active.  Returns the sample.
+    def sample(self, label=None):
+        rpc = label or self.active
+        with self.lock:
+            info = self.jade.get_version_info()
+
+            sample = {'time': time.time() - self.start_time, 'rpc': rpc}
+            sample.update({field: info.get(field) for field in MEMORY_FIELDS})
+            self.samples.append(sample)
+
+            if self.writer:
+                self.writer.writerow(sample)
+                self.outfile.flush()
+            elif self.outfile:
+                self.outfile.write(json.dumps(sample) + '\n')
+                self.outfile.flush()
+        return sample
+
+    def summary(self):
+        return summarise_samples(self.samples)
+
+    def _call(self, name, fn, *args, **kwargs):
+        with self.lock:
+            with self.state_lock:
+                self.active = name
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.state_lock:
+                    self.active, due, self.due = None, self.due, None
+                if due:
+                    self.sample(due)
+
+
+# Proxy for a JadeAPI, whose method calls are made via the JadeTelemetrySampler
+class _SampledJadeAPI:
+    def __init__(self, sampler):
+        self._sampler = sampler
+
+    def __getattr__(self, name):
+        attr = getattr(self._sampler.jade, name)
+        if not callable(attr):
+            return attr
+
+        def _sampled(*args, **kwargs):
+            return self._sampler._call(name, attr, *args, **kwargs)
+        return _sampled
@@ -0,0 +1,247 @@
+import logging
+
+import wallycore as wally
+
+from .jade import JadeError
+from .addresses import NETWORK_PARAMS, is_liquid, VARIANTS
+
+# 'jade' logger
+logger = logging.getLogger('jade')
+
+# Error code used by the hw for invalid parameters
+BAD_PARAMETERS = -32602
+
+# Limits - mirror the firmware's cbor_rpc.h and wallet.c
+MAX_PATH_LEN = 16
+MAX_CSV_BLOCKS_ALLOWED = 65535
+UINT32_MAX = 0xFFFFFFFF
+
+# Lengths of the trusted commitments fields - mirror the firmware's rpc_get_commitments_allocate()
+# (abf and vbf are not required by the hw, but are checked here if present)
+COMMITMENT_FIELD_LENGTHS = {'asset_generator': wally.ASSET_GENERATOR_LEN,
+                            'value_commitment': wally.ASSET_COMMITMENT_LEN,
+                            'hmac': wally.HMAC_SHA256_LEN,
+                            'asset_id': wally.ASSET_TAG_LEN,
+                            'blinding_key': wally.EC_PUBLIC_KEY_LEN}
+
+
+def _fail(message):
+    logger.warning('Pre-flight validation failed: {}'.format(message))
+    raise JadeError(BAD_PARAMETERS, message, None)
+
+
+def _is_uint(value, maximum=None):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0 \
+        and (maximum is None or value <= maximum)
+
+
+def _is_valid_path(path):
+    return isinstance(path, list) and 0 < len(path) <= MAX_PATH_LEN \
+        and all(_is_uint(i, UINT32_MAX) for i in path)
+
+
+def _is_bytes(value, length=None):
+    return isinstance(value, (bytes, bytearray)) and len(value) > 0 \
+        and (length is None or len(value) == length)
+
+
+def _expected_script_length(variant):
+    if variant == 'pkh(k)':
+        return wally.WALLY_SCRIPTPUBKEY_P2PKH_LEN
+    elif variant == 'wpkh(k)':
+        return wally.WALLY_SCRIPTPUBKEY_P2WPKH_LEN
+    return wally.WALLY_SCRIPTPUBKEY_P2SH_LEN
+
+
+def _check_network(network, liquid):
+    if not network or network not in NETWORK_PARAMS:
+        _fail('Failed to extract valid network from parameters')
+    if liquid and not is_liquid(network):
+        _fail('sign_liquid_tx call only appropriate for liquid network')
+    if not liquid and is_liquid(network):
+        _fail('sign_tx call not appropriate for liquid network')
+
+
+def _parse_tx(txn, flags, missing_msg):
+    if not _is_bytes(txn):
+        _fail(missing_msg)
+    try:
+        return wally.tx_from_bytes(txn, flags)
+    except (ValueError, TypeError):
+        _fail('Failed to extract tx from passed bytes')
+
+
+def _check_num_inputs(tx, inputs):
+    if not inputs:
+        _fail('Failed to extract valid number of inputs from parameters')
+    if len(inputs) != wally.tx_get_num_inputs(tx):
+        _fail('Unexpected number of inputs for transaction')
+
+
+# Mirrors the firmware's validate_change_paths() - except that the change
+# script cannot be regenerated without the hw keys, so only its length (per
+# script variant) and the csv blocks limit are checked.
+def _check_change(tx, change):
+    num_outputs = wally.tx_get_num_outputs(tx)
+    if len(change) != num_outputs:
+        _fail('Unexpected number of output (change) entries for transaction')
+
+    for i, entry in enumerate(change):
+        if not isinstance(entry, dict):
+            continue  # Not a change output
+
+        if not _is_valid_path(entry.get('path')):
+            _fail('Failed to extract valid change path from parameters')
+
+        variant = entry.get('variant')
+        if variant and variant not in VARIANTS:
+            _fail('Invalid script variant parameter')
+
+        # NOTE: the hw ignores a 'csv_blocks' which is not an unsigned integer
+        csv_blocks = entry.get('csv_blocks')
+        csv_blocks = csv_blocks if _is_uint(csv_blocks) else 0
+
+        script = wally.tx_get_output_script(tx, i)
+        if not script or len(script) != _expected_script_length(variant) \
+                or csv_blocks > MAX_CSV_BLOCKS_ALLOWED:
+            _fail('Change script cannot be validated')
+
+
+# Checks common to the inputs for sign_tx and sign_liquid_tx
+# Returns whether the input is to be signed (ie. has a path)
+def _check_input_path_and_script(txinput):
+    if not isinstance(txinput, dict) or not isinstance(txinput.get('is_witness'), bool):
+        _fail('Failed to extract is_witness from parameters')
+
+    if txinput.get('path') is None:
+        return False
+
+    if not _is_valid_path(txinput['path']):
+        _fail('Failed to extract valid path from parameters')
+    if not _is_bytes(txinput.get('script')):
+        _fail('Failed to extract script from parameters')
+    return True
+
+
+# Returns the amount of the prevout spent by input 'index' of 'tx'
+# 'prevout_amounts' records the amounts of later inputs spending an input_tx already seen.
+def _get_input_satoshi(tx, index, txinput, num_inputs, prevout_amounts):
+    input_tx = txinput.get('input_tx')
+    if input_tx is None and txinput.get('input_txhash') is not None:
+        # Reference to an input_tx passed for a prior input
+        if txinput['input_txhash'] != wally.tx_get_input_txhash(tx, index) or \
+                index not in prevout_amounts:
+            _fail('input_txhash cannot be resolved to a prior input_tx')
+        return prevout_amounts[index]
+
+    if input_tx is None:
+        # Full input tx can only be omitted for a single witness input
+        if not txinput['is_witness'] or num_inputs > 1:
+            _fail('Failed to extract input_tx from parameters')
+        if not _is_uint(txinput.get('satoshi')):
+            _fail('Failed to extract satoshi from parameters')
+        return txinput['satoshi']
+
+    try:
+        prevtx = wally.tx_from_bytes(input_tx, 0)
+    except (ValueError, TypeError):
+        _fail('Failed to extract input_tx')
+
+    if wally.tx_get_txid(prevtx) != wally.tx_get_input_txhash(tx, index):
+        _fail('input_tx cannot be verified against transaction input data')
+
+    vout = wally.tx_get_input_index(tx, index)
+    if wally.tx_get_num_outputs(prevtx) <= vout:
+        _fail('input_tx missing corresponding output')
+
+    txhash = wally.tx_get_input_txhash(tx, index)
+    for i in range(index + 1, num_inputs):
+        later_vout = wally.tx_get_input_index(tx, i)
+        if wally.tx_get_input_txhash(tx, i) == txhash and \
+                later_vout < wally.tx_get_num_outputs(prevtx):
+            prevout_amounts[i] = wally.tx_get_output_satoshi(prevtx, later_vout)
+
+    return wally.tx_get_output_satoshi(prevtx, vout)
+
+
+# Pre-flight validation of sign_tx parameters (see JadeAPI.sign_tx()) against the
+# firmware's sign_tx.c acceptance rules, so bad requests can be rejected before
+# the transaction and inputs are uploaded (or the user is prompted on the hw).
+# Raises JadeError (with the same message as the hw would return) if invalid.
+# NOTE: checks which require the hw keys (eg. change script derivation) are
+# left to the hw.
+def validate_sign_tx(network, txn, inputs, change):
+    _check_network(network, liquid=False)
+    tx = _parse_tx(txn, 0, 'Failed to extract tx from parameters')
+    _check_num_inputs(tx, inputs)
+
+    if isinstance(change, list):
+        _check_change(tx, change)
+
+    input_amount = 0
+    prevout_amounts = {}
+    for index, txinput in enumerate(inputs):
+        _check_input_path_and_script(txinput)
+        input_amount += _get_input_satoshi(tx, index, txinput, len(inputs), prevout_amounts)
+
+    if wally.tx_get_total_output_satoshi(tx) > input_amount:
+        _fail('Total input amounts less than total output amounts')
+
+
+# Check the trusted commitment for a confidential output is well formed and
+# internally consistent.  The hmac and the blinding factors' derivation from
+# hash_prevouts can only be verified by the hw.
+def _check_commitment(tx, index, commitment):
+    if not commitment:
+        _fail('Failed to verify asset_generator from commitments data')
+
+    if len(wally.tx_get_output_asset(tx, index)) != wally.ASSET_GENERATOR_LEN:
+        _fail('Failed to update tx asset_generator from commitments data')
+    if len(wally.tx_get_output_value(tx, index)) != wally.ASSET_COMMITMENT_LEN:
+        _fail('Failed to update tx value_commitment from commitments data')
+
+    # NOTE: asset_id as displayed, ie. reversed compared to consensus order
+    asset_id = bytes(reversed(commitment['asset_id']))
+    generator = commitment['asset_generator']
+    if commitment.get('abf') is not None:
+        if not _is_bytes(commitment['abf'], wally.BLINDING_FACTOR_LEN) or \
+                wally.asset_generator_from_bytes(asset_id, commitment['abf']) != generator:
+            _fail('Failed to verify asset_generator from commitments data')
+
+    if commitment.get('vbf') is not None:
+        if not _is_bytes(commitment['vbf'], wally.BLINDING_FACTOR_LEN) or \
+                wally.asset_value_commitment(commitment['value'], commitment['vbf'],
+                                             generator) != commitment['value_commitment']:
+            _fail('Failed to verify value_commitment from commitments data')
+
+
+# Pre-flight validation of sign_liquid_tx parameters (see JadeAPI.sign_liquid_tx())
+# against the firmware's sign_liquid_tx.c acceptance rules.
+# Raises JadeError (with the same message as the hw would return) if invalid.
+def validate_sign_liquid_tx(network, txn, inputs, commitments, change):
+    _check_network(network, liquid=True)
+    tx = _parse_tx(txn, wally.WALLY_TX_FLAG_USE_ELEMENTS, 'Failed to extract txn from parameters')
+    _check_num_inputs(tx, inputs)
+
+    # One entry per output, each null or a map with the expected fields
+    if not isinstance(commitments, list) or not commitments or \
+            not all(c is None or (isinstance(c, dict) and
+                                  all(_is_bytes(c.get(k), n)
+                                      for k, n in COMMITMENT_FIELD_LENGTHS.items()) and
+                                  _is_uint(c.get('value')))
+                    for c in commitments):
+        _fail('Failed to extract trusted commitments from parameters')
+    if len(commitments) != wally.tx_get_num_outputs(tx):
+        _fail('Unexpected number of trusted commitments for transaction')
+
+    if isinstance(change, list):
+        _check_change(tx, change)
+
+    for index, commitment in enumerate(commitments):
+        if wally.tx_get_output_value(tx, index)[0] != 1:
+            _check_commitment(tx, index, commitment)
+
+    for txinput in inputs:
+        if _check_input_path_and_script(txinput) and txinput['is_witness'] and \
+                not _is_bytes(txinput.get('value_commitment'), wally.ASSET_COMMITMENT_LEN):
+            _fail('Failed to extract value commitment from parameters')
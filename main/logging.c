@@ -2,6 +2,8 @@
 #include "process.h"
 #include "utils/cbor_rpc.h"
 #include <esp_log.h>
+#include <freertos/FreeRTOS.h>
+#include <freertos/task.h>
 #include <stdio.h>
 #include <string.h>
 
@@ -9,21 +11,70 @@ static size_t BUFFER_SIZE = 256;
 static size_t CBOR_OVERHEAD = 8;
 static const char* TRUNCATE_TAIL = "...";
 
-// Writes logging messages to the serial interface output buffer, ensuring
-// that logging messages are not interleaved on the serial interface with
-// application protocol messages
-int serial_logger(const char* message, va_list fmt)
+// Runtime log level and maximum log message rate (per second, 0 = unlimited)
+// NOTE: log messages are only sent over the serial interface
+static esp_log_level_t log_level = CONFIG_LOG_DEFAULT_LEVEL;
+static size_t max_log_rate = 0;
+
+// Rate-limit window
+static portMUX_TYPE rate_mutex = portMUX_INITIALIZER_UNLOCKED;
+static TickType_t window_start = 0;
+static size_t window_count = 0;
+static size_t dropped_count = 0;
+
+void logging_get_config(esp_log_level_t* level, size_t* max_rate)
 {
-    char buff[BUFFER_SIZE];
-    int written = vsnprintf(buff, sizeof(buff), message, fmt);
+    JADE_ASSERT(level);
+    JADE_ASSERT(max_rate);
 
-    if (written >= sizeof(buff)) {
-        // The message has been truncated, write "...\n" to the end
-        char* tail_begin = buff + sizeof(buff) - strlen(TRUNCATE_TAIL) - 1;
-        memcpy(tail_begin, TRUNCATE_TAIL, strlen(TRUNCATE_TAIL));
-        written = sizeof(buff) - 1;
+    *level = log_level;
+    *max_rate = max_log_rate;
+}
+
+void logging_set_config(const esp_log_level_t level, const size_t max_rate)
+{
+    JADE_ASSERT(level <= ESP_LOG_VERBOSE);
+
+    // NOTE: levels above the compile-time log level have no effect
+    esp_log_level_set("*", level);
+    log_level = level;
+
+    portENTER_CRITICAL(&rate_mutex);
+    max_log_rate = max_rate;
+    window_count = 0;
+    portEXIT_CRITICAL(&rate_mutex);
+}
+
+// Whether a log message can be sent now, given the maximum log rate.
+// If so, 'dropped' is set to the number of messages dropped since the last sent.
+static bool log_rate_check(size_t* dropped)
+{
+    JADE_ASSERT(dropped);
+    *dropped = 0;
+
+    bool allowed = true;
+    portENTER_CRITICAL(&rate_mutex);
+    if (max_log_rate) {
+        const TickType_t now = xTaskGetTickCount();
+        if (now - window_start >= pdMS_TO_TICKS(1000)) {
+            window_start = now;
+            window_count = 0;
+        }
+        allowed = window_count < max_log_rate;
+        if (allowed) {
+            ++window_count;
+            *dropped = dropped_count;
+            dropped_count = 0;
+        } else {
+            ++dropped_count;
+        }
     }
+    portEXIT_CRITICAL(&rate_mutex);
+    return allowed;
+}
 
+static void push_log_message(const char* message, const size_t len)
+{
     CborEncoder root_encoder;
     uint8_t cbor_buff[BUFFER_SIZE + CBOR_OVERHEAD];
     cbor_encoder_init(&root_encoder, cbor_buff, sizeof(cbor_buff), 0);
@@ -31,7 +82,7 @@ int serial_logger(const char* message, va_list fmt)
     CborError cberr = cbor_encoder_create_map(&root_encoder, &root_map_encoder, 1);
     JADE_ASSERT(cberr == CborNoError);
 
-    add_bytes_to_map(&root_map_encoder, "log", (uint8_t*)buff, written);
+    add_bytes_to_map(&root_map_encoder, "log", (const uint8_t*)message, len);
 
     cberr = cbor_encoder_close_container(&root_encoder, &root_map_encoder);
     JADE_ASSERT(cberr == CborNoError);
@@ -39,6 +90,36 @@ int serial_logger(const char* message, va_list fmt)
     const size_t towrite = cbor_encoder_get_buffer_size(&root_encoder, cbor_buff);
 
     jade_process_push_out_message((unsigned char*)cbor_buff, towrite, SOURCE_SERIAL);
+}
+
+// Writes logging messages to the serial interface output buffer, ensuring
+// that logging messages are not interleaved on the serial interface with
+// application protocol messages
+int serial_logger(const char* message, va_list fmt)
+{
+    // Drop the message if over the rate limit (before formatting it)
+    size_t dropped = 0;
+    if (!log_rate_check(&dropped)) {
+        return 0;
+    }
+
+    if (dropped) {
+        char note[64];
+        const int notelen = snprintf(note, sizeof(note), "(%u log messages dropped)\n", dropped);
+        JADE_ASSERT(notelen > 0 && notelen < sizeof(note));
+        push_log_message(note, notelen);
+    }
+
+    char buff[BUFFER_SIZE];
+    int written = vsnprintf(buff, sizeof(buff), message, fmt);
+
+    if (written >= sizeof(buff)) {
+        // The message has been truncated, write "...\n" to the end
+        char* tail_begin = buff + sizeof(buff) - strlen(TRUNCATE_TAIL) - 1;
+        memcpy(tail_begin, TRUNCATE_TAIL, strlen(TRUNCATE_TAIL));
+        written = sizeof(buff) - 1;
+    }
 
+    push_log_message(buff, written);
     return written;
 }
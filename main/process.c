@@ -4,6 +4,7 @@
 #include "process/process_utils.h"
 #include "utils/cbor_rpc.h"
 #include "utils/malloc_ext.h"
+#include "utils/perf.h"
 
 #include <freertos/FreeRTOS.h>
 #include <freertos/ringbuf.h>
@@ -13,6 +14,16 @@
 #include <ctype.h>
 #include <stdlib.h>
 
+// Ring buffer sizes
+// NOTE: The inbound ring buffer should be twice the size of the largest
+// valid input message, as the largest item the buffer will hold is just
+// under half its size.
+// The output ring buffers are quite generous because at startup, especially with
+// debug logging on, logging messages accumulate in the buffer before the
+// serial writer task starts running to clear them down.
+#define SHARED_IN_RING_SIZE (2 * MAX_INPUT_MSG_SIZE + 32)
+#define OUT_RING_SIZE (8 * 1024)
+
 static RingbufHandle_t shared_in = NULL;
 static RingbufHandle_t serial_out = NULL;
 static RingbufHandle_t ble_out = NULL;
@@ -21,6 +32,20 @@ static TaskHandle_t ble_handle;
 
 static char jade_id[16];
 
+// Reply capture - when active, message replies sent from the capturing task are
+// appended to the capture buffer rather than being pushed to the output queue.
+// Used to collect the replies to the sub-requests of a 'batch' request.
+typedef struct {
+    TaskHandle_t task;
+    uint8_t* buffer;
+    size_t buffer_len;
+    size_t written;
+    size_t count;
+    bool overflow;
+} reply_capture_t;
+
+static reply_capture_t reply_capture = { .task = NULL };
+
 #ifdef CONFIG_HEAP_TRACING
 
 #include <esp_heap_trace.h>
@@ -123,20 +148,13 @@ bool jade_process_init(TaskHandle_t** serial_h, TaskHandle_t** ble_h)
     deduce_jade_id();
 
     // Allocate ring buffer main storage areas into SPIRAM if available
-
-    // NOTE: The inbound ring buffer should be twice the size of the largest
-    // valid input message, as the largest item the buffer will hold is just
-    // under half its size.
-    shared_in = create_ringbuffer(2 * MAX_INPUT_MSG_SIZE + 32);
+    shared_in = create_ringbuffer(SHARED_IN_RING_SIZE);
     JADE_ASSERT(shared_in);
 
-    // The ring buffers are quite generous because at startup, especially with
-    // debug logging on, logging messages accumulate in the buffer before the
-    // serial writer task starts running to clear them down.
-    serial_out = create_ringbuffer(8 * 1024);
+    serial_out = create_ringbuffer(OUT_RING_SIZE);
     JADE_ASSERT(serial_out);
 
-    ble_out = create_ringbuffer(8 * 1024);
+    ble_out = create_ringbuffer(OUT_RING_SIZE);
     JADE_ASSERT(ble_out);
 
     // Serial/ble task handles
@@ -220,6 +238,9 @@ bool jade_process_push_in_message(const unsigned char* data, const size_t size)
         // wait for a spot in the ringbuffer
     }
 
+    perf_record_message_in(data[0], size - 1);
+    perf_record_ring_usage(
+        PERF_RING_SHARED_IN, SHARED_IN_RING_SIZE - xRingbufferGetCurFreeSize(shared_in), SHARED_IN_RING_SIZE);
     return true;
 }
 
@@ -249,11 +270,64 @@ void jade_process_push_out_message(const unsigned char* data, const size_t size,
         }
     }
 
+    perf_record_message_out(source, size);
+    perf_record_ring_usage(source == SOURCE_SERIAL ? PERF_RING_SERIAL_OUT : PERF_RING_BLE_OUT,
+        OUT_RING_SIZE - xRingbufferGetCurFreeSize(ring), OUT_RING_SIZE);
+
     if (handle) {
         xTaskNotify(handle, 0, eNoAction);
     }
 }
 
+void jade_process_start_reply_capture(uint8_t* buffer, const size_t buffer_len)
+{
+    JADE_ASSERT(buffer);
+    JADE_ASSERT(buffer_len);
+    JADE_ASSERT(!reply_capture.task);
+
+    reply_capture.task = xTaskGetCurrentTaskHandle();
+    reply_capture.buffer = buffer;
+    reply_capture.buffer_len = buffer_len;
+    reply_capture.written = 0;
+    reply_capture.count = 0;
+    reply_capture.overflow = false;
+}
+
+// Stop capturing replies - returns true if exactly one reply was captured
+// (and it fitted into the capture buffer), and outputs its length.
+bool jade_process_stop_reply_capture(size_t* written)
+{
+    JADE_ASSERT(written);
+    JADE_ASSERT(reply_capture.task == xTaskGetCurrentTaskHandle());
+
+    const bool ret = !reply_capture.overflow && reply_capture.count == 1;
+    *written = reply_capture.written;
+
+    reply_capture.task = NULL;
+    reply_capture.buffer = NULL;
+    reply_capture.buffer_len = 0;
+    return ret;
+}
+
+// Push a message reply to the output queue - or to the capture buffer if we are
+// capturing replies sent from the current task.
+// NOTE: logging messages do not come through here, so are never captured.
+static void push_reply_message(const uint8_t* data, const size_t size, const jade_msg_source_t source)
+{
+    if (reply_capture.task && reply_capture.task == xTaskGetCurrentTaskHandle()) {
+        ++reply_capture.count;
+        if (reply_capture.written + size > reply_capture.buffer_len) {
+            JADE_LOGE("Reply of size %u too large for capture buffer", size);
+            reply_capture.overflow = true;
+            return;
+        }
+        memcpy(reply_capture.buffer + reply_capture.written, data, size);
+        reply_capture.written += size;
+        return;
+    }
+    jade_process_push_out_message(data, size, source);
+}
+
 #ifdef CONFIG_HEAP_TRACING
 static void dump_mem_report()
 {
@@ -345,7 +419,7 @@ bool jade_process_get_out_message(void* ctx, bool (*writer)(void*, char*, size_t
 void jade_process_reply_to_message_ex(jade_msg_source_t source, const uint8_t* reply_payload, const size_t payload_len)
 {
     JADE_LOGD("jade_process_reply_to_message_ex %u", payload_len);
-    jade_process_push_out_message(reply_payload, payload_len, source);
+    push_reply_message(reply_payload, payload_len, source);
 }
 
 void jade_process_reply_to_message_result_with_id(const char* id, uint8_t* output, const size_t output_size,
@@ -393,6 +467,13 @@ void cbor_result_boolean_cb(const void* ctx, CborEncoder* container)
     JADE_ASSERT(cberr == CborNoError);
 }
 
+void cbor_result_uint_cb(const void* ctx, CborEncoder* container)
+{
+    const size_t val = *(const size_t*)ctx;
+    const CborError cberr = cbor_encode_uint(container, val);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
 void jade_process_reply_to_message_result(const cbor_msg_t ctx, const void* cbctx, cbor_encoder_fn_t cb)
 {
     JADE_ASSERT(cb);
@@ -430,7 +511,7 @@ void jade_process_reject_message_with_id(const char* id, int code, const char* m
     if (cbor_print_error_for(id, code, message, data, datalen, buffer, buffer_len, &towrite)
         || cbor_print_error_for(id, code, message, NULL, 0, buffer, buffer_len, &towrite)) {
         JADE_LOGI("jade_pushing out reject");
-        jade_process_push_out_message(buffer, towrite, source);
+        push_reply_message(buffer, towrite, source);
     } else {
         // Can't flatten message to buffer?
         JADE_LOGE("Failed to flatten error message to buffer of size %u", buffer_len);
@@ -476,5 +557,5 @@ void jade_process_reply_to_message_bytes(
     JADE_ASSERT(cberr == CborNoError);
     cberr = cbor_encoder_close_container(&root_encoder, &root_map_encoder);
     JADE_ASSERT(cberr == CborNoError);
-    jade_process_push_out_message(buffer, cbor_encoder_get_buffer_size(&root_encoder, buffer), ctx.source);
+    push_reply_message(buffer, cbor_encoder_get_buffer_size(&root_encoder, buffer), ctx.source);
 }
@@ -89,6 +89,10 @@ void jade_process_reject_message_with_id(const char* id, int code, const char* m
 void jade_process_reject_message_ex(cbor_msg_t ctx, int code, const char* message, const uint8_t* data, size_t datalen,
     uint8_t* buffer, size_t buffer_len);
 
+// Capture replies (from the current task) into a buffer rather than sending them
+void jade_process_start_reply_capture(uint8_t* buffer, size_t buffer_len);
+bool jade_process_stop_reply_capture(size_t* written);
+
 // Get in/out messages from the queues/ring-buffers
 void jade_process_get_in_message(void* ctx, void (*writer)(void*, unsigned char*, size_t), bool blocking);
 bool jade_process_get_out_message(void* ctx, bool (*)(void*, char*, size_t), jade_msg_source_t source);
@@ -97,6 +101,7 @@ bool jade_process_get_out_message(void* ctx, bool (*)(void*, char*, size_t), jad
 void cbor_result_bytes_cb(const void* ctx, CborEncoder* container);
 void cbor_result_string_cb(const void* ctx, CborEncoder* container);
 void cbor_result_boolean_cb(const void* ctx, CborEncoder* container);
+void cbor_result_uint_cb(const void* ctx, CborEncoder* container);
 
 void jade_process_reply_to_message_bytes(cbor_msg_t ctx, uint8_t* data, size_t datalen, uint8_t* buffer, size_t buflen);
 
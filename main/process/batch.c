@@ -0,0 +1,248 @@
+#include "../jade_assert.h"
+#include "../process.h"
+#include "../utils/cbor_rpc.h"
+#include "../utils/malloc_ext.h"
+
+#include <string.h>
+
+#include "process_utils.h"
+
+// Maximum number of sub-requests in a single batch request
+#define MAX_BATCH_REQUESTS 32
+
+// Space which must be available in the batch reply before a sub-request is
+// processed - enough for the reply to any of the batchable methods, except for
+// the multi-output get_shared_nonce, whose reply grows with the number of outputs.
+#define BATCH_ITEM_MAX_REPLY_SIZE 512
+
+// Additional reply space per output of a multi-output get_shared_nonce - the
+// cbor-encoded 32-byte nonce
+#define BATCH_NONCE_REPLY_SIZE (SHA256_LEN + 2)
+
+// Any single item must fit in a batch reply (with the reply header) on its own
+_Static_assert(
+    BATCH_ITEM_MAX_REPLY_SIZE + (MAX_SHARED_NONCE_OUTPUTS * BATCH_NONCE_REPLY_SIZE) + 64 <= MAX_OUTPUT_MSG_SIZE,
+    "Largest batch item reply too large");
+
+// Space reserved for the 'batch full' error reply to each unprocessed sub-request
+#define BATCH_ITEM_DEFERRED_REPLY_SIZE 64
+
+// Functional actions which can be batched
+void get_xpubs_process(void* process_ptr);
+void get_receive_address_process(void* process_ptr);
+void sign_message_process(void* process_ptr);
+void get_blinding_key_process(void* process_ptr);
+void get_shared_nonce_process(void* process_ptr);
+void get_blinding_factor_process(void* process_ptr);
+void get_commitments_process(void* process_ptr);
+
+// method_name should be a string literal - or at least non-null and null-terminated
+#define IS_METHOD(method_name) (!strncmp(method, method_name, method_len) && strlen(method_name) == method_len)
+
+// Get the task function for a method which can be included in a batch, or NULL if
+// the method cannot be batched (eg. multi-message flows like sign_tx or ota).
+// NOTE: the sub-requests are handled by the usual process functions, so any user
+// confirmations (eg. sign_message, get_receive_address) are still required per-item.
+static TaskFunction_t get_batchable_task_function(const char* method, const size_t method_len)
+{
+    if (IS_METHOD("get_xpub")) {
+        return get_xpubs_process;
+    } else if (IS_METHOD("get_receive_address")) {
+        return get_receive_address_process;
+    } else if (IS_METHOD("sign_message")) {
+        return sign_message_process;
+    } else if (IS_METHOD("get_blinding_key")) {
+        return get_blinding_key_process;
+    } else if (IS_METHOD("get_shared_nonce")) {
+        return get_shared_nonce_process;
+    } else if (IS_METHOD("get_blinding_factor")) {
+        return get_blinding_factor_process;
+    } else if (IS_METHOD("get_commitments")) {
+        return get_commitments_process;
+    }
+    return NULL;
+}
+
+// Whether the sub-request is for a range of receive addresses - not batchable, as its reply
+// is too large to be sure of fitting, and it is only confirmed by the user once processed.
+static bool is_ranged_receive_address(const char* method, const size_t method_len, const CborValue* item)
+{
+    CborValue params;
+    return IS_METHOD("get_receive_address")
+        && cbor_value_map_find_value(item, CBOR_RPC_TAG_PARAMS, &params) == CborNoError && cbor_value_is_map(&params)
+        && rpc_has_field_data("num_addresses", &params);
+}
+
+// The worst-case size of the reply to a sub-request.
+// NOTE: a multi-output get_shared_nonce with too many outputs is rejected (a small
+// error reply) so need not be accounted for here.
+static size_t get_batch_item_max_reply_size(const char* method, const size_t method_len, const CborValue* item)
+{
+    size_t max_reply_size = BATCH_ITEM_MAX_REPLY_SIZE;
+    if (IS_METHOD("get_shared_nonce")) {
+        CborValue params;
+        CborValue outputs;
+        size_t num_outputs = 0;
+        if (cbor_value_map_find_value(item, CBOR_RPC_TAG_PARAMS, &params) == CborNoError
+            && cbor_value_is_map(&params) && cbor_value_map_find_value(&params, "outputs", &outputs) == CborNoError
+            && cbor_value_is_array(&outputs) && cbor_value_get_array_length(&outputs, &num_outputs) == CborNoError
+            && num_outputs <= MAX_SHARED_NONCE_OUTPUTS) {
+            max_reply_size += num_outputs * BATCH_NONCE_REPLY_SIZE;
+        }
+    }
+    return max_reply_size;
+}
+
+// Run a single sub-request, capturing its reply into the passed buffer.
+// Returns the size of the reply written.
+static size_t run_batch_item(const jade_msg_source_t source, const uint8_t* item, const size_t item_len,
+    TaskFunction_t task_function, uint8_t* buffer, const size_t buffer_len)
+{
+    // Make new process object for the sub-request, with a copy of the message
+    jade_process_t item_process;
+    init_jade_process(&item_process);
+    item_process.ctx.source = source;
+    item_process.ctx.cbor = JADE_MALLOC(item_len);
+    item_process.ctx.cbor_len = item_len;
+    memcpy(item_process.ctx.cbor, item, item_len);
+    const CborError cberr = cbor_parser_init(item_process.ctx.cbor, item_process.ctx.cbor_len, CborValidateBasic,
+        &item_process.ctx.parser, &item_process.ctx.value);
+    JADE_ASSERT(cberr == CborNoError);
+
+    // Call the function, capturing its reply
+    jade_process_start_reply_capture(buffer, buffer_len);
+    task_function(&item_process);
+
+    size_t written = 0;
+    const bool captured = jade_process_stop_reply_capture(&written);
+
+    if (!captured) {
+        // Reply lost (or unexpected number of replies) - replace with an error
+        char id[MAXLEN_ID + 1];
+        size_t id_len = 0;
+        rpc_get_id(&item_process.ctx.value, id, sizeof(id), &id_len);
+        const bool ok = cbor_print_error_for(id_len ? id : "00", CBOR_RPC_INTERNAL_ERROR, "Failed to capture reply",
+            NULL, 0, buffer, buffer_len, &written);
+        JADE_ASSERT(ok);
+    }
+
+    cleanup_jade_process(&item_process);
+    return written;
+}
+
+// Handle a 'batch' request - an array of (complete) sub-requests, each of which is
+// processed in turn.  The reply is a single message whose result is the array of the
+// replies to each sub-request (each a normal reply or error message, with its own id).
+// If the batch reply becomes full, any remaining sub-requests are not processed, and
+// receive a CBOR_RPC_BATCH_FULL error - the caller should resend those items.
+void batch_process(void* process_ptr)
+{
+    JADE_LOGI("Starting: %u", xPortGetFreeHeapSize());
+    jade_process_t* process = process_ptr;
+
+    // We expect a current message to be present
+    ASSERT_CURRENT_MESSAGE(process, "batch");
+    GET_MSG_PARAMS(process);
+
+    CborValue requests;
+    size_t num_requests = 0;
+    if (cbor_value_map_find_value(&params, "requests", &requests) != CborNoError || !cbor_value_is_array(&requests)
+        || cbor_value_get_array_length(&requests, &num_requests) != CborNoError || num_requests == 0
+        || num_requests > MAX_BATCH_REQUESTS) {
+        jade_process_reject_message(
+            process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract valid requests array from parameters", NULL);
+        goto cleanup;
+    }
+
+    // Validate all sub-requests up front, so nothing is processed if the batch is malformed
+    CborValue item;
+    CborError cberr = cbor_value_enter_container(&requests, &item);
+    JADE_ASSERT(cberr == CborNoError);
+    for (size_t i = 0; i < num_requests; ++i) {
+        JADE_ASSERT(!cbor_value_at_end(&item));
+        if (!rpc_request_valid(&item)) {
+            jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Invalid request in batch", NULL);
+            goto cleanup;
+        }
+
+        size_t method_len = 0;
+        const char* method = NULL;
+        rpc_get_method(&item, &method, &method_len);
+        if (!get_batchable_task_function(method, method_len) || is_ranged_receive_address(method, method_len, &item)) {
+            jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Method not supported in batch", NULL);
+            goto cleanup;
+        }
+        cberr = cbor_value_advance(&item);
+        JADE_ASSERT(cberr == CborNoError);
+    }
+
+    // Write the reply header - { id, result: [ <num_requests items> ] } - the
+    // captured replies to the sub-requests are then appended as the array items.
+    uint8_t* const reply = JADE_MALLOC(MAX_OUTPUT_MSG_SIZE);
+    jade_process_free_on_exit(process, reply);
+
+    const char* reqid = NULL;
+    size_t reqid_len = 0;
+    rpc_get_id_ptr(&process->ctx.value, &reqid, &reqid_len);
+    JADE_ASSERT(reqid_len != 0);
+
+    CborEncoder root_encoder;
+    cbor_encoder_init(&root_encoder, reply, MAX_OUTPUT_MSG_SIZE, 0);
+    CborEncoder root_map_encoder; // id, result
+    cberr = cbor_encoder_create_map(&root_encoder, &root_map_encoder, 2);
+    JADE_ASSERT(cberr == CborNoError);
+    rpc_init_cbor(&root_map_encoder, reqid, reqid_len);
+    CborEncoder array_encoder; // sub-request replies
+    cberr = cbor_encoder_create_array(&root_map_encoder, &array_encoder, num_requests);
+    JADE_ASSERT(cberr == CborNoError);
+
+    // NOTE: definite-length containers, so nothing further to write when 'closing'
+    size_t written = cbor_encoder_get_buffer_size(&array_encoder, reply);
+
+    // Process each sub-request in turn
+    cberr = cbor_value_enter_container(&requests, &item);
+    JADE_ASSERT(cberr == CborNoError);
+    for (size_t i = 0; i < num_requests; ++i) {
+        const uint8_t* const item_start = cbor_value_get_next_byte(&item);
+        char id[MAXLEN_ID + 1];
+        size_t id_len = 0;
+        rpc_get_id(&item, id, sizeof(id), &id_len);
+        JADE_ASSERT(id_len != 0);
+
+        size_t method_len = 0;
+        const char* method = NULL;
+        rpc_get_method(&item, &method, &method_len);
+        const TaskFunction_t task_function = get_batchable_task_function(method, method_len);
+        JADE_ASSERT(task_function);
+        const size_t max_reply_size = get_batch_item_max_reply_size(method, method_len, &item);
+
+        cberr = cbor_value_advance(&item);
+        JADE_ASSERT(cberr == CborNoError);
+        const uint8_t* const item_end = cbor_value_get_next_byte(&item);
+
+        // Only process the item if its reply is sure to fit, leaving space for the
+        // 'batch full' replies to all subsequent items.
+        // NOTE: any item fits in a batch on its own, so the client can always make progress.
+        const size_t remaining = MAX_OUTPUT_MSG_SIZE - written;
+        const size_t reserved = (num_requests - i - 1) * BATCH_ITEM_DEFERRED_REPLY_SIZE;
+        size_t item_written = 0;
+        if (remaining >= max_reply_size + reserved) {
+            JADE_LOGD("Processing batch item %u: '%.*s'", i, method_len, method);
+            item_written = run_batch_item(process->ctx.source, item_start, item_end - item_start, task_function,
+                reply + written, remaining - reserved);
+        } else {
+            JADE_LOGW("Batch reply full, deferring item %u", i);
+            const bool ok = cbor_print_error_for(
+                id, CBOR_RPC_BATCH_FULL, "Batch full", NULL, 0, reply + written, remaining, &item_written);
+            JADE_ASSERT(ok);
+        }
+        written += item_written;
+        JADE_ASSERT(written <= MAX_OUTPUT_MSG_SIZE);
+    }
+
+    jade_process_reply_to_message_ex(process->ctx.source, reply, written);
+    JADE_LOGI("Success");
+
+cleanup:
+    return;
+}
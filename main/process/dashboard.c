@@ -22,6 +22,7 @@
 #include "../utils/event.h"
 #include "../utils/malloc_ext.h"
 #include "../utils/network.h"
+#include "../utils/perf.h"
 #include "../wallet.h"
 #ifndef CONFIG_ESP32_NO_BLOBS
 #include "../ble/ble.h"
@@ -47,10 +48,16 @@ void debug_handshake(void* process_ptr);
 #endif
 void get_xpubs_process(void* process_ptr);
 void get_receive_address_process(void* process_ptr);
+void batch_process(void* process_ptr);
 void ota_process(void* process_ptr);
+void ota_expire_suspended_upload(void);
 void pin_process(void* process_ptr);
 void mnemonic_process(void* process_ptr);
 
+// Runtime logging config
+void logging_get_config(esp_log_level_t* level, size_t* max_rate);
+void logging_set_config(esp_log_level_t level, size_t max_rate);
+
 // GUI screens
 void make_setup_screen(gui_activity_t** act_ptr, const char* device_name);
 void make_connect_screen(gui_activity_t** act_ptr, const char* device_name);
@@ -77,11 +84,12 @@ static void reply_version_info(const void* ctx, CborEncoder* container)
     JADE_ASSERT(err == ESP_OK);
 
     CborEncoder map_encoder;
-    CborError cberr = cbor_encoder_create_map(container, &map_encoder, 14);
+    CborError cberr = cbor_encoder_create_map(container, &map_encoder, 15);
     JADE_ASSERT(cberr == CborNoError);
 
     add_string_to_map(&map_encoder, "JADE_VERSION", running_app_info.version);
     add_uint_to_map(&map_encoder, "JADE_OTA_MAX_CHUNK", JADE_OTA_BUF_SIZE);
+    add_uint_to_map(&map_encoder, "JADE_TXN_MAX_CHUNK", MAX_TXN_CHUNK_SIZE);
 
 #ifndef CONFIG_ESP32_NO_BLOBS
     add_string_to_map(&map_encoder, "JADE_CONFIG", "BLE");
@@ -102,12 +110,19 @@ static void reply_version_info(const void* ctx, CborEncoder* container)
 #endif
     JADE_ASSERT(cberr == CborNoError);
 
-    // 'features' could potentially be a comma-separated list
-    // initially it's either 'secure boot' or 'dev' ...
+    // 'features' is a comma-separated list, always starting with either 'SB' (secure boot)
+    // or 'DEV' - as older firmware returned just that one token - then 'OTAWINDOW' as several
+    // ota_data messages can be kept in flight, and 'DELTA' if delta (patch) ota is supported
+    // (only with SPIRAM, as the patch buffers do not fit in DRAM alongside the upload).
 #ifdef CONFIG_SECURE_BOOT
-    add_string_to_map(&map_encoder, "JADE_FEATURES", "SB");
+#define JADE_FEATURES_BOOT "SB"
+#else
+#define JADE_FEATURES_BOOT "DEV"
+#endif
+#ifdef CONFIG_ESP32_SPIRAM_SUPPORT
+    add_string_to_map(&map_encoder, "JADE_FEATURES", JADE_FEATURES_BOOT ",OTAWINDOW,DELTA");
 #else
-    add_string_to_map(&map_encoder, "JADE_FEATURES", "DEV");
+    add_string_to_map(&map_encoder, "JADE_FEATURES", JADE_FEATURES_BOOT ",OTAWINDOW");
 #endif
 
     JADE_ASSERT(cberr == CborNoError);
@@ -170,6 +185,58 @@ cleanup:
     return;
 }
 
+// Log level and rate, as returned from 'set_log_level'
+typedef struct {
+    esp_log_level_t level;
+    size_t max_rate;
+} log_config_t;
+
+static void reply_log_config(const void* ctx, CborEncoder* container)
+{
+    JADE_ASSERT(ctx);
+    JADE_ASSERT(container);
+
+    const log_config_t* config = (const log_config_t*)ctx;
+
+    CborEncoder map_encoder;
+    CborError cberr = cbor_encoder_create_map(container, &map_encoder, 2);
+    JADE_ASSERT(cberr == CborNoError);
+
+    add_uint_to_map(&map_encoder, "level", config->level);
+    add_uint_to_map(&map_encoder, "max_rate", config->max_rate);
+
+    cberr = cbor_encoder_close_container(container, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+// Set the runtime log level, and the maximum number of log messages sent per second
+// (0 = unlimited).  Replies with the prior settings, so they can be restored.
+static void process_set_log_level_request(jade_process_t* process)
+{
+    size_t level = 0;
+    size_t max_rate = 0;
+
+    ASSERT_CURRENT_MESSAGE(process, "set_log_level");
+    GET_MSG_PARAMS(process);
+
+    if (!rpc_get_sizet("level", &params, &level) || level > ESP_LOG_VERBOSE) {
+        jade_process_reject_message(
+            process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract valid log level from parameters", NULL);
+        goto cleanup;
+    }
+
+    // Optional - defaults to unlimited
+    rpc_get_sizet("max_rate", &params, &max_rate);
+
+    log_config_t prior;
+    logging_get_config(&prior.level, &prior.max_rate);
+    logging_set_config((esp_log_level_t)level, max_rate);
+    jade_process_reply_to_message_result(process->ctx, &prior, reply_log_config);
+
+cleanup:
+    return;
+}
+
 // Do we have have a keychain, and does its userdata indicate the same 'source'
 // as the current message ?
 // This is to check that we only handle messages from the same source (serial or ble)
@@ -216,6 +283,13 @@ static void dispatch_message(jade_process_t* process)
     JADE_ASSERT(method_len != 0);
 
     TaskFunction_t task_function = NULL;
+    bool dispatched = true; // false if the method is rejected as unknown/unexpected/locked
+
+    // Copy the method name for the perf counters, as the message may be freed when handled
+    char method_name[32];
+    const size_t method_name_len = method_len < sizeof(method_name) ? method_len : sizeof(method_name);
+    memcpy(method_name, method, method_name_len);
+    const int64_t start_us = perf_now();
 
     JADE_LOGD("dashboard dispatching message method='%.*s'", method_len, method);
 
@@ -226,6 +300,9 @@ static void dispatch_message(jade_process_t* process)
     } else if (IS_METHOD("add_entropy")) {
         JADE_LOGD("Received external entropy message");
         process_add_entropy_request(process);
+    } else if (IS_METHOD("set_log_level")) {
+        JADE_LOGD("Received set log level message");
+        process_set_log_level_request(process);
     } else if (IS_METHOD("auth_user")) {
         // Either enter pin or set-up mnemonic if uninitialised
         if (keychain_unlocked_by_message_source(process)) {
@@ -261,6 +338,8 @@ static void dispatch_message(jade_process_t* process)
         task_function = debug_set_mnemonic_process;
     } else if (IS_METHOD("debug_handshake")) {
         task_function = debug_handshake;
+    } else if (IS_METHOD("debug_get_perf_stats")) {
+        jade_process_reply_to_message_result(process->ctx, NULL, perf_stats_cb);
 #endif // CONFIG_DEBUG_MODE
     } else {
         // Methods only available after user authorised
@@ -268,6 +347,7 @@ static void dispatch_message(jade_process_t* process)
             // Reject the message as bad (startup) protocol
             jade_process_reject_message(
                 process, CBOR_RPC_HW_LOCKED, "When locked expecting either 'auth_user' or 'ota' message only.", NULL);
+            dispatched = false;
         } else if (IS_METHOD("get_xpub")) {
             task_function = get_xpubs_process;
         } else if (IS_METHOD("get_receive_address")) {
@@ -286,13 +366,17 @@ static void dispatch_message(jade_process_t* process)
             task_function = get_blinding_key_process;
         } else if (IS_METHOD("get_shared_nonce")) {
             task_function = get_shared_nonce_process;
+        } else if (IS_METHOD("batch")) {
+            task_function = batch_process;
         } else if (IS_METHOD("ota_data") || IS_METHOD("ota_complete") || IS_METHOD("tx_input")
-            || IS_METHOD("handshake_init") || IS_METHOD("handshake_complete")) {
+            || IS_METHOD("tx_data") || IS_METHOD("handshake_init") || IS_METHOD("handshake_complete")) {
             // Method we only expect as part of a multi-message protocol
             jade_process_reject_message(process, CBOR_RPC_PROTOCOL_ERROR, "Unexpected method", NULL);
+            dispatched = false;
         } else {
             // Reject the message as unknown, and free message
             jade_process_reject_message(process, CBOR_RPC_UNKNOWN_METHOD, "Unknown method", NULL);
+            dispatched = false;
         }
     }
 
@@ -308,6 +392,11 @@ static void dispatch_message(jade_process_t* process)
         // Then clean up after the process has finished
         cleanup_jade_process(&task_process);
     }
+
+    // Only record the methods handled, so arbitrary method names cannot fill the perf counters
+    if (dispatched) {
+        perf_record_method(method_name, method_name_len, start_us);
+    }
 }
 
 // Function to get user confirmation, then wipe all flash memory.
@@ -683,6 +772,9 @@ static void do_dashboard(jade_process_t* process, const keychain_t* const expect
         //     }
         // }
 
+        // Release any interrupted ota upload the client has not come back to resume
+        ota_expire_suspended_upload();
+
         // Looping without having done anything this iteration
         // Set flag to false so we don't set the screen back to dashboard
         acted = false;
@@ -169,7 +169,7 @@ void get_commitments_process(void* process_ptr)
     JADE_ASSERT(cberr == CborNoError);
 
     const size_t towrite = cbor_encoder_get_buffer_size(&root_encoder, buf);
-    jade_process_push_out_message(buf, towrite, process->ctx.source);
+    jade_process_reply_to_message_ex(process->ctx.source, buf, towrite);
     JADE_LOGI("Success");
 
 cleanup:
@@ -4,6 +4,7 @@
 #include "../ui.h"
 #include "../utils/address.h"
 #include "../utils/cbor_rpc.h"
+#include "../utils/malloc_ext.h"
 #include "../utils/network.h"
 #include "../wallet.h"
 
@@ -11,10 +12,104 @@
 
 #include <esp_event.h>
 
+#include <stdio.h>
 #include <string.h>
 
 #include "process_utils.h"
 
+// Maximum number of addresses which can be returned in one (ranged) reply
+#define MAX_RECEIVE_ADDRESS_RANGE 20
+
+typedef struct {
+    const char (*addresses)[MAX_ADDRESS_LEN];
+    size_t num_addresses;
+} address_range_t;
+
+static void reply_address_range(const void* ctx, CborEncoder* container)
+{
+    JADE_ASSERT(ctx);
+    JADE_ASSERT(container);
+
+    const address_range_t* range = (const address_range_t*)ctx;
+
+    CborEncoder array_encoder;
+    CborError cberr = cbor_encoder_create_array(container, &array_encoder, range->num_addresses);
+    JADE_ASSERT(cberr == CborNoError);
+
+    for (size_t i = 0; i < range->num_addresses; ++i) {
+        cberr = cbor_encode_text_stringz(&array_encoder, range->addresses[i]);
+        JADE_ASSERT(cberr == CborNoError);
+    }
+
+    cberr = cbor_encoder_close_container(container, &array_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+// Convert a script into an address string, blinded if liquid
+static bool script_to_receive_address(
+    const char* network, const unsigned char* script, const size_t script_len, char* address, const size_t address_len)
+{
+    if (isLiquidNetwork(network)) {
+        // Blind address
+        unsigned char blinding_key[EC_PUBLIC_KEY_LEN];
+        if (!wallet_get_public_blinding_key(script, script_len, blinding_key, sizeof(blinding_key))) {
+            return false;
+        }
+        elements_script_to_address(
+            network, script, script_len, blinding_key, sizeof(blinding_key), address, address_len);
+    } else {
+        script_to_address(network, script, script_len, address, address_len);
+    }
+    return true;
+}
+
+// Green-multisig addresses for a range of pointers [pointer, pointer + num_addresses), in one reply.
+// The user confirms the export of the range as a whole, rather than each individual address.
+static void get_receive_address_range(jade_process_t* process, const char* network, const char* xpubrecovery,
+    const uint32_t csvBlocks, const uint32_t subaccount, const uint32_t branch, const uint32_t pointer,
+    const size_t num_addresses)
+{
+    JADE_ASSERT(num_addresses > 0 && num_addresses <= MAX_RECEIVE_ADDRESS_RANGE);
+
+    // Build the script pubkeys for the range - the parent keys are derived only once
+    unsigned char scripts[MAX_RECEIVE_ADDRESS_RANGE * WALLY_SCRIPTPUBKEY_P2SH_LEN];
+    if (!wallet_build_receive_scripts(
+            network, xpubrecovery, csvBlocks, subaccount, branch, pointer, num_addresses, scripts, sizeof(scripts))) {
+        jade_process_reject_message(
+            process, CBOR_RPC_BAD_PARAMETERS, "Failed to generate valid green address script", NULL);
+        return;
+    }
+
+    // Convert those into address strings
+    char(*addresses)[MAX_ADDRESS_LEN] = JADE_MALLOC(num_addresses * MAX_ADDRESS_LEN);
+    jade_process_free_on_exit(process, addresses);
+    for (size_t i = 0; i < num_addresses; ++i) {
+        if (!script_to_receive_address(network, scripts + (i * WALLY_SCRIPTPUBKEY_P2SH_LEN),
+                WALLY_SCRIPTPUBKEY_P2SH_LEN, addresses[i], MAX_ADDRESS_LEN)) {
+            jade_process_reject_message(process, CBOR_RPC_INTERNAL_ERROR, "Cannot get blinding key for script", NULL);
+            return;
+        }
+    }
+
+    // Ask the user to confirm the export of the range
+    char message[96];
+    const int ret = snprintf(message, sizeof(message), "\nExport %u addresses\nfrom subaccount %u\npointers %u - %u ?",
+        num_addresses, subaccount, pointer, pointer + num_addresses - 1);
+    JADE_ASSERT(ret > 0 && ret < sizeof(message));
+
+    if (!await_yesno_activity("Export Addresses", message)) {
+        JADE_LOGW("User declined to export addresses");
+        jade_process_reject_message(process, CBOR_RPC_USER_CANCELLED, "User declined to export addresses", NULL);
+        return;
+    }
+    JADE_LOGD("User pressed accept");
+
+    // Reply with the addresses
+    const address_range_t range = { .addresses = (const char(*)[MAX_ADDRESS_LEN])addresses,
+        .num_addresses = num_addresses };
+    jade_process_reply_to_message_result(process->ctx, &range, reply_address_range);
+}
+
 void get_receive_address_process(void* process_ptr)
 {
     JADE_LOGI("Starting: %u", xPortGetFreeHeapSize());
@@ -55,6 +150,28 @@ void get_receive_address_process(void* process_ptr)
             goto cleanup;
         }
 
+        // Optional number of addresses, for a range of pointers
+        size_t num_addresses = 0;
+        if (rpc_has_field_data("num_addresses", &params)) {
+            if (!rpc_get_sizet("num_addresses", &params, &num_addresses) || num_addresses == 0
+                || num_addresses > MAX_RECEIVE_ADDRESS_RANGE) {
+                jade_process_reject_message(
+                    process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract valid num_addresses from parameters", NULL);
+                goto cleanup;
+            }
+
+            // Optional xpub for 2of3 accounts, and 'blocks' for csv outputs
+            written = 0;
+            char xpubrecovery[120];
+            rpc_get_string("recovery_xpub", sizeof(xpubrecovery), &params, xpubrecovery, &written);
+            uint32_t csvBlocks = 0;
+            rpc_get_sizet("csv_blocks", &params, &csvBlocks);
+
+            get_receive_address_range(process, network, written ? xpubrecovery : NULL, csvBlocks, subaccount, branch,
+                pointer, num_addresses);
+            goto cleanup;
+        }
+
         wallet_build_receive_path(subaccount, branch, pointer, path, sizeof(path), &path_len);
     } else {
         // Otherwise the path is explicit in the params
@@ -87,17 +204,9 @@ void get_receive_address_process(void* process_ptr)
 
     // Convert that into an address string
     char address[MAX_ADDRESS_LEN];
-    if (isLiquidNetwork(network)) {
-        // Blind address
-        unsigned char blinding_key[EC_PUBLIC_KEY_LEN];
-        if (!wallet_get_public_blinding_key(script, script_len, blinding_key, sizeof(blinding_key))) {
-            jade_process_reject_message(process, CBOR_RPC_INTERNAL_ERROR, "Cannot get blinding key for script", NULL);
-            goto cleanup;
-        }
-        elements_script_to_address(
-            network, script, script_len, blinding_key, sizeof(blinding_key), address, sizeof(address));
-    } else {
-        script_to_address(network, script, script_len, address, sizeof(address));
+    if (!script_to_receive_address(network, script, script_len, address, sizeof(address))) {
+        jade_process_reject_message(process, CBOR_RPC_INTERNAL_ERROR, "Cannot get blinding key for script", NULL);
+        goto cleanup;
     }
 
     // Display to the user to confirm
@@ -2,45 +2,125 @@
 #include "../process.h"
 #include "../ui.h"
 #include "../utils/cbor_rpc.h"
+#include "../utils/malloc_ext.h"
 #include "../wallet.h"
 
 #include <string.h>
 
 #include "process_utils.h"
 
-void get_shared_nonce_process(void* process_ptr)
+typedef struct {
+    const unsigned char (*nonces)[SHA256_LEN];
+    size_t num_nonces;
+} shared_nonces_t;
+
+static void reply_shared_nonces(const void* ctx, CborEncoder* container)
 {
-    JADE_LOGI("Starting: %u", xPortGetFreeHeapSize());
-    jade_process_t* process = process_ptr;
+    JADE_ASSERT(ctx);
+    JADE_ASSERT(container);
 
-    // We expect a current message to be present
-    ASSERT_CURRENT_MESSAGE(process, "get_shared_nonce");
-    GET_MSG_PARAMS(process);
+    const shared_nonces_t* nonces = (const shared_nonces_t*)ctx;
+
+    CborEncoder array_encoder;
+    CborError cberr = cbor_encoder_create_array(container, &array_encoder, nonces->num_nonces);
+    JADE_ASSERT(cberr == CborNoError);
 
+    for (size_t i = 0; i < nonces->num_nonces; ++i) {
+        cberr = cbor_encode_byte_string(&array_encoder, nonces->nonces[i], SHA256_LEN);
+        JADE_ASSERT(cberr == CborNoError);
+    }
+
+    cberr = cbor_encoder_close_container(container, &array_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+// Extract the script and their_pubkey from the passed map, and compute the shared nonce.
+// The nonce is pre-hashed so it can be used directly to unblind later.
+// Returns false (having rejected the message) on error.
+static bool get_hashed_shared_nonce(jade_process_t* process, const CborValue* params, unsigned char* output)
+{
     size_t script_len = 0;
     const uint8_t* script = NULL;
-    rpc_get_bytes_ptr("script", &params, &script, &script_len);
+    rpc_get_bytes_ptr("script", params, &script, &script_len);
     if (!script || script_len <= 0) {
         jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract script from parameters", NULL);
-        goto cleanup;
+        return false;
     }
 
     size_t their_pubkey_len = 0;
     const uint8_t* their_pubkey = NULL;
-    rpc_get_bytes_ptr("their_pubkey", &params, &their_pubkey, &their_pubkey_len);
+    rpc_get_bytes_ptr("their_pubkey", params, &their_pubkey, &their_pubkey_len);
     if (!their_pubkey || their_pubkey_len != EC_PUBLIC_KEY_LEN) {
         jade_process_reject_message(
             process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract their_pubkey from parameters", NULL);
-        goto cleanup;
+        return false;
     }
 
     // get nonce and pre-hash so we can use it directly to unblind later
     unsigned char shared_nonce[SHA256_LEN];
-    unsigned char shared_nonce_hash[SHA256_LEN];
     if (!wallet_get_shared_nonce(script, script_len, their_pubkey, their_pubkey_len, shared_nonce, sizeof(shared_nonce))
-        || wally_sha256(shared_nonce, sizeof(shared_nonce), shared_nonce_hash, sizeof(shared_nonce_hash)) != WALLY_OK) {
+        || wally_sha256(shared_nonce, sizeof(shared_nonce), output, SHA256_LEN) != WALLY_OK) {
         jade_process_reject_message(
             process, CBOR_RPC_INTERNAL_ERROR, "Failed to compute hashed shared nonce value for the parameters", NULL);
+        return false;
+    }
+    return true;
+}
+
+// Multi-output variant - 'outputs' array of { script, their_pubkey } maps,
+// replies with an array of (hashed) shared nonces, one per output.
+static void get_shared_nonces(jade_process_t* process, CborValue* outputs)
+{
+    size_t num_outputs = 0;
+    if (cbor_value_get_array_length(outputs, &num_outputs) != CborNoError || num_outputs == 0
+        || num_outputs > MAX_SHARED_NONCE_OUTPUTS) {
+        jade_process_reject_message(
+            process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract valid outputs array from parameters", NULL);
+        return;
+    }
+
+    unsigned char(*nonces)[SHA256_LEN] = JADE_MALLOC(num_outputs * SHA256_LEN);
+    jade_process_free_on_exit(process, nonces);
+
+    CborValue item;
+    CborError cberr = cbor_value_enter_container(outputs, &item);
+    JADE_ASSERT(cberr == CborNoError);
+    for (size_t i = 0; i < num_outputs; ++i) {
+        JADE_ASSERT(!cbor_value_at_end(&item));
+        if (!cbor_value_is_map(&item)) {
+            jade_process_reject_message(
+                process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract valid outputs array from parameters", NULL);
+            return;
+        }
+        if (!get_hashed_shared_nonce(process, &item, nonces[i])) {
+            return;
+        }
+        cberr = cbor_value_advance(&item);
+        JADE_ASSERT(cberr == CborNoError);
+    }
+
+    const shared_nonces_t reply = { .nonces = (const unsigned char(*)[SHA256_LEN])nonces, .num_nonces = num_outputs };
+    jade_process_reply_to_message_result(process->ctx, &reply, reply_shared_nonces);
+}
+
+void get_shared_nonce_process(void* process_ptr)
+{
+    JADE_LOGI("Starting: %u", xPortGetFreeHeapSize());
+    jade_process_t* process = process_ptr;
+
+    // We expect a current message to be present
+    ASSERT_CURRENT_MESSAGE(process, "get_shared_nonce");
+    GET_MSG_PARAMS(process);
+
+    // Multi-output variant if 'outputs' array passed
+    CborValue outputs;
+    if (cbor_value_map_find_value(&params, "outputs", &outputs) == CborNoError && cbor_value_is_array(&outputs)) {
+        get_shared_nonces(process, &outputs);
+        goto cleanup;
+    }
+
+    unsigned char shared_nonce_hash[SHA256_LEN];
+    if (!get_hashed_shared_nonce(process, &params, shared_nonce_hash)) {
         goto cleanup;
     }
 
@@ -7,6 +7,7 @@
 #include "../jade_assert.h"
 #include "../utils/cbor_rpc.h"
 #include "../utils/malloc_ext.h"
+#include "../utils/perf.h"
 
 #include <stdint.h>
 #include <string.h>
@@ -14,9 +15,11 @@
 #include <esp32/rom/miniz.h>
 #include <esp_efuse.h>
 #include <esp_ota_ops.h>
+#include <mbedtls/sha256.h>
 
 #include <sodium/utils.h>
 #include <wally_core.h>
+#include <wally_crypto.h>
 
 #include "process_utils.h"
 
@@ -24,8 +27,14 @@
 
 // Timeout total 20s (40ms blocking on msg)
 #define DEFAULT_TIMEOUT_BEGIN 500
+
+// After an error, stop draining in-flight messages once idle for 200ms (40ms blocking on msg)
+#define DRAIN_IDLE_POLLS 5
 #define VERSION_STRING_MAX_LENGTH 32
 
+// An interrupted upload not resumed within 2 minutes is abandoned, freeing its buffers
+#define SUSPENDED_UPLOAD_TIMEOUT_MS (2 * 60 * 1000)
+
 enum ota_status {
     SUCCESS,
     ERROR_OTA_SETUP,
@@ -40,6 +49,8 @@ enum ota_status {
     ERROR_NODOWNGRADE,
     ERROR_INVALIDFW,
     ERROR_USER_DECLINED,
+    ERROR_BADHASH,
+    ERROR_PATCH,
 };
 
 // status messages
@@ -57,24 +68,67 @@ static const char MESSAGES[][20] = {
     "ERROR_NODOWNGRADE",
     "ERROR_INVALIDFW",
     "ERROR_USER_DECLINED",
+    "ERROR_BADHASH",
+    "ERROR_PATCH",
 };
 
 struct bin_msg {
     char id[MAXLEN_ID + 1];
-    const uint8_t* inbound_buf;
+    uint8_t* inbound_buf;
     size_t len;
+    size_t max_len;
+    bool other_msg; // some other message received (ie. not ota_data)
+    jade_msg_source_t other_msg_source;
     jade_msg_source_t expected_source;
     bool loaded;
     bool error;
 };
 
+// The state of an ota upload.  If the client passes the hash of the compressed image, and the
+// upload is interrupted (eg. the connection drops), this is retained so that a subsequent ota
+// request for the same image can resume the upload where it left off.
+// NOTE: only retained in memory - does not survive a reboot - and only until it times out.
+typedef struct {
+    uint8_t cmphash[SHA256_LEN];
+    bool has_cmphash;
+    size_t firmwaresize;
+    size_t compressedsize;
+    uint32_t remaining_compressed;
+    uint32_t remaining;
+    int status;
+    bool prevalidated;
+    esp_ota_handle_t update_handle;
+    esp_partition_t const* update_partition;
+    tinfl_decompressor* decomp;
+    uint8_t* uncompressed;
+    uint8_t* nout;
+    mbedtls_sha256_context sha_ctx;
+    ota_patch_t* patch; // if the upload is a delta against the running firmware
+} ota_upload_t;
+
+static ota_upload_t* suspended_upload = NULL;
+static TickType_t suspended_upload_time = 0;
+
+// Context for writing the firmware (which may be the output of a patch)
+typedef struct {
+    ota_upload_t* upload;
+    progress_bar_t* progress_bar;
+    enum ota_status status;
+} fw_writer_t;
+
+// Reply to an ota request which passes the image hash
+typedef struct {
+    size_t chunksize;
+    size_t offset;
+} ota_resume_reply_t;
+
 // UI screens to confirm ota
 void make_ota_versions_activity(gui_activity_t** activity_ptr, const char* current_version, const char* new_version);
 
-static enum ota_status ota_init(unsigned char* uncompressed, esp_partition_t const** update_partition,
+static enum ota_status ota_init(const uint8_t* fwdata, esp_partition_t const** update_partition,
     const size_t firmwaresize, esp_ota_handle_t* update_handle, progress_bar_t* progress_bar)
 {
-    JADE_ASSERT(uncompressed);
+    JADE_ASSERT(fwdata);
     JADE_ASSERT(update_partition);
     JADE_ASSERT(update_handle);
     JADE_ASSERT(progress_bar);
@@ -89,7 +143,7 @@ static enum ota_status ota_init(unsigned char* uncompressed, esp_partition_t con
     JADE_LOGI("Running firmware version: %s", running_app_info.version);
 
     const size_t offset = sizeof(esp_image_header_t) + sizeof(esp_image_segment_header_t);
-    const esp_app_desc_t* new_app_info = (esp_app_desc_t*)(uncompressed + offset);
+    const esp_app_desc_t* new_app_info = (const esp_app_desc_t*)(fwdata + offset);
 
     // Sanity check that the version string is reasonable (ie. length)
     if (strnlen(new_app_info->version, VERSION_STRING_MAX_LENGTH + 1) > VERSION_STRING_MAX_LENGTH) {
@@ -149,13 +203,17 @@ static enum ota_status ota_init(unsigned char* uncompressed, esp_partition_t con
 }
 
 // Helper to read a chunk of binary data
-static void reset_ctx(struct bin_msg* bctx, uint8_t* inbound_buf, const jade_msg_source_t expected_source)
+static void reset_ctx(
+    struct bin_msg* bctx, uint8_t* inbound_buf, const size_t max_len, const jade_msg_source_t expected_source)
 {
     JADE_ASSERT(bctx);
 
     bctx->id[0] = '\0';
     bctx->inbound_buf = inbound_buf;
     bctx->len = 0;
+    bctx->max_len = max_len;
+    bctx->other_msg = false;
+    bctx->other_msg_source = SOURCE_NONE;
     bctx->expected_source = expected_source;
     bctx->loaded = false;
     bctx->error = false;
@@ -180,14 +238,23 @@ static void handle_in_bin_data(void* ctx, unsigned char* data, size_t rawsize)
     JADE_ASSERT(written != 0);
 
     if (!rpc_is_method(&value, "ota_data")) {
+        // Some other request (eg. from a client which has reconnected) - the client is
+        // asked to retry it (see reject_other_message())
+        bctx->other_msg = true;
+        bctx->other_msg_source = data[0];
+        return;
+    }
+
+    if (data[0] != bctx->expected_source || !bctx->inbound_buf) {
         bctx->error = true;
         return;
     }
 
+    // Copy the chunk out of the message - the ring item is released (and may be overwritten
+    // by further ota_data messages already in flight) as soon as we return.
     written = 0;
-    rpc_get_bytes_ptr("params", &value, &bctx->inbound_buf, &written);
-
-    if (written == 0 || data[0] != bctx->expected_source || written > JADE_OTA_BUF_SIZE) {
+    rpc_get_bytes("params", bctx->max_len, &value, bctx->inbound_buf, &written);
+    if (written == 0) {
         bctx->error = true;
         return;
     }
@@ -203,14 +270,190 @@ static void send_ok(char* id, jade_msg_source_t source)
     jade_process_reply_to_message_result_with_id(id, ok_msg, sizeof(ok_msg), source, &ok, cbor_result_boolean_cb);
 }
 
+// Reject a message received during the ota (which is not ota_data) with the 'ota interrupted'
+// error, so the client resends it - by which time the ota has ended and the dashboard handles it.
+// (It cannot be pushed back onto the input queue, as this task is the queue's only consumer.)
+static void reject_other_message(const struct bin_msg* bctx)
+{
+    JADE_ASSERT(bctx);
+    JADE_ASSERT(bctx->other_msg);
+
+    JADE_LOGW("Rejecting message %s received during ota - client to retry", bctx->id);
+    uint8_t buf[128];
+    jade_process_reject_message_with_id(bctx->id, CBOR_RPC_OTA_INTERRUPTED, "OTA upload interrupted - retry", NULL,
+        0, buf, sizeof(buf), bctx->other_msg_source);
+}
+
+// The client may keep several ota_data messages in flight, so after an error reject any
+// further messages already sent (rather than leaving them to the dashboard, which would
+// only reply once the error has been acknowledged), so the client gets the ota status
+// promptly for every chunk.  Stops once no message has arrived for a short while, or at
+// the first other message (eg. the client retrying the ota), which the client is asked to retry.
+static void reject_inflight_messages(const jade_msg_source_t source, const enum ota_status status)
+{
+    unsigned char buf[256];
+    struct bin_msg binctx;
+    size_t idle = 0;
+    while (idle < DRAIN_IDLE_POLLS) {
+        reset_ctx(&binctx, NULL, JADE_OTA_MAX_BUF_SIZE, source);
+        jade_process_get_in_message(&binctx, &handle_in_bin_data, false);
+        if (binctx.other_msg) {
+            reject_other_message(&binctx);
+            break;
+        }
+        if (binctx.id[0] == '\0') {
+            ++idle;
+            continue;
+        }
+
+        idle = 0;
+        JADE_LOGW("Rejecting in-flight message %s", binctx.id);
+        jade_process_reject_message_with_id(binctx.id, CBOR_RPC_INTERNAL_ERROR, "Error uploading OTA data",
+            (const uint8_t*)MESSAGES[status], strlen(MESSAGES[status]), buf, sizeof(buf), source);
+    }
+}
+
+static ota_upload_t* create_upload(
+    const size_t firmwaresize, const size_t compressedsize, const uint8_t* cmphash, const bool is_patch)
+{
+    ota_upload_t* upload = JADE_CALLOC(1, sizeof(ota_upload_t));
+    if (cmphash) {
+        memcpy(upload->cmphash, cmphash, sizeof(upload->cmphash));
+        upload->has_cmphash = true;
+    }
+    upload->firmwaresize = firmwaresize;
+    upload->compressedsize = compressedsize;
+    upload->remaining_compressed = compressedsize;
+    upload->remaining = firmwaresize;
+    upload->status = TINFL_STATUS_NEEDS_MORE_INPUT;
+
+    // sizeof(tinfl_decompressor) is just over 10k
+    upload->decomp = JADE_MALLOC_PREFER_SPIRAM(sizeof(tinfl_decompressor));
+    tinfl_init(upload->decomp);
+
+    upload->uncompressed = JADE_MALLOC_PREFER_SPIRAM(UNCOMPRESSED_BUF_SIZE);
+    upload->nout = upload->uncompressed;
+
+    mbedtls_sha256_init(&upload->sha_ctx);
+    const int res = mbedtls_sha256_starts_ret(&upload->sha_ctx, 0); // 0 = SHA256 instead of SHA224
+    JADE_ASSERT(res == 0);
+
+    if (is_patch) {
+        upload->patch = ota_patch_create(esp_ota_get_running_partition(), UNCOMPRESSED_BUF_SIZE);
+    }
+
+    return upload;
+}
+
+// Free an upload, abandoning the ota if it has been started and not completed
+static void free_upload(ota_upload_t* upload, const bool ota_end_called)
+{
+    JADE_ASSERT(upload);
+
+    if (upload->prevalidated && !ota_end_called) {
+        // ota_begin has been called, cleanup
+        const esp_err_t err = esp_ota_end(upload->update_handle);
+        JADE_ASSERT(err == ESP_OK || err == ESP_ERR_OTA_VALIDATE_FAILED);
+    }
+
+    if (upload->patch) {
+        ota_patch_free(upload->patch);
+    }
+    mbedtls_sha256_free(&upload->sha_ctx);
+    free(upload->uncompressed);
+    free(upload->decomp);
+    free(upload);
+}
+
+// Abandon any interrupted upload which has not been resumed within the timeout, so its ota
+// handle and buffers are not held indefinitely.  Called periodically from the dashboard loop.
+void ota_expire_suspended_upload(void)
+{
+    if (suspended_upload
+        && xTaskGetTickCount() - suspended_upload_time >= pdMS_TO_TICKS(SUSPENDED_UPLOAD_TIMEOUT_MS)) {
+        JADE_LOGW("Abandoning interrupted ota upload - not resumed within %ums", SUSPENDED_UPLOAD_TIMEOUT_MS);
+        free_upload(suspended_upload, false);
+        suspended_upload = NULL;
+    }
+}
+
+// Whether an interrupted upload can be resumed by the given ota request
+static bool can_resume_upload(const ota_upload_t* upload, const size_t firmwaresize, const size_t compressedsize,
+    const uint8_t* cmphash, const bool is_patch)
+{
+    JADE_ASSERT(upload);
+    return cmphash && upload->firmwaresize == firmwaresize && upload->compressedsize == compressedsize
+        && !memcmp(upload->cmphash, cmphash, sizeof(upload->cmphash)) && (upload->patch != NULL) == is_patch;
+}
+
+// Write the next block of firmware - the first block is used to validate the new firmware
+// and for the user to confirm the new version, before the ota is started.
+static bool write_firmware(void* ctx, const uint8_t* data, const size_t len)
+{
+    JADE_ASSERT(ctx);
+    JADE_ASSERT(data);
+
+    fw_writer_t* writer = (fw_writer_t*)ctx;
+    ota_upload_t* upload = writer->upload;
+
+    if (len > upload->remaining) {
+        JADE_LOGE("Firmware exceeds expected size by %u bytes", len - upload->remaining);
+        writer->status = ERROR_DECOMPRESS;
+        return false;
+    }
+
+    if (!upload->prevalidated) {
+        const enum ota_status res = ota_init(
+            data, &upload->update_partition, upload->firmwaresize, &upload->update_handle, writer->progress_bar);
+        if (res != SUCCESS) {
+            JADE_LOGE("ota_init() error, %u", res);
+            writer->status = res;
+            return false;
+        }
+        upload->prevalidated = true;
+    }
+
+    const int64_t write_start_us = perf_now();
+    const esp_err_t res = esp_ota_write(upload->update_handle, (const void*)data, len);
+    perf_record_timer(PERF_TIMER_OTA_WRITE, write_start_us);
+    if (res != ESP_OK) {
+        JADE_LOGE("ota_write() error: %u", res);
+        writer->status = ERROR_WRITE;
+        return false;
+    }
+
+    upload->remaining -= len;
+    return true;
+}
+
+static void ota_resume_reply_cb(const void* ctx, CborEncoder* container)
+{
+    JADE_ASSERT(ctx);
+    JADE_ASSERT(container);
+
+    const ota_resume_reply_t* reply = (const ota_resume_reply_t*)ctx;
+
+    CborEncoder map_encoder;
+    CborError cberr = cbor_encoder_create_map(container, &map_encoder, 2);
+    JADE_ASSERT(cberr == CborNoError);
+
+    add_uint_to_map(&map_encoder, "otachunk", reply->chunksize);
+    add_uint_to_map(&map_encoder, "offset", reply->offset);
+
+    cberr = cbor_encoder_close_container(container, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
 void ota_process(void* process_ptr)
 {
     JADE_LOGI("Starting: %u", xPortGetFreeHeapSize());
     jade_process_t* process = process_ptr;
     bool uploading = false;
+    bool interrupted = false;
     enum ota_status ota_return_status = ERROR_OTA_SETUP;
-    bool prevalidated = false;
     bool ota_end_called = false;
+    ota_upload_t* upload = NULL;
+    uint8_t* chunk_buf = NULL;
 
     // We expect a current message to be present
     ASSERT_CURRENT_MESSAGE(process, "ota");
@@ -227,48 +470,118 @@ void ota_process(void* process_ptr)
         goto cleanup;
     }
 
-    esp_ota_handle_t update_handle = 0;
-    esp_partition_t const* update_partition = NULL;
-    esp_err_t err = ESP_FAIL;
+    // The client can request larger chunks than the default - in which case we grant the
+    // largest we can accept, up to the size requested, and reply with the granted size.
+    size_t chunksize = JADE_OTA_BUF_SIZE;
+    const bool chunksize_requested = rpc_get_sizet("otachunk", &params, &chunksize);
+    if (chunksize_requested) {
+        if (chunksize == 0) {
+            jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Bad parameters", NULL);
+            goto cleanup;
+        }
+        chunksize = chunksize < JADE_OTA_MAX_BUF_SIZE ? chunksize : JADE_OTA_MAX_BUF_SIZE;
+        JADE_LOGI("Requested ota chunk size granted as %u", chunksize);
+    }
 
-    // sizeof(tinfl_decompressor) is just over 10k
-    tinfl_decompressor* decomp = JADE_MALLOC_PREFER_SPIRAM(sizeof(tinfl_decompressor));
-    jade_process_free_on_exit(process, decomp);
-    tinfl_init(decomp);
+    // The client can pass the hash of the compressed image - which is verified once uploaded,
+    // and allows an interrupted upload of that image to be resumed.
+    uint8_t cmphash[SHA256_LEN];
+    size_t written = 0;
+    rpc_get_bytes("cmphash", sizeof(cmphash), &params, cmphash, &written);
+    if (rpc_has_field_data("cmphash", &params) && written != sizeof(cmphash)) {
+        jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Bad parameters", NULL);
+        goto cleanup;
+    }
+    const uint8_t* const image_hash = written ? cmphash : NULL;
+
+    // Otherwise the client can say it will pass the hash with ota_complete (eg. if it is streaming
+    // the image as it downloads it) - in which case that is awaited before finalising the upload.
+    bool cmphash_on_complete = false;
+    rpc_get_boolean("cmphash_on_complete", &params, &cmphash_on_complete);
+    cmphash_on_complete = cmphash_on_complete && !image_hash;
+
+    // The upload may be a patch against the running firmware, rather than a full image
+    // NOTE: only supported with SPIRAM, as the patch buffers do not fit alongside the upload in DRAM
+    bool is_patch = false;
+    rpc_get_boolean("patch", &params, &is_patch);
+#ifndef CONFIG_ESP32_SPIRAM_SUPPORT
+    if (is_patch) {
+        jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Delta ota not supported", NULL);
+        goto cleanup;
+    }
+#endif
 
-    uint32_t remaining_compressed = compressedsize;
-    uint32_t remaining = firmwaresize;
+    // Resume any interrupted upload of the same image - otherwise abandon it
+    if (suspended_upload) {
+        if (can_resume_upload(suspended_upload, firmwaresize, compressedsize, image_hash, is_patch)) {
+            JADE_LOGI("Resuming ota upload at offset %u",
+                suspended_upload->compressedsize - suspended_upload->remaining_compressed);
+            upload = suspended_upload;
+        } else {
+            JADE_LOGI("Abandoning interrupted ota upload");
+            free_upload(suspended_upload, false);
+        }
+        suspended_upload = NULL;
+    }
+    if (!upload) {
+        upload = create_upload(firmwaresize, compressedsize, image_hash, is_patch);
+    }
 
+    esp_err_t err = ESP_FAIL;
     size_t timeout = DEFAULT_TIMEOUT_BEGIN;
 
-    int status = TINFL_STATUS_NEEDS_MORE_INPUT;
-    uint8_t* uncompressed = JADE_MALLOC_PREFER_SPIRAM(UNCOMPRESSED_BUF_SIZE);
-    jade_process_free_on_exit(process, uncompressed);
-
-    uint8_t* nout = uncompressed;
-
-    // Send the ok response, which implies now we will get ota_data messages
-    jade_process_reply_to_message_ok(process);
+    // Send the ok (or granted chunk size, or resume offset) response, which implies now we
+    // will get ota_data messages
+    if (image_hash) {
+        const ota_resume_reply_t reply
+            = { .chunksize = chunksize, .offset = upload->compressedsize - upload->remaining_compressed };
+        jade_process_reply_to_message_result(process->ctx, &reply, ota_resume_reply_cb);
+    } else if (chunksize_requested) {
+        jade_process_reply_to_message_result(process->ctx, &chunksize, cbor_result_uint_cb);
+    } else {
+        jade_process_reply_to_message_ok(process);
+    }
 
     // We will show a progress bar once the user has confirmed and the upload in progress
-    // Initially just show a message screen.
+    // Initially just show a message screen (unless resuming an upload already confirmed).
     progress_bar_t progress_bar = { .progress_bar = NULL, .pcnt_txt = NULL };
-    display_message_activity_two_lines("Preparing for firmware", "update");
+    if (upload->prevalidated) {
+        display_progress_bar_activity("Firmware Upgrade", "Upload Progress:", &progress_bar);
+        update_progress_bar(&progress_bar, upload->compressedsize,
+            upload->compressedsize - upload->remaining_compressed);
+    } else {
+        display_message_activity_two_lines("Preparing for firmware", "update");
+    }
 
     vTaskDelay(200 / portTICK_PERIOD_MS); // sleep a little bit
 
+    // Buffer each chunk is copied into, out of the input ring
+    chunk_buf = JADE_MALLOC_PREFER_SPIRAM(chunksize);
+
+    fw_writer_t writer = { .upload = upload, .progress_bar = &progress_bar, .status = SUCCESS };
     struct bin_msg binctx;
     ota_return_status = SUCCESS;
-    while (remaining_compressed) {
+    while (upload->remaining_compressed) {
         if (!timeout) {
             JADE_LOGE("OTA Timeout");
             ota_return_status = ERROR_TIMEOUT;
             goto cleanup;
         }
 
-        reset_ctx(&binctx, NULL, source);
+        reset_ctx(&binctx, chunk_buf, chunksize, source);
         jade_process_get_in_message(&binctx, &handle_in_bin_data, false); // non-blocking, we want to detect timeouts
 
+        if (binctx.other_msg) {
+            // Another request has interrupted the upload (eg. the client has reconnected after
+            // the connection dropped) - ask the client to retry it once the ota has ended.
+            JADE_LOGW("OTA upload interrupted");
+            reject_other_message(&binctx);
+            uploading = false;
+            interrupted = true;
+            ota_return_status = ERROR_BADDATA;
+            goto cleanup;
+        }
+
         if (binctx.error) {
             JADE_LOGE("Error on ota_data message");
             ota_return_status = ERROR_BADDATA;
@@ -287,63 +600,67 @@ void ota_process(void* process_ptr)
 
         JADE_LOGI("Received ota_data msg %s, payload size %u", binctx.id, binctx.len);
 
-        if (binctx.len > remaining_compressed) {
-            JADE_LOGE("Received %u bytes when only needed %u", binctx.len, remaining_compressed);
+        if (binctx.len > upload->remaining_compressed) {
+            JADE_LOGE("Received %u bytes when only needed %u", binctx.len, upload->remaining_compressed);
             ota_return_status = ERROR_BADDATA;
             goto cleanup;
         }
 
+        const int hashres = mbedtls_sha256_update_ret(&upload->sha_ctx, binctx.inbound_buf, binctx.len);
+        JADE_ASSERT(hashres == 0);
+
         size_t length = binctx.len;
         const uint8_t* data_buf = binctx.inbound_buf;
-        while (length > 0 && remaining > 0 && status > TINFL_STATUS_DONE) {
+        while (length > 0 && upload->remaining > 0 && upload->status > TINFL_STATUS_DONE) {
             size_t in_bytes = length;
-            size_t out_bytes = uncompressed + UNCOMPRESSED_BUF_SIZE - nout;
+            size_t out_bytes = upload->uncompressed + UNCOMPRESSED_BUF_SIZE - upload->nout;
             int flags = TINFL_FLAG_PARSE_ZLIB_HEADER;
-            if (remaining_compressed > length)
+            if (upload->remaining_compressed > length)
                 flags |= TINFL_FLAG_HAS_MORE_INPUT;
 
-            status = tinfl_decompress(decomp, data_buf, &in_bytes, uncompressed, nout, &out_bytes, flags);
+            const int64_t decompress_start_us = perf_now();
+            upload->status = tinfl_decompress(
+                upload->decomp, data_buf, &in_bytes, upload->uncompressed, upload->nout, &out_bytes, flags);
+            perf_record_timer(PERF_TIMER_OTA_DECOMPRESS, decompress_start_us);
 
-            remaining_compressed -= in_bytes;
+            upload->remaining_compressed -= in_bytes;
             length -= in_bytes;
             data_buf += in_bytes;
 
-            nout += out_bytes;
-            const size_t towrite = nout - uncompressed;
-            if ((prevalidated && status <= TINFL_STATUS_DONE) || towrite == UNCOMPRESSED_BUF_SIZE) {
-                if (!prevalidated) {
-                    const enum ota_status res
-                        = ota_init(uncompressed, &update_partition, firmwaresize, &update_handle, &progress_bar);
-                    if (res != SUCCESS) {
-                        JADE_LOGE("ota_init() error, %u", res);
-                        ota_return_status = res;
-                        goto cleanup;
-                    }
-                    prevalidated = true;
+            upload->nout += out_bytes;
+            const size_t towrite = upload->nout - upload->uncompressed;
+            const bool final = upload->status <= TINFL_STATUS_DONE && (upload->prevalidated || upload->patch);
+            if (final || towrite == UNCOMPRESSED_BUF_SIZE) {
+                // The decompressed data is either the firmware, or a patch to apply to the running firmware
+                bool written_ok;
+                if (upload->patch) {
+                    written_ok = ota_patch_apply(upload->patch, upload->uncompressed, towrite, write_firmware, &writer)
+                        && (upload->status != TINFL_STATUS_DONE
+                            || ota_patch_finish(upload->patch, write_firmware, &writer));
+                } else {
+                    written_ok = write_firmware(&writer, upload->uncompressed, towrite);
                 }
 
-                const esp_err_t res = esp_ota_write(update_handle, (const void*)uncompressed, towrite);
-                if (res != ESP_OK) {
-                    JADE_LOGE("ota_write() error: %u", res);
-                    ota_return_status = ERROR_WRITE;
+                if (!written_ok) {
+                    ota_return_status = writer.status != SUCCESS ? writer.status : ERROR_PATCH;
                     goto cleanup;
                 }
-
-                remaining -= towrite;
-                nout = uncompressed;
+                upload->nout = upload->uncompressed;
             }
         }
 
         // Update the progress bar once the user has confirmed and upload is in progress
-        if (prevalidated) {
+        if (upload->prevalidated) {
             JADE_ASSERT(progress_bar.progress_bar);
-            update_progress_bar(&progress_bar, compressedsize, compressedsize - remaining_compressed);
+            update_progress_bar(&progress_bar, compressedsize, compressedsize - upload->remaining_compressed);
         }
-        JADE_LOGI("compressed:   total = %u, current = %u", compressedsize, compressedsize - remaining_compressed);
-        JADE_LOGI("uncompressed: total = %u, current = %u", firmwaresize, firmwaresize - remaining);
+        JADE_LOGI(
+            "compressed:   total = %u, current = %u", compressedsize, compressedsize - upload->remaining_compressed);
+        JADE_LOGI("uncompressed: total = %u, current = %u", firmwaresize, firmwaresize - upload->remaining);
 
-        if ((status != TINFL_STATUS_DONE && remaining_compressed == 0) || (status < TINFL_STATUS_DONE)
-            || (status == TINFL_STATUS_DONE && remaining_compressed > 0)) {
+        if ((upload->status != TINFL_STATUS_DONE && upload->remaining_compressed == 0)
+            || (upload->status < TINFL_STATUS_DONE)
+            || (upload->status == TINFL_STATUS_DONE && upload->remaining_compressed > 0)) {
             JADE_LOGE("Data decompression error");
             ota_return_status = ERROR_DECOMPRESS;
             goto cleanup;
@@ -356,14 +673,55 @@ void ota_process(void* process_ptr)
     // Uploading complete
     uploading = false;
 
+    // If the hash of the compressed image is to be passed with ota_complete, await that
+    // before finalising the upload.  Otherwise it is finalised first, and ota_complete
+    // just requests the status.
+    if (cmphash_on_complete) {
+        jade_process_load_in_message(process, true);
+        if (!rpc_is_method(&process->ctx.value, "ota_complete")) {
+            jade_process_reject_message(
+                process, CBOR_RPC_PROTOCOL_ERROR, "Unexpected message, expecting 'ota_complete'", NULL);
+            ota_return_status = ERROR_FINISH;
+            goto cleanup;
+        }
+
+        CborValue complete_params;
+        written = 0;
+        const CborError cberr
+            = cbor_value_map_find_value(&process->ctx.value, CBOR_RPC_TAG_PARAMS, &complete_params);
+        bool has_cmphash = false;
+        if (cberr == CborNoError && cbor_value_is_map(&complete_params)) {
+            rpc_get_bytes("cmphash", sizeof(upload->cmphash), &complete_params, upload->cmphash, &written);
+            has_cmphash = rpc_has_field_data("cmphash", &complete_params);
+        }
+        if (has_cmphash && written != sizeof(upload->cmphash)) {
+            JADE_LOGE("Invalid compressed image hash passed with ota_complete");
+            ota_return_status = ERROR_BADHASH;
+            goto otacomplete;
+        }
+        upload->has_cmphash = written != 0;
+    }
+
     // Bail-out if the fw uncompressed to an unexpected size
-    if (remaining != 0) {
-        JADE_LOGE("Expected uncompressed size: %u, got %u", firmwaresize, firmwaresize - remaining);
+    if (upload->remaining != 0) {
+        JADE_LOGE("Expected uncompressed size: %u, got %u", firmwaresize, firmwaresize - upload->remaining);
         ota_return_status = ERROR_DECOMPRESS;
         goto otacomplete;
     }
 
-    err = esp_ota_end(update_handle);
+    // Bail-out if the compressed image does not match the hash passed
+    if (upload->has_cmphash) {
+        uint8_t calculated_hash[SHA256_LEN];
+        const int hashres = mbedtls_sha256_finish_ret(&upload->sha_ctx, calculated_hash);
+        JADE_ASSERT(hashres == 0);
+        if (sodium_memcmp(calculated_hash, upload->cmphash, sizeof(calculated_hash))) {
+            JADE_LOGE("Compressed image hash mismatch");
+            ota_return_status = ERROR_BADHASH;
+            goto otacomplete;
+        }
+    }
+
+    err = esp_ota_end(upload->update_handle);
     ota_end_called = true;
     if (err != ESP_OK) {
         JADE_LOGE("esp_ota_end() returned %d", err);
@@ -371,24 +729,28 @@ void ota_process(void* process_ptr)
         goto otacomplete;
     }
 
-    err = esp_ota_set_boot_partition(update_partition);
+    err = esp_ota_set_boot_partition(upload->update_partition);
     if (err != ESP_OK) {
         JADE_LOGE("esp_ota_set_boot_partition() returned %d", err);
         ota_return_status = ERROR_SETPARTITION;
         goto otacomplete;
     }
 
-    JADE_ASSERT(prevalidated);
+    JADE_ASSERT(upload->prevalidated);
     JADE_LOGI("Success");
 
 otacomplete:
-    // Expect a complete/request for status
-    jade_process_load_in_message(process, true);
+    // Expect a complete/request for status (if not already received)
+    if (!cmphash_on_complete) {
+        jade_process_load_in_message(process, true);
+        if (!rpc_is_method(&process->ctx.value, "ota_complete")) {
+            jade_process_reject_message(
+                process, CBOR_RPC_PROTOCOL_ERROR, "Unexpected message, expecting 'ota_complete'", NULL);
+            goto cleanup;
+        }
+    }
 
-    if (!rpc_is_method(&process->ctx.value, "ota_complete")) {
-        jade_process_reject_message(
-            process, CBOR_RPC_PROTOCOL_ERROR, "Unexpected message, expecting 'ota_complete'", NULL);
-    } else if (ota_return_status != SUCCESS) {
+    if (ota_return_status != SUCCESS) {
         jade_process_reject_message(
             process, CBOR_RPC_INTERNAL_ERROR, "Error completing OTA", MESSAGES[ota_return_status]);
     } else {
@@ -396,6 +758,8 @@ otacomplete:
     }
 
 cleanup:
+    free(chunk_buf);
+
     // If ota has been successful show message and reboot.
     // If error, show error-message and await user acknowledgement.
     if (ota_return_status == SUCCESS) {
@@ -405,11 +769,6 @@ cleanup:
         esp_restart();
     } else {
         JADE_LOGW("OTA error %u", ota_return_status);
-        if (prevalidated && !ota_end_called) {
-            // ota_begin has been called, cleanup
-            err = esp_ota_end(update_handle);
-            JADE_ASSERT(err == ESP_OK || err == ESP_ERR_OTA_VALIDATE_FAILED);
-        }
 
         // If we get here and we have not finished loading the data, send an error message
         if (uploading) {
@@ -417,11 +776,26 @@ cleanup:
             jade_process_reject_message_with_id(binctx.id, CBOR_RPC_INTERNAL_ERROR, "Error uploading OTA data",
                 (const uint8_t*)MESSAGES[ota_return_status], strlen(MESSAGES[ota_return_status]), buf, sizeof(buf),
                 source);
+            reject_inflight_messages(source, ota_return_status);
         }
 
-        // If the error is not 'did not start' or 'user declined', show an error screen
-        if (ota_return_status != ERROR_OTA_SETUP && ota_return_status != ERROR_USER_DECLINED) {
-            await_error_activity(MESSAGES[ota_return_status]);
+        // If the upload was interrupted (rather than the data being bad), and can be identified
+        // by its hash, retain it so it can be resumed - no need for the user to acknowledge.
+        // Otherwise abandon it, and if the error is not 'did not start', 'user declined' or an
+        // interruption (which the dashboard is left to handle), show an error screen.
+        if (upload && upload->has_cmphash && upload->prevalidated
+            && (ota_return_status == ERROR_TIMEOUT || ota_return_status == ERROR_BADDATA)) {
+            JADE_LOGW("Retaining interrupted ota upload at offset %u",
+                upload->compressedsize - upload->remaining_compressed);
+            suspended_upload = upload;
+            suspended_upload_time = xTaskGetTickCount();
+        } else {
+            if (upload) {
+                free_upload(upload, ota_end_called);
+            }
+            if (ota_return_status != ERROR_OTA_SETUP && ota_return_status != ERROR_USER_DECLINED && !interrupted) {
+                await_error_activity(MESSAGES[ota_return_status]);
+            }
         }
     }
 }
@@ -1,7 +1,51 @@
 #ifndef JADE_OTA_H_
 #define JADE_OTA_H_
 
-// OTA chunk size - should be less that MAX_INPUT_MSG_SIZE
+#include <sdkconfig.h>
+
+#include <esp_partition.h>
+#include <stdbool.h>
+#include <stddef.h>
+#include <stdint.h>
+
+// OTA chunk size - the default, unless the client requests larger chunks
 #define JADE_OTA_BUF_SIZE (1024 * 4)
 
+// Largest OTA chunk size that can be granted - each chunk is copied out of the shared input
+// ring into a buffer of the granted size, so the ring only ever holds the chunks in flight.
+// Must fit with the message overhead in MAX_INPUT_MSG_SIZE.
+#ifndef CONFIG_ESP32_SPIRAM_SUPPORT
+#define JADE_OTA_MAX_BUF_SIZE (1024 * 8)
+#else
+#define JADE_OTA_MAX_BUF_SIZE (1024 * 128)
+#endif
+
+// Delta ota - the (zlib compressed) upload is a patch from the running firmware to the new
+// firmware, as generated by fwprep.py.  The patch is:
+//   header: magic "JDP1" | base image length (u32) | base app_elf_sha256 (32 bytes)
+//   then a sequence of ops (all integers little-endian):
+//     'A' | base offset (u32) | length (u32) | <length> bytes added to the base bytes
+//     'I' | length (u32) | <length> bytes inserted as-is
+#define OTA_PATCH_MAGIC "JDP1"
+#define OTA_PATCH_OP_ADD 'A'
+#define OTA_PATCH_OP_INSERT 'I'
+
+typedef struct ota_patch ota_patch_t;
+
+// Called with each block of patched firmware - returns false on error
+typedef bool (*ota_patch_writer_fn)(void* ctx, const uint8_t* data, size_t len);
+
+// Create a patch applier reading the base firmware from the 'source' partition, and
+// passing the patched firmware to the writer in blocks of 'outbuf_size' bytes.
+ota_patch_t* ota_patch_create(const esp_partition_t* source, size_t outbuf_size);
+void ota_patch_free(ota_patch_t* patch);
+
+// Apply the next part of the (uncompressed) patch - returns false if the patch is invalid,
+// does not apply to the source firmware, or the writer fails.
+bool ota_patch_apply(ota_patch_t* patch, const uint8_t* data, size_t len, ota_patch_writer_fn writer, void* ctx);
+
+// Flush the remaining patched firmware at the end of the patch - returns false if the
+// patch is incomplete or the writer fails.
+bool ota_patch_finish(ota_patch_t* patch, ota_patch_writer_fn writer, void* ctx);
+
 #endif /* JADE_OTA_H_ */
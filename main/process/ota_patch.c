@@ -0,0 +1,222 @@
+#include "ota.h"
+#include "../jade_assert.h"
+#include "../utils/malloc_ext.h"
+
+#include <string.h>
+
+#include <esp_ota_ops.h>
+
+// Base firmware is read from flash in blocks of this size
+#define SOURCE_BUF_SIZE 4096
+
+#define PATCH_HEADER_LEN (sizeof(OTA_PATCH_MAGIC) - 1 + sizeof(uint32_t) + 32)
+#define ADD_OP_LEN (1 + 2 * sizeof(uint32_t))
+#define INSERT_OP_LEN (1 + sizeof(uint32_t))
+
+struct ota_patch {
+    const esp_partition_t* source;
+    size_t source_len;
+
+    // The patch header, or the header of the next op, as it is received
+    uint8_t header[PATCH_HEADER_LEN];
+    size_t header_len;
+    bool patch_header_read;
+
+    // The op being applied
+    uint8_t op;
+    uint32_t source_offset;
+    uint32_t op_remaining;
+
+    uint8_t* sourcebuf;
+    uint8_t* outbuf;
+    size_t outbuf_size;
+    size_t outbuf_len;
+};
+
+static inline uint32_t read_u32(const uint8_t* data)
+{
+    return (uint32_t)data[0] | ((uint32_t)data[1] << 8) | ((uint32_t)data[2] << 16) | ((uint32_t)data[3] << 24);
+}
+
+ota_patch_t* ota_patch_create(const esp_partition_t* source, const size_t outbuf_size)
+{
+    JADE_ASSERT(source);
+    JADE_ASSERT(outbuf_size);
+
+    ota_patch_t* patch = JADE_CALLOC(1, sizeof(ota_patch_t));
+    patch->source = source;
+    patch->sourcebuf = JADE_MALLOC_PREFER_SPIRAM(SOURCE_BUF_SIZE);
+    patch->outbuf = JADE_MALLOC_PREFER_SPIRAM(outbuf_size);
+    patch->outbuf_size = outbuf_size;
+    return patch;
+}
+
+void ota_patch_free(ota_patch_t* patch)
+{
+    JADE_ASSERT(patch);
+    free(patch->outbuf);
+    free(patch->sourcebuf);
+    free(patch);
+}
+
+// Check the patch header, and that the patch is for the firmware in the source partition
+static bool read_patch_header(ota_patch_t* patch)
+{
+    const size_t magic_len = sizeof(OTA_PATCH_MAGIC) - 1;
+    if (memcmp(patch->header, OTA_PATCH_MAGIC, magic_len)) {
+        JADE_LOGE("Invalid patch header");
+        return false;
+    }
+
+    patch->source_len = read_u32(patch->header + magic_len);
+    if (patch->source_len > patch->source->size) {
+        JADE_LOGE("Patch base length %u exceeds partition size %u", patch->source_len, patch->source->size);
+        return false;
+    }
+
+    esp_app_desc_t source_app_info;
+    if (esp_ota_get_partition_description(patch->source, &source_app_info) != ESP_OK) {
+        JADE_LOGE("Failed to read patch base firmware description");
+        return false;
+    }
+
+    const uint8_t* base_elf_sha256 = patch->header + magic_len + sizeof(uint32_t);
+    if (memcmp(base_elf_sha256, source_app_info.app_elf_sha256, sizeof(source_app_info.app_elf_sha256))) {
+        JADE_LOGE("Patch is not for the running firmware %s", source_app_info.version);
+        return false;
+    }
+
+    JADE_LOGI("Applying patch to running firmware %s", source_app_info.version);
+    patch->patch_header_read = true;
+    return true;
+}
+
+// Start the op whose header has been read
+static bool read_op_header(ota_patch_t* patch)
+{
+    patch->op = patch->header[0];
+    if (patch->op == OTA_PATCH_OP_ADD) {
+        patch->source_offset = read_u32(patch->header + 1);
+        patch->op_remaining = read_u32(patch->header + 1 + sizeof(uint32_t));
+        if (patch->source_offset > patch->source_len
+            || patch->op_remaining > patch->source_len - patch->source_offset) {
+            JADE_LOGE("Patch op exceeds base firmware: %u + %u", patch->source_offset, patch->op_remaining);
+            return false;
+        }
+    } else {
+        JADE_ASSERT(patch->op == OTA_PATCH_OP_INSERT);
+        patch->op_remaining = read_u32(patch->header + 1);
+    }
+
+    if (!patch->op_remaining) {
+        JADE_LOGE("Empty patch op");
+        return false;
+    }
+    return true;
+}
+
+// The length of the header currently being received (the patch header, or the next op header)
+static size_t expected_header_len(const ota_patch_t* patch)
+{
+    if (!patch->patch_header_read) {
+        return PATCH_HEADER_LEN;
+    }
+    if (!patch->header_len) {
+        return 1; // op type
+    }
+    switch (patch->header[0]) {
+    case OTA_PATCH_OP_ADD:
+        return ADD_OP_LEN;
+    case OTA_PATCH_OP_INSERT:
+        return INSERT_OP_LEN;
+    default:
+        return 0;
+    }
+}
+
+bool ota_patch_apply(
+    ota_patch_t* patch, const uint8_t* data, size_t len, const ota_patch_writer_fn writer, void* ctx)
+{
+    JADE_ASSERT(patch);
+    JADE_ASSERT(data || !len);
+    JADE_ASSERT(writer);
+
+    while (len) {
+        if (!patch->op_remaining) {
+            // Collect the next header
+            const size_t header_len = expected_header_len(patch);
+            if (!header_len) {
+                JADE_LOGE("Invalid patch op: %u", patch->header[0]);
+                return false;
+            }
+
+            const size_t n = len < header_len - patch->header_len ? len : header_len - patch->header_len;
+            memcpy(patch->header + patch->header_len, data, n);
+            patch->header_len += n;
+            data += n;
+            len -= n;
+
+            if (patch->header_len == header_len && header_len > 1) {
+                if (!(patch->patch_header_read ? read_op_header(patch) : read_patch_header(patch))) {
+                    return false;
+                }
+                patch->header_len = 0;
+            }
+            continue;
+        }
+
+        // Apply the current op, as far as the data and the output buffer allow
+        size_t n = len < patch->op_remaining ? len : patch->op_remaining;
+        if (n > patch->outbuf_size - patch->outbuf_len) {
+            n = patch->outbuf_size - patch->outbuf_len;
+        }
+
+        uint8_t* out = patch->outbuf + patch->outbuf_len;
+        if (patch->op == OTA_PATCH_OP_ADD) {
+            n = n < SOURCE_BUF_SIZE ? n : SOURCE_BUF_SIZE;
+            const esp_err_t err = esp_partition_read(patch->source, patch->source_offset, patch->sourcebuf, n);
+            if (err != ESP_OK) {
+                JADE_LOGE("esp_partition_read() returned %d", err);
+                return false;
+            }
+            for (size_t i = 0; i < n; ++i) {
+                out[i] = patch->sourcebuf[i] + data[i];
+            }
+            patch->source_offset += n;
+        } else {
+            memcpy(out, data, n);
+        }
+
+        patch->outbuf_len += n;
+        patch->op_remaining -= n;
+        data += n;
+        len -= n;
+
+        if (patch->outbuf_len == patch->outbuf_size) {
+            if (!writer(ctx, patch->outbuf, patch->outbuf_len)) {
+                return false;
+            }
+            patch->outbuf_len = 0;
+        }
+    }
+    return true;
+}
+
+bool ota_patch_finish(ota_patch_t* patch, const ota_patch_writer_fn writer, void* ctx)
+{
+    JADE_ASSERT(patch);
+    JADE_ASSERT(writer);
+
+    if (!patch->patch_header_read || patch->header_len || patch->op_remaining) {
+        JADE_LOGE("Incomplete patch");
+        return false;
+    }
+
+    if (patch->outbuf_len) {
+        if (!writer(ctx, patch->outbuf, patch->outbuf_len)) {
+            return false;
+        }
+        patch->outbuf_len = 0;
+    }
+    return true;
+}
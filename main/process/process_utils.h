@@ -42,6 +42,23 @@ typedef enum {
     SCRIPT_FLAVOUR_MIXED
 } script_flavour_t;
 
+// Maximum number of outputs in a single (multi-output) get_shared_nonce request
+#define MAX_SHARED_NONCE_OUTPUTS 64
+
+// Chunked txn upload - for txns too large to pass in the sign_tx/sign_liquid_tx message.
+// NOTE: this only raises the maximum txn size - the chunks are assembled into a buffer of
+// the whole txn before it is parsed, and the input ring is still sized for the largest
+// whole-txn message (MAX_INPUT_MSG_SIZE), so as not to break clients which do not chunk.
+// The length is checked against this limit, and against the free heap (which must also
+// allow for the parsed txn), before anything is allocated.
+// With SPIRAM the limit is the largest standard txn (400k weight units, so at most 400k bytes).
+#define MAX_TXN_CHUNK_SIZE (1024 * 8)
+#ifndef CONFIG_ESP32_SPIRAM_SUPPORT
+#define MAX_CHUNKED_TXN_SIZE (1024 * 32)
+#else
+#define MAX_CHUNKED_TXN_SIZE (400 * 1000)
+#endif
+
 #define WARN_MSG_MIXED_INPUTS "Your inputs in this transaction are of varying types."
 
 #endif /* PROCESS_UTILS_H_ */
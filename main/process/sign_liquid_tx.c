@@ -24,6 +24,7 @@ void update_aggregate_scripts_flavour(
     const script_flavour_t new_script_flvaour, script_flavour_t* aggregate_scripts_flavour);
 bool validate_change_paths(jade_process_t* process, const char* network, struct wally_tx* tx, CborValue* change,
     output_info_t* output_info, char** errmsg);
+uint8_t* receive_chunked_txn(jade_process_t* process, const size_t txn_len);
 
 static void wally_free_tx_wrapper(void* tx) { JADE_WALLY_VERIFY(wally_tx_free((struct wally_tx*)tx)); }
 
@@ -169,6 +170,18 @@ void sign_liquid_tx_process(void* process_ptr)
     const uint8_t* txbytes = NULL;
     rpc_get_bytes_ptr("txn", &params, &txbytes, &written);
 
+    // A large txn may instead be uploaded in chunks, following this message
+    size_t txn_len = 0;
+    uint8_t* txn_upload = NULL;
+    if (written == 0 && rpc_get_sizet("txn_len", &params, &txn_len)) {
+        txn_upload = receive_chunked_txn(process, txn_len);
+        if (!txn_upload) {
+            goto cleanup;
+        }
+        txbytes = txn_upload;
+        written = txn_len;
+    }
+
     if (written == 0) {
         jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract txn from parameters", NULL);
         goto cleanup;
@@ -177,6 +190,7 @@ void sign_liquid_tx_process(void* process_ptr)
 
     struct wally_tx* tx = NULL;
     int res = wally_tx_from_bytes(txbytes, written, WALLY_TX_FLAG_USE_ELEMENTS, &tx); // elements, without witness
+    free(txn_upload); // Any uploaded txn is no longer needed
     if (res != WALLY_OK || !tx) {
         jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract tx from passed bytes", NULL);
         goto cleanup;
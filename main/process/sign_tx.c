@@ -19,6 +19,132 @@
 
 static void wally_free_tx_wrapper(void* tx) { JADE_WALLY_VERIFY(wally_tx_free((struct wally_tx*)tx)); }
 
+// Prevout amounts taken from an input_tx already sent in this signing session, so
+// subsequent inputs spending the same prior tx can reference it by txhash.
+typedef struct {
+    uint64_t satoshi;
+    bool known;
+} prevout_amount_t;
+
+// Record the amounts of all subsequent inputs which spend outputs of the passed (verified) input_tx
+static void cache_prevout_amounts(const struct wally_tx* tx, const size_t index, const struct wally_tx* input_tx,
+    prevout_amount_t* prevout_amounts)
+{
+    JADE_ASSERT(tx);
+    JADE_ASSERT(index < tx->num_inputs);
+    JADE_ASSERT(input_tx);
+    JADE_ASSERT(prevout_amounts);
+
+    for (size_t i = index + 1; i < tx->num_inputs; ++i) {
+        if (!memcmp(tx->inputs[i].txhash, tx->inputs[index].txhash, WALLY_TXHASH_LEN)
+            && tx->inputs[i].index < input_tx->num_outputs) {
+            prevout_amounts[i].satoshi = input_tx->outputs[tx->inputs[i].index].satoshi;
+            prevout_amounts[i].known = true;
+        }
+    }
+}
+
+// Chunked txn upload - used when the txn is too large to pass in the sign_tx message.
+// The message passes 'txn_len' rather than 'txn', and we reply 'true' when ready to
+// receive.  The txn is then sent in 'tx_data' messages, each of which we ack with 'true'.
+struct txn_chunk_msg {
+    char id[MAXLEN_ID + 1];
+    uint8_t* txbuf;
+    size_t txbuf_len;
+    size_t written;
+    jade_msg_source_t expected_source;
+    bool error;
+};
+
+static void handle_in_txn_chunk(void* ctx, unsigned char* data, size_t rawsize)
+{
+    JADE_ASSERT(ctx);
+    JADE_ASSERT(data);
+    JADE_ASSERT(rawsize >= 2);
+
+    CborParser parser;
+    CborValue value;
+    const CborError cberr = cbor_parser_init(data + 1, rawsize - 1, CborValidateBasic, &parser, &value);
+    JADE_ASSERT(cberr == CborNoError);
+    JADE_ASSERT(rpc_request_valid(&value));
+
+    struct txn_chunk_msg* chunkctx = ctx;
+
+    size_t written = 0;
+    rpc_get_id(&value, chunkctx->id, sizeof(chunkctx->id), &written);
+    JADE_ASSERT(written != 0);
+
+    if (!rpc_is_method(&value, "tx_data")) {
+        chunkctx->error = true;
+        return;
+    }
+
+    written = 0;
+    const uint8_t* chunk = NULL;
+    rpc_get_bytes_ptr("params", &value, &chunk, &written);
+
+    if (written == 0 || data[0] != chunkctx->expected_source || written > MAX_TXN_CHUNK_SIZE
+        || written > chunkctx->txbuf_len - chunkctx->written) {
+        chunkctx->error = true;
+        return;
+    }
+
+    // Copy the chunk now, as the message data is only valid in this callback
+    memcpy(chunkctx->txbuf + chunkctx->written, chunk, written);
+    chunkctx->written += written;
+}
+
+// Receive a txn of 'txn_len' bytes uploaded in 'tx_data' chunks (see above).
+// Replies to the current message, and to every chunk message.
+// Returns the txn buffer (to be freed by the caller), or NULL if the length is too large for
+// the device or a bad chunk is received - in which case the message has been rejected.
+uint8_t* receive_chunked_txn(jade_process_t* process, const size_t txn_len)
+{
+    JADE_ASSERT(process);
+
+    // Check the client-provided length before allocating anything - the buffer must fit in
+    // the heap, leaving at least as much again for the parsed txn.
+    const size_t largest_block = heap_caps_get_largest_free_block(MALLOC_CAP_DEFAULT);
+    const size_t free_heap = heap_caps_get_free_size(MALLOC_CAP_DEFAULT);
+    if (txn_len == 0 || txn_len > MAX_CHUNKED_TXN_SIZE) {
+        jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Invalid txn_len parameter", NULL);
+        return NULL;
+    }
+    if (txn_len > largest_block || txn_len > free_heap / 2) {
+        JADE_LOGW("Rejecting txn_len %u - largest free block %u, free heap %u", txn_len, largest_block, free_heap);
+        jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Transaction too large for device", NULL);
+        return NULL;
+    }
+
+    uint8_t* const txbuf = JADE_MALLOC_PREFER_SPIRAM(txn_len);
+    struct txn_chunk_msg chunkctx = { .txbuf = txbuf,
+        .txbuf_len = txn_len,
+        .written = 0,
+        .expected_source = process->ctx.source,
+        .error = false };
+
+    // Reply ok to say we are ready to receive the txn
+    jade_process_reply_to_message_ok(process);
+
+    uint8_t reply_msg[MAXLEN_ID + 128];
+    const bool ok = true;
+    while (chunkctx.written < txn_len) {
+        jade_process_get_in_message(&chunkctx, &handle_in_txn_chunk, true);
+
+        if (chunkctx.error) {
+            JADE_LOGE("Error on tx_data message");
+            jade_process_reject_message_with_id(chunkctx.id, CBOR_RPC_BAD_PARAMETERS, "Invalid tx_data message", NULL,
+                0, reply_msg, sizeof(reply_msg), chunkctx.expected_source);
+            free(txbuf);
+            return NULL;
+        }
+
+        jade_process_reply_to_message_result_with_id(
+            chunkctx.id, reply_msg, sizeof(reply_msg), chunkctx.expected_source, &ok, cbor_result_boolean_cb);
+    }
+    return txbuf;
+}
+
 // For now just return 'single-sig' or 'other'.
 // In future may extend to inlcude eg. 'green', 'other-multisig', etc.
 script_flavour_t get_script_flavour(const uint8_t* script, const size_t script_len)
@@ -169,6 +295,18 @@ void sign_tx_process(void* process_ptr)
     const uint8_t* txbytes = NULL;
     rpc_get_bytes_ptr("txn", &params, &txbytes, &written);
 
+    // A large txn may instead be uploaded in chunks, following this message
+    size_t txn_len = 0;
+    uint8_t* txn_upload = NULL;
+    if (written == 0 && rpc_get_sizet("txn_len", &params, &txn_len)) {
+        txn_upload = receive_chunked_txn(process, txn_len);
+        if (!txn_upload) {
+            goto cleanup;
+        }
+        txbytes = txn_upload;
+        written = txn_len;
+    }
+
     if (written == 0) {
         jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract tx from parameters", NULL);
         goto cleanup;
@@ -177,6 +315,7 @@ void sign_tx_process(void* process_ptr)
 
     struct wally_tx* tx = NULL;
     int res = wally_tx_from_bytes(txbytes, written, 0, &tx); // 0 = no witness, TODO
+    free(txn_upload); // Any uploaded txn is no longer needed
     if (res != WALLY_OK || !tx) {
         jade_process_reject_message(process, CBOR_RPC_BAD_PARAMETERS, "Failed to extract tx from passed bytes", NULL);
         goto cleanup;
@@ -261,6 +400,10 @@ void sign_tx_process(void* process_ptr)
     signing_data_t* const all_signing_data = JADE_CALLOC(num_inputs, sizeof(signing_data_t));
     jade_process_free_on_exit(process, all_signing_data);
 
+    // Amounts of prevouts from input_txs already sent (for inputs which reference them)
+    prevout_amount_t* const prevout_amounts = JADE_CALLOC(num_inputs, sizeof(prevout_amount_t));
+    jade_process_free_on_exit(process, prevout_amounts);
+
     // We track if the type of the inputs we are signing changes (ie. single-sig vs
     // green/multisig/other) so we can show a warning to the user if so.
     script_flavour_t aggregate_inputs_scripts_flavour = SCRIPT_FLAVOUR_NONE;
@@ -327,6 +470,7 @@ void sign_tx_process(void* process_ptr)
 
         // Full input tx can be omitted for transactions with only one single witness
         // input, otherwise it must be present to validate the input utxo amounts.
+        // (If already sent for an earlier input it can instead be referenced by txhash.)
         const unsigned char* txbuf = NULL;
         size_t txsize = 0;
         rpc_get_bytes_ptr("input_tx", &params, &txbuf, &txsize);
@@ -368,8 +512,28 @@ void sign_tx_process(void* process_ptr)
             // Fetch the amount from the txn
             input_satoshi = input_tx->outputs[tx->inputs[index].index].satoshi;
 
+            // Also record the amounts for any later inputs spending the same txn,
+            // so the client need not send it again for those inputs.
+            cache_prevout_amounts(tx, index, input_tx, prevout_amounts);
+
             // Free the (potentially large) txn immediately
             JADE_WALLY_VERIFY(wally_tx_free(input_tx));
+        } else if (rpc_has_field_data("input_txhash", &params)) {
+            // Reference to an input_tx sent with a prior input in this session
+            const uint8_t* txhash = NULL;
+            size_t txhash_len = 0;
+            rpc_get_bytes_ptr("input_txhash", &params, &txhash, &txhash_len);
+
+            if (txhash_len != WALLY_TXHASH_LEN
+                || sodium_memcmp(txhash, tx->inputs[index].txhash, WALLY_TXHASH_LEN) != 0
+                || !prevout_amounts[index].known) {
+                jade_process_reject_message(
+                    process, CBOR_RPC_BAD_PARAMETERS, "input_txhash cannot be resolved to a prior input_tx", NULL);
+                goto cleanup;
+            }
+
+            JADE_LOGD("Using input utxo amount from previously sent prior transaction");
+            input_satoshi = prevout_amounts[index].satoshi;
         } else {
             if (!is_witness || num_inputs > 1) {
                 jade_process_reject_message(
@@ -19,6 +19,8 @@
 #define CBOR_RPC_PROTOCOL_ERROR -32001
 #define CBOR_RPC_HW_LOCKED -32002
 #define CBOR_RPC_NETWORK_MISMATCH -32003
+#define CBOR_RPC_BATCH_FULL -32004
+#define CBOR_RPC_OTA_INTERRUPTED -32005
 
 #define CBOR_RPC_TAG_PARAMS "params"
 #define MAXLEN_ID 16
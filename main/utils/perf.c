@@ -0,0 +1,299 @@
+#include "perf.h"
+
+#ifdef CONFIG_DEBUG_MODE
+
+#include <freertos/FreeRTOS.h>
+#include <freertos/task.h>
+
+#include <string.h>
+
+#include "jade_assert.h"
+#include "utils/cbor_rpc.h"
+#include "utils/malloc_ext.h"
+
+// Only methods dispatched by the dashboard are recorded (currently 19) - any beyond
+// this are aggregated under 'other'
+#define PERF_MAX_METHODS 24
+#define PERF_MAX_METHOD_NAME_LEN 24
+
+typedef struct {
+    uint32_t count;
+    uint64_t total_us;
+    uint32_t max_us;
+} perf_timing_t;
+
+typedef struct {
+    char name[PERF_MAX_METHOD_NAME_LEN];
+    perf_timing_t timing;
+} perf_method_t;
+
+typedef struct {
+    uint32_t msgs_in;
+    uint64_t bytes_in;
+    uint32_t msgs_out;
+    uint64_t bytes_out;
+} perf_source_t;
+
+typedef struct {
+    size_t size;
+    size_t high_water;
+} perf_ring_usage_t;
+
+static const char* TIMER_NAMES[PERF_TIMER_COUNT] = { "wire_framing", "ota_decompress", "ota_write" };
+static const char* RING_NAMES[PERF_RING_COUNT] = { "shared_in", "serial_out", "ble_out" };
+
+// Counters are updated from the serial, ble and dashboard tasks
+static portMUX_TYPE perf_mutex = portMUX_INITIALIZER_UNLOCKED;
+
+static perf_method_t methods[PERF_MAX_METHODS];
+static size_t num_methods = 0;
+static perf_timing_t timers[PERF_TIMER_COUNT];
+static perf_source_t sources[2]; // serial, ble
+static perf_ring_usage_t rings[PERF_RING_COUNT];
+
+static void update_timing(perf_timing_t* timing, const int64_t start_us)
+{
+    const int64_t elapsed = esp_timer_get_time() - start_us;
+    const uint32_t elapsed_us = elapsed > 0 ? elapsed : 0;
+
+    ++timing->count;
+    timing->total_us += elapsed_us;
+    if (elapsed_us > timing->max_us) {
+        timing->max_us = elapsed_us;
+    }
+}
+
+static perf_source_t* get_source(const jade_msg_source_t source)
+{
+    JADE_ASSERT(source == SOURCE_SERIAL || source == SOURCE_BLE);
+    return &sources[source == SOURCE_SERIAL ? 0 : 1];
+}
+
+void perf_record_method(const char* method, const size_t method_len, const int64_t start_us)
+{
+    JADE_ASSERT(method);
+
+    // Last entry is reserved for 'other'
+    const size_t name_len = method_len < PERF_MAX_METHOD_NAME_LEN ? method_len : PERF_MAX_METHOD_NAME_LEN - 1;
+
+    portENTER_CRITICAL(&perf_mutex);
+    perf_method_t* entry = NULL;
+    for (size_t i = 0; i < num_methods && !entry; ++i) {
+        if (!strncmp(methods[i].name, method, name_len) && methods[i].name[name_len] == '\0') {
+            entry = &methods[i];
+        }
+    }
+    if (!entry) {
+        if (num_methods < PERF_MAX_METHODS - 1) {
+            entry = &methods[num_methods++];
+            memcpy(entry->name, method, name_len);
+            entry->name[name_len] = '\0';
+        } else {
+            entry = &methods[PERF_MAX_METHODS - 1];
+            strcpy(entry->name, "other");
+        }
+    }
+    update_timing(&entry->timing, start_us);
+    portEXIT_CRITICAL(&perf_mutex);
+}
+
+void perf_record_timer(const perf_timer_t timer, const int64_t start_us)
+{
+    JADE_ASSERT(timer < PERF_TIMER_COUNT);
+
+    portENTER_CRITICAL(&perf_mutex);
+    update_timing(&timers[timer], start_us);
+    portEXIT_CRITICAL(&perf_mutex);
+}
+
+void perf_record_message_in(const jade_msg_source_t source, const size_t size)
+{
+    perf_source_t* counters = get_source(source);
+
+    portENTER_CRITICAL(&perf_mutex);
+    ++counters->msgs_in;
+    counters->bytes_in += size;
+    portEXIT_CRITICAL(&perf_mutex);
+}
+
+void perf_record_message_out(const jade_msg_source_t source, const size_t size)
+{
+    perf_source_t* counters = get_source(source);
+
+    portENTER_CRITICAL(&perf_mutex);
+    ++counters->msgs_out;
+    counters->bytes_out += size;
+    portEXIT_CRITICAL(&perf_mutex);
+}
+
+void perf_record_ring_usage(const perf_ring_t ring, const size_t used, const size_t size)
+{
+    JADE_ASSERT(ring < PERF_RING_COUNT);
+
+    portENTER_CRITICAL(&perf_mutex);
+    rings[ring].size = size;
+    if (used > rings[ring].high_water) {
+        rings[ring].high_water = used;
+    }
+    portEXIT_CRITICAL(&perf_mutex);
+}
+
+static void add_timing_to_map(CborEncoder* container, const char* name, const perf_timing_t* timing)
+{
+    CborError cberr = cbor_encode_text_stringz(container, name);
+    JADE_ASSERT(cberr == CborNoError);
+
+    CborEncoder map_encoder;
+    cberr = cbor_encoder_create_map(container, &map_encoder, 3);
+    JADE_ASSERT(cberr == CborNoError);
+
+    add_uint_to_map(&map_encoder, "count", timing->count);
+    add_uint_to_map(&map_encoder, "total_us", timing->total_us);
+    add_uint_to_map(&map_encoder, "max_us", timing->max_us);
+
+    cberr = cbor_encoder_close_container(container, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+static void add_source_to_map(CborEncoder* container, const char* name, const perf_source_t* source)
+{
+    CborError cberr = cbor_encode_text_stringz(container, name);
+    JADE_ASSERT(cberr == CborNoError);
+
+    CborEncoder map_encoder;
+    cberr = cbor_encoder_create_map(container, &map_encoder, 4);
+    JADE_ASSERT(cberr == CborNoError);
+
+    add_uint_to_map(&map_encoder, "msgs_in", source->msgs_in);
+    add_uint_to_map(&map_encoder, "bytes_in", source->bytes_in);
+    add_uint_to_map(&map_encoder, "msgs_out", source->msgs_out);
+    add_uint_to_map(&map_encoder, "bytes_out", source->bytes_out);
+
+    cberr = cbor_encoder_close_container(container, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+static void add_ring_to_map(CborEncoder* container, const char* name, const perf_ring_usage_t* ring)
+{
+    CborError cberr = cbor_encode_text_stringz(container, name);
+    JADE_ASSERT(cberr == CborNoError);
+
+    CborEncoder map_encoder;
+    cberr = cbor_encoder_create_map(container, &map_encoder, 2);
+    JADE_ASSERT(cberr == CborNoError);
+
+    add_uint_to_map(&map_encoder, "size", ring->size);
+    add_uint_to_map(&map_encoder, "high_water", ring->high_water);
+
+    cberr = cbor_encoder_close_container(container, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+#if defined(CONFIG_FREERTOS_USE_TRACE_FACILITY) && defined(CONFIG_FREERTOS_GENERATE_RUN_TIME_STATS)
+// Cumulative task run times - the client can diff these to get cpu percentages
+static void add_task_runtimes_to_map(CborEncoder* container)
+{
+    UBaseType_t num_tasks = uxTaskGetNumberOfTasks() + 2; // allow for tasks created meanwhile
+    TaskStatus_t* tasks = JADE_MALLOC(num_tasks * sizeof(TaskStatus_t));
+    uint32_t total_runtime = 0;
+    num_tasks = uxTaskGetSystemState(tasks, num_tasks, &total_runtime);
+
+    add_uint_to_map(container, "total_runtime", total_runtime);
+
+    CborError cberr = cbor_encode_text_stringz(container, "tasks");
+    JADE_ASSERT(cberr == CborNoError);
+
+    CborEncoder map_encoder;
+    cberr = cbor_encoder_create_map(container, &map_encoder, num_tasks);
+    JADE_ASSERT(cberr == CborNoError);
+
+    for (size_t i = 0; i < num_tasks; ++i) {
+        add_uint_to_map(&map_encoder, tasks[i].pcTaskName, tasks[i].ulRunTimeCounter);
+    }
+
+    cberr = cbor_encoder_close_container(container, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+    free(tasks);
+}
+#define NUM_TASK_RUNTIME_FIELDS 2
+#else
+#define NUM_TASK_RUNTIME_FIELDS 0
+#endif
+
+void perf_stats_cb(const void* ctx, CborEncoder* container)
+{
+    JADE_ASSERT(ctx == NULL); // Unused here
+    JADE_ASSERT(container);
+
+    // Take a copy of the counters, so not holding the lock while encoding
+    portENTER_CRITICAL(&perf_mutex);
+    perf_method_t methods_copy[PERF_MAX_METHODS];
+    const size_t num_methods_copy = methods[PERF_MAX_METHODS - 1].timing.count ? PERF_MAX_METHODS : num_methods;
+    memcpy(methods_copy, methods, sizeof(methods_copy));
+    perf_timing_t timers_copy[PERF_TIMER_COUNT];
+    memcpy(timers_copy, timers, sizeof(timers_copy));
+    perf_source_t sources_copy[2];
+    memcpy(sources_copy, sources, sizeof(sources_copy));
+    perf_ring_usage_t rings_copy[PERF_RING_COUNT];
+    memcpy(rings_copy, rings, sizeof(rings_copy));
+    portEXIT_CRITICAL(&perf_mutex);
+
+    CborEncoder root_map;
+    CborError cberr = cbor_encoder_create_map(container, &root_map, 5 + NUM_TASK_RUNTIME_FIELDS);
+    JADE_ASSERT(cberr == CborNoError);
+
+    add_uint_to_map(&root_map, "uptime_us", esp_timer_get_time());
+
+    // Per-method handling times
+    CborEncoder map_encoder;
+    cberr = cbor_encode_text_stringz(&root_map, "methods");
+    JADE_ASSERT(cberr == CborNoError);
+    cberr = cbor_encoder_create_map(&root_map, &map_encoder, num_methods_copy);
+    JADE_ASSERT(cberr == CborNoError);
+    for (size_t i = 0; i < num_methods_copy; ++i) {
+        add_timing_to_map(&map_encoder, methods_copy[i].name, &methods_copy[i].timing);
+    }
+    cberr = cbor_encoder_close_container(&root_map, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+
+    // Message counts/bytes per source
+    cberr = cbor_encode_text_stringz(&root_map, "sources");
+    JADE_ASSERT(cberr == CborNoError);
+    cberr = cbor_encoder_create_map(&root_map, &map_encoder, 2);
+    JADE_ASSERT(cberr == CborNoError);
+    add_source_to_map(&map_encoder, "serial", &sources_copy[0]);
+    add_source_to_map(&map_encoder, "ble", &sources_copy[1]);
+    cberr = cbor_encoder_close_container(&root_map, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+
+    // Ring buffer high-water marks
+    cberr = cbor_encode_text_stringz(&root_map, "rings");
+    JADE_ASSERT(cberr == CborNoError);
+    cberr = cbor_encoder_create_map(&root_map, &map_encoder, PERF_RING_COUNT);
+    JADE_ASSERT(cberr == CborNoError);
+    for (size_t i = 0; i < PERF_RING_COUNT; ++i) {
+        add_ring_to_map(&map_encoder, RING_NAMES[i], &rings_copy[i]);
+    }
+    cberr = cbor_encoder_close_container(&root_map, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+
+    // Other timers (cbor framing, ota)
+    cberr = cbor_encode_text_stringz(&root_map, "timers");
+    JADE_ASSERT(cberr == CborNoError);
+    cberr = cbor_encoder_create_map(&root_map, &map_encoder, PERF_TIMER_COUNT);
+    JADE_ASSERT(cberr == CborNoError);
+    for (size_t i = 0; i < PERF_TIMER_COUNT; ++i) {
+        add_timing_to_map(&map_encoder, TIMER_NAMES[i], &timers_copy[i]);
+    }
+    cberr = cbor_encoder_close_container(&root_map, &map_encoder);
+    JADE_ASSERT(cberr == CborNoError);
+
+#if NUM_TASK_RUNTIME_FIELDS
+    add_task_runtimes_to_map(&root_map);
+#endif
+
+    cberr = cbor_encoder_close_container(container, &root_map);
+    JADE_ASSERT(cberr == CborNoError);
+}
+
+#endif // CONFIG_DEBUG_MODE
@@ -0,0 +1,50 @@
+#ifndef UTILS_PERF_H_
+#define UTILS_PERF_H_
+
+#include <sdkconfig.h>
+#include <stddef.h>
+#include <stdint.h>
+
+#include "process.h"
+
+// Performance counters - only collected in debug builds, where they can be
+// fetched with the 'debug_get_perf_stats' message.  No-ops otherwise.
+
+typedef enum {
+    PERF_TIMER_WIRE_FRAMING,
+    PERF_TIMER_OTA_DECOMPRESS,
+    PERF_TIMER_OTA_WRITE,
+    PERF_TIMER_COUNT
+} perf_timer_t;
+
+typedef enum {
+    PERF_RING_SHARED_IN,
+    PERF_RING_SERIAL_OUT,
+    PERF_RING_BLE_OUT,
+    PERF_RING_COUNT
+} perf_ring_t;
+
+#ifdef CONFIG_DEBUG_MODE
+#include <esp_timer.h>
+
+static inline int64_t perf_now(void) { return esp_timer_get_time(); }
+
+void perf_record_method(const char* method, size_t method_len, int64_t start_us);
+void perf_record_timer(perf_timer_t timer, int64_t start_us);
+void perf_record_message_in(jade_msg_source_t source, size_t size);
+void perf_record_message_out(jade_msg_source_t source, size_t size);
+void perf_record_ring_usage(perf_ring_t ring, size_t used, size_t size);
+
+// Cbor encoder callback to write the counters as a map
+void perf_stats_cb(const void* ctx, CborEncoder* container);
+#else
+static inline int64_t perf_now(void) { return 0; }
+
+static inline void perf_record_method(const char* method, size_t method_len, int64_t start_us) {}
+static inline void perf_record_timer(perf_timer_t timer, int64_t start_us) {}
+static inline void perf_record_message_in(jade_msg_source_t source, size_t size) {}
+static inline void perf_record_message_out(jade_msg_source_t source, size_t size) {}
+static inline void perf_record_ring_usage(perf_ring_t ring, size_t used, size_t size) {}
+#endif // CONFIG_DEBUG_MODE
+
+#endif /* UTILS_PERF_H_ */
@@ -190,17 +190,18 @@ void wallet_build_receive_path(const uint32_t subaccount, const uint32_t branch,
     }
 }
 
-// Helper to validate the user-path, and fetch the wallet's relevant gait service pubkey
-static bool wallet_get_gaservice_key(
-    const char* network, const uint32_t* path, const size_t path_size, struct ext_key* gakey)
+// Helper to validate the user-path, and fetch the parent of the wallet's relevant gait service pubkey
+// (ie. the service key for the path excluding the final 'ptr' element).
+static bool wallet_get_gaservice_parent_key(
+    const char* network, const uint32_t* path, const size_t path_size, struct ext_key* gaparent)
 {
     JADE_ASSERT(keychain_get());
     JADE_ASSERT(network);
     JADE_ASSERT(path);
     JADE_ASSERT(path_size > 0);
-    JADE_ASSERT(gakey);
+    JADE_ASSERT(gaparent);
 
-    uint32_t ga_path[35]; // 32 + 3 max
+    uint32_t ga_path[34]; // 32 + 2 max (excludes final ptr)
     size_t ga_path_size = 0;
 
     // We only support the following cases
@@ -213,8 +214,7 @@ static bool wallet_get_gaservice_key(
         // gapath: 1/<ga service path (32)>/ptr
         ga_path[0] = path[0];
         // skip 1-32
-        ga_path[33] = path[1];
-        ga_path_size = 34;
+        ga_path_size = 33;
 
     } else if (path_size == 4) {
         // 2.  3'/subact'/1/ptr
@@ -227,8 +227,7 @@ static bool wallet_get_gaservice_key(
         ga_path[0] = unharden(path[0]);
         // skip 1-32
         ga_path[33] = unharden(path[1]);
-        ga_path[34] = path[3];
-        ga_path_size = 35;
+        ga_path_size = 34;
     } else {
         return false;
     }
@@ -239,30 +238,31 @@ static bool wallet_get_gaservice_key(
         ga_path[i + 1] = (keychain->service_path[2 * i] << 8) + keychain->service_path[2 * i + 1];
     }
 
-    // Derive ga account pubkey for the path, except the ptr (so we can log it).
+    // Derive ga account pubkey for the path, except the ptr
     const struct ext_key* const service = networkToGaService(network);
     if (!service) {
         JADE_LOGE("Unknown network: %s", network);
         return false;
     }
-    /*
-        // This outputs the parent service xpub to match what the gdk has in its txn data
-        struct ext_key garoot;
-        JADE_WALLY_VERIFY(bip32_key_from_parent_path(service, ga_path, ga_path_size-1, BIP32_FLAG_KEY_PUBLIC |
-       BIP32_FLAG_SKIP_HASH, &garoot));
+    JADE_WALLY_VERIFY(bip32_key_from_parent_path(
+        service, ga_path, ga_path_size, BIP32_FLAG_KEY_PUBLIC | BIP32_FLAG_SKIP_HASH, gaparent));
+    return true;
+}
 
-        // Log this xpub
-        char *logbuf;
-        JADE_WALLY_VERIFY(bip32_key_to_base58(&garoot, BIP32_FLAG_KEY_PUBLIC, &logbuf));
-        JADE_LOGI("service xpub: %s", logbuf);
-        wally_free_string(logbuf);
+// Helper to validate the user-path, and fetch the wallet's relevant gait service pubkey
+static bool wallet_get_gaservice_key(
+    const char* network, const uint32_t* path, const size_t path_size, struct ext_key* gakey)
+{
+    JADE_ASSERT(gakey);
 
-        // Derive final part of the path into the output
-        JADE_WALLY_VERIFY(bip32_key_from_parent_path(&garoot, &ga_path[ga_path_size-1], 1, BIP32_FLAG_KEY_PUBLIC |
-       BIP32_FLAG_SKIP_HASH, gakey));
-     */
-    JADE_WALLY_VERIFY(bip32_key_from_parent_path(
-        service, ga_path, ga_path_size, BIP32_FLAG_KEY_PUBLIC | BIP32_FLAG_SKIP_HASH, gakey));
+    struct ext_key gaparent;
+    if (!wallet_get_gaservice_parent_key(network, path, path_size, &gaparent)) {
+        return false;
+    }
+
+    // Derive final part of the path (ptr) into the output
+    JADE_WALLY_VERIFY(
+        bip32_key_from_parent(&gaparent, path[path_size - 1], BIP32_FLAG_KEY_PUBLIC | BIP32_FLAG_SKIP_HASH, gakey));
     return true;
 }
 
@@ -340,14 +340,10 @@ static void wallet_build_csv(const char* network, const uint8_t* pubkeys, const
     }
 }
 
-// Helper to build a green-address script - 2of2 or 2of3 multisig, or a 2of2 csv
-static bool build_ga_script(const char* network, const char* xpubrecovery, const uint32_t csvBlocks,
-    const uint32_t* path, const size_t path_size, unsigned char* output, const size_t output_len, size_t* written)
+// Helper to check the green-address script options are valid/supported
+static bool validate_ga_script_options(const char* network, const char* xpubrecovery, const uint32_t csvBlocks)
 {
     JADE_ASSERT(network);
-    JADE_ASSERT(written);
-    JADE_ASSERT(output_len >= WALLY_SCRIPTPUBKEY_P2SH_LEN);
-    JADE_ASSERT(keychain_get());
 
     // We do not support 2of3-csv (ie. can't have csv blocks AND a recovery xpub)
     if (csvBlocks > 0 && xpubrecovery) {
@@ -361,10 +357,42 @@ static bool build_ga_script(const char* network, const char* xpubrecovery, const
         return false;
     }
 
+    return true;
+}
+
+// Helper to build a green-address script from the GA, user and (optional) recovery pubkeys
+static void build_ga_script_for_pubkeys(const char* network, const uint8_t* pubkeys, const size_t num_pubkeys,
+    const uint32_t csvBlocks, unsigned char* output, const size_t output_len, size_t* written)
+{
     // The multisig or csv script we generate
     size_t script_size = 0;
     unsigned char script[MSIG_2OFN_SCRIPT_LEN(3)]; // The largest script we might generate
 
+    // Get 2of2 or 2of3, csv or multisig script, depending on params
+    if (csvBlocks > 0) {
+        wallet_build_csv(
+            network, pubkeys, num_pubkeys * EC_PUBLIC_KEY_LEN, csvBlocks, script, sizeof(script), &script_size);
+    } else {
+        wallet_build_multisig(pubkeys, num_pubkeys * EC_PUBLIC_KEY_LEN, script, sizeof(script), &script_size);
+    }
+
+    // Get the p2sh/p2wsh script-pubkey for the script we have created
+    wallet_p2sh_p2wsh_scriptpubkey_for_bytes(script, script_size, WALLY_SCRIPT_SHA256, output, output_len, written);
+}
+
+// Helper to build a green-address script - 2of2 or 2of3 multisig, or a 2of2 csv
+static bool build_ga_script(const char* network, const char* xpubrecovery, const uint32_t csvBlocks,
+    const uint32_t* path, const size_t path_size, unsigned char* output, const size_t output_len, size_t* written)
+{
+    JADE_ASSERT(network);
+    JADE_ASSERT(written);
+    JADE_ASSERT(output_len >= WALLY_SCRIPTPUBKEY_P2SH_LEN);
+    JADE_ASSERT(keychain_get());
+
+    if (!validate_ga_script_options(network, xpubrecovery, csvBlocks)) {
+        return false;
+    }
+
     // The GA and user pubkeys
     unsigned char user_privkey[EC_PRIVATE_KEY_LEN];
     unsigned char pubkeys[3 * EC_PUBLIC_KEY_LEN]; // In case of 2of3
@@ -410,16 +438,93 @@ static bool build_ga_script(const char* network, const char* xpubrecovery, const
         memcpy(next_pubkey, key.pub_key, sizeof(key.pub_key));
     }
 
-    // Get 2of2 or 2of3, csv or multisig script, depending on params
-    if (csvBlocks > 0) {
-        wallet_build_csv(
-            network, pubkeys, num_pubkeys * EC_PUBLIC_KEY_LEN, csvBlocks, script, sizeof(script), &script_size);
-    } else {
-        wallet_build_multisig(pubkeys, num_pubkeys * EC_PUBLIC_KEY_LEN, script, sizeof(script), &script_size);
+    build_ga_script_for_pubkeys(network, pubkeys, num_pubkeys, csvBlocks, output, output_len, written);
+    return true;
+}
+
+// Builds the green-address scripts for a contiguous range of pointers [pointer, pointer + num_scripts).
+// The GA service, user and recovery parent keys are derived once, and only the final (ptr) child is derived
+// for each script.  'output' must be a buffer of at least num_scripts * WALLY_SCRIPTPUBKEY_P2SH_LEN bytes,
+// into which the (fixed-length p2sh) scripts are written consecutively.
+bool wallet_build_receive_scripts(const char* network, const char* xpubrecovery, const uint32_t csvBlocks,
+    const uint32_t subaccount, const uint32_t branch, const uint32_t pointer, const size_t num_scripts,
+    unsigned char* output, const size_t output_len)
+{
+    JADE_ASSERT(keychain_get());
+
+    if (!network || csvBlocks > MAX_CSV_BLOCKS_ALLOWED || num_scripts == 0 || !output
+        || output_len < num_scripts * WALLY_SCRIPTPUBKEY_P2SH_LEN) {
+        return false;
     }
 
-    // Get the p2sh/p2wsh script-pubkey for the script we have created
-    wallet_p2sh_p2wsh_scriptpubkey_for_bytes(script, script_size, WALLY_SCRIPT_SHA256, output, output_len, written);
+    if (!validate_ga_script_options(network, xpubrecovery, csvBlocks)) {
+        return false;
+    }
+
+    // Validate the range (the path for the initial pointer is validated below)
+    if (pointer >= MAX_PATH_PTR || num_scripts > MAX_PATH_PTR - pointer) {
+        JADE_LOGE("Invalid pointer range: %u + %u", pointer, num_scripts);
+        return false;
+    }
+
+    uint32_t path[4];
+    size_t path_size = 0;
+    wallet_build_receive_path(subaccount, branch, pointer, path, sizeof(path) / sizeof(path[0]), &path_size);
+
+    // Get the GA-key parent for the passed path (if valid)
+    struct ext_key gaparent;
+    if (!wallet_get_gaservice_parent_key(network, path, path_size, &gaparent)) {
+        JADE_LOGE("Failed to derive valid ga key for path");
+        return false;
+    }
+
+    // Get the recovery key parent, if one passed - xpub includes branch, so only
+    // need to derive the final step (ptr) for each script
+    struct ext_key recoveryparent;
+    if (xpubrecovery) {
+        const int wret = bip32_key_from_base58(xpubrecovery, &recoveryparent);
+        if (wret != WALLY_OK) {
+            JADE_LOGE("Error %d, trying to interpret base58 recovery key '%s'", wret, xpubrecovery);
+            return false;
+        }
+    }
+
+    // Derive the user parent key (excluding ptr)
+    struct ext_key userparent;
+    SENSITIVE_PUSH(&userparent, sizeof(userparent));
+    JADE_WALLY_VERIFY(bip32_key_from_parent_path(&(keychain_get()->xpriv), path, path_size - 1,
+        BIP32_FLAG_KEY_PRIVATE | BIP32_FLAG_SKIP_HASH, &userparent));
+
+    // Step only the final child for each script
+    unsigned char pubkeys[3 * EC_PUBLIC_KEY_LEN]; // In case of 2of3
+    const size_t num_pubkeys = xpubrecovery ? 3 : 2; // 2of3 if recovery-xpub
+    struct ext_key child;
+    SENSITIVE_PUSH(&child, sizeof(child));
+    for (size_t i = 0; i < num_scripts; ++i) {
+        const uint32_t ptr = pointer + i;
+
+        JADE_WALLY_VERIFY(bip32_key_from_parent(&gaparent, ptr, BIP32_FLAG_KEY_PUBLIC | BIP32_FLAG_SKIP_HASH, &child));
+        memcpy(pubkeys, child.pub_key, EC_PUBLIC_KEY_LEN);
+
+        JADE_WALLY_VERIFY(
+            bip32_key_from_parent(&userparent, ptr, BIP32_FLAG_KEY_PRIVATE | BIP32_FLAG_SKIP_HASH, &child));
+        memcpy(pubkeys + EC_PUBLIC_KEY_LEN, child.pub_key, EC_PUBLIC_KEY_LEN);
+
+        if (xpubrecovery) {
+            JADE_WALLY_VERIFY(
+                bip32_key_from_parent(&recoveryparent, ptr, BIP32_FLAG_KEY_PUBLIC | BIP32_FLAG_SKIP_HASH, &child));
+            memcpy(pubkeys + 2 * EC_PUBLIC_KEY_LEN, child.pub_key, EC_PUBLIC_KEY_LEN);
+        }
+
+        size_t written = 0;
+        unsigned char* const script = output + (i * WALLY_SCRIPTPUBKEY_P2SH_LEN);
+        build_ga_script_for_pubkeys(
+            network, pubkeys, num_pubkeys, csvBlocks, script, WALLY_SCRIPTPUBKEY_P2SH_LEN, &written);
+        JADE_ASSERT(written == WALLY_SCRIPTPUBKEY_P2SH_LEN);
+    }
+    SENSITIVE_POP(&child);
+    SENSITIVE_POP(&userparent);
+
     return true;
 }
 
@@ -27,6 +27,9 @@ void wallet_build_receive_path(uint32_t subaccount, uint32_t branch, uint32_t po
 bool wallet_build_receive_script(const char* network, script_variant_t variant, const char* xpubrecovery,
     uint32_t csvBlocks, const uint32_t* path, size_t path_size, unsigned char* output, size_t output_len,
     size_t* written);
+bool wallet_build_receive_scripts(const char* network, const char* xpubrecovery, uint32_t csvBlocks,
+    uint32_t subaccount, uint32_t branch, uint32_t pointer, size_t num_scripts, unsigned char* output,
+    size_t output_len);
 bool wallet_validate_receive_script(const char* network, script_variant_t variant, const char* xpubrecovery,
     uint32_t csvBlocks, const uint32_t* path, size_t path_size, const unsigned char* script, size_t script_len);
 
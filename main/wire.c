@@ -15,6 +15,7 @@
 #include "process/ota.h"
 #include "random.h"
 #include "utils/cbor_rpc.h"
+#include "utils/perf.h"
 
 // Macros for use in handle_data() as always called with fixed params
 #define SEND_REJECT_MSG(code, msg, data, datalen)                                                                      \
@@ -31,6 +32,7 @@ void handle_data(uint8_t* full_data_in, size_t* read_ptr, uint8_t* data_out, jad
 
         size_t msg_size = 0;
 
+        const int64_t framing_start_us = perf_now();
         for (size_t i = 1; i <= read; ++i) {
             const CborError cberr = cbor_parser_init(data_in, i, CborValidateCompleteData, &ctx.parser, &ctx.value);
             if (cberr == CborNoError && cbor_value_validate_basic(&ctx.value) == CborNoError) {
@@ -38,6 +40,7 @@ void handle_data(uint8_t* full_data_in, size_t* read_ptr, uint8_t* data_out, jad
                 break;
             }
         }
+        perf_record_timer(PERF_TIMER_WIRE_FRAMING, framing_start_us);
 
         if (msg_size == 0) {
             JADE_LOGD("Got incomplete CBOR message, length %d - awaiting more data...", read);
@@ -13,4 +13,8 @@ setup(
         'aioitertools==0.4.0',
         'requests==2.22.0'
     ],
+    extras_require={
+        # Local wallet functionality - address derivation, PSBT signing, tx validation
+        'wallet': ['wallycore==1.5.6']
+    },
 )
@@ -12,7 +12,9 @@ import _thread
 from pinserver.server import PINServerECDH
 from pinserver.pindb import PINDb
 import wallycore as wally
-from jadepy.jade import JadeAPI, JadeInterface, JadeError
+from jadepy.jade import JadeAPI, JadeInterface, JadeError, DEFAULT_TXN_CHUNK_THRESHOLD
+from jadepy.validate import validate_sign_tx
+from jadepy.perf import log_perf_stats
 
 # Enable jade logging
 jadehandler = logging.StreamHandler()
@@ -85,7 +87,7 @@ DEFAULT_SERIAL_DEVICE = "/dev/ttyUSB0"
 SRTIMEOUT = 30
 
 # The number of values expected back in version info
-NUM_VALUES_VERINFO = 14
+NUM_VALUES_VERINFO = 15
 
 TEST_MNEMONIC = 'fish inner face ginger orchard permit useful method fence \
 kidney chuckle party favorite sunset draw limb science crane oval letter \
@@ -218,6 +220,9 @@ SIGN_TXN_TESTS = list(map(_h2b_signing_test_case,
 SIGN_TXN_FAIL_CASES = list(map(_h2b_signing_test_case,
                                _load_json_test_cases("badtxn_*.json")))
 
+# The sign_tx failures which need the hw keys to detect, so pass host pre-flight validation
+HOST_UNDETECTABLE_SIGN_TXN_ERRORS = ['Change script cannot be validated']
+
 SIGN_LIQUID_TXN_TESTS = list(map(_h2b_signing_test_case,
                                  _load_json_test_cases("liquid_txn_*.json")))
 
@@ -477,6 +482,14 @@ d99ee7b5892a2740000000000ffffffff01203f0f00000000001600145f4fcd4a757c2abf6a069\
                     {'fwsize': 'X', 'cmpsize': 'Y'}), 'Bad parameters'),
                   (('badota5', 'ota',  # compsize >= fwsize rejected
                     {'fwsize': 1234, 'cmpsize': 1234}), 'Bad parameters'),
+                  (('badota6', 'ota',  # zero chunk size rejected
+                    {'fwsize': 1234, 'cmpsize': 123, 'otachunk': 0}), 'Bad parameters'),
+                  (('badota7', 'ota',  # hash must be 32 bytes
+                    {'fwsize': 1234, 'cmpsize': 123, 'cmphash': bytes(31)}), 'Bad parameters'),
+                  (('badota8', 'ota',
+                    {'fwsize': 1234, 'cmpsize': 123, 'cmphash': bytes(33)}), 'Bad parameters'),
+                  (('badota9', 'ota',
+                    {'fwsize': 1234, 'cmpsize': 123, 'cmphash': 'notbytes'}), 'Bad parameters'),
 
                   (('badxpub1', 'get_xpub'), 'Expecting parameters map'),
                   (('badxpub2', 'get_xpub',
@@ -607,7 +620,36 @@ d99ee7b5892a2740000000000ffffffff01203f0f00000000001600145f4fcd4a757c2abf6a069\
                      'change': [{'not_path': [[1, 2, 3]]}]}), 'extract valid change path'),
                   (('badsigntx15', 'sign_tx',  # wrong number of outputs
                     {'network': 'testnet', 'txn': GOODTX, 'num_inputs': 1,
-                     'change': [None, None]}), 'Unexpected number of output (change) entries')]
+                     'change': [None, None]}), 'Unexpected number of output (change) entries'),
+
+                  (('badrecvaddr1', 'get_receive_address',
+                    {'network': 'testnet', 'subaccount': 0, 'branch': 1, 'pointer': 1,
+                     'num_addresses': 0}), 'valid num_addresses'),
+                  (('badrecvaddr2', 'get_receive_address',
+                    {'network': 'testnet', 'subaccount': 0, 'branch': 1, 'pointer': 1,
+                     'num_addresses': 21}), 'valid num_addresses'),
+                  (('badrecvaddr3', 'get_receive_address',
+                    {'network': 'testnet', 'subaccount': 0, 'branch': 1, 'pointer': 9999,
+                     'num_addresses': 2}), 'generate valid green address script'),
+
+                  (('badbatch1', 'batch'), 'Expecting parameters map'),
+                  (('badbatch2', 'batch', {'requests': None}), 'valid requests array'),
+                  (('badbatch3', 'batch', {'requests': []}), 'valid requests array'),
+                  (('badbatch4', 'batch',
+                    {'requests': [{'id': '1', 'method': 'get_xpub'}] * 33}),
+                   'valid requests array'),
+                  (('badbatch5', 'batch',
+                    {'requests': [{'method': 'get_xpub'}]}), 'Invalid request in batch'),
+                  (('badbatch6', 'batch',
+                    {'requests': [{'id': '1', 'method': 'sign_tx'}]}), 'not supported in batch'),
+                  (('badbatch7', 'batch',
+                    {'requests': [{'id': '1', 'method': 'batch'}]}), 'not supported in batch'),
+                  (('badbatch8', 'batch',  # ranged receive addresses
+                    {'requests': [{'id': '1', 'method': 'get_receive_address',
+                                   'params': {'network': 'testnet', 'subaccount': 0,
+                                              'branch': 1, 'pointer': 0,
+                                              'num_addresses': 20}}]}),
+                   'not supported in batch')]
 
     bad_tx_inputs = [(('badinput0', 'tx_input'), 'Expecting parameters map'),
                      (('badinput1', 'tx_input',
@@ -705,6 +747,15 @@ ddab03ecc4ae0b5e77c4fc0e5cf6c95a0100000000000f4240000000000000')
                     {'script': TEST_SCRIPT, 'their_pubkey': 'notbin'}), 'extract their_pubkey'),
                   (('badnonce8', 'get_shared_nonce',  # short pubkey
                     {'script': TEST_SCRIPT, 'their_pubkey': h2b('ab')}), 'extract their_pubkey'),
+                  (('badnonce9', 'get_shared_nonce', {'outputs': []}), 'valid outputs array'),
+                  (('badnonce10', 'get_shared_nonce',
+                    {'outputs': [{'script': TEST_SCRIPT, 'their_pubkey': TEST_THEIR_PK}] * 65}),
+                   'valid outputs array'),
+                  (('badnonce11', 'get_shared_nonce', {'outputs': [TEST_SCRIPT]}),
+                   'valid outputs array'),
+                  (('badnonce12', 'get_shared_nonce',
+                    {'outputs': [{'script': TEST_SCRIPT, 'their_pubkey': TEST_THEIR_PK},
+                                 {'script': TEST_SCRIPT}]}), 'extract their_pubkey'),
 
                   (('badblindfac1', 'get_blinding_factor'), 'Expecting parameters map'),
                   (('badblindfac2', 'get_blinding_factor',
@@ -1160,11 +1211,25 @@ def run_api_tests(jadeapi, authuser=False):
                                            csv_blocks=csvblocks)
         assert rslt == expected
 
+        # Ranged variant returns a list of addresses, for consecutive pointers
+        rslt = jadeapi.get_receive_addresses(network, subact, branch, ptr, 3,
+                                             recovery_xpub=recovxpub, csv_blocks=csvblocks)
+        assert len(rslt) == 3 and rslt[0] == expected
+        assert rslt[2] == jadeapi.get_receive_address(network, subact, branch, ptr + 2,
+                                                      recovery_xpub=recovxpub,
+                                                      csv_blocks=csvblocks)
+
     # Get xpubs
     for path, network, expected in GET_XPUB_DATA:
         rslt = jadeapi.get_xpub(network, path)
         assert rslt == expected
 
+    # Get xpubs in a single batch message
+    with jadeapi.batch() as batch:
+        rslts = [batch.get_xpub(network, path) for path, network, _ in GET_XPUB_DATA]
+    for rslt, (path, network, expected) in zip(rslts, GET_XPUB_DATA):
+        assert rslt.result() == expected
+
     # Sign message
     for msg_data in SIGN_MSG_TESTS:
         input = msg_data['input']
@@ -1177,12 +1242,57 @@ def run_api_tests(jadeapi, authuser=False):
         rslt = jadeapi.sign_tx(input['network'],
                                input['txn'],
                                input['inputs'],
-                               input['change'])
+                               input['change'],
+                               validate=True)
         assert rslt == txn_data['expected_output']
         for sig in rslt:
             if len(sig) > 0:
                 assert len(sig) <= wally.EC_SIGNATURE_DER_MAX_LOW_R_LEN
 
+    # Sign Tx with each prior tx only sent once (where spent by several inputs)
+    for txn_data in SIGN_TXN_TESTS:
+        input = txn_data['input']
+        if len(input['inputs']) > 1:
+            rslt = jadeapi.sign_tx(input['network'],
+                                   input['txn'],
+                                   input['inputs'],
+                                   input['change'],
+                                   dedup_input_txs=True)
+            assert rslt == txn_data['expected_output']
+
+    # Set log level - returns the prior settings, which can be restored
+    prior = jadeapi.set_log_level('error', 10)
+    rslt = jadeapi.set_log_level(prior['level'], prior['max_rate'])
+    assert rslt == {'level': 1, 'max_rate': 10}
+
+    # Sign Tx with the txn uploaded in small chunks (with hw logging reduced)
+    jadeapi.txn_chunk_threshold = 0
+    try:
+        with jadeapi.quiet_logs():
+            for txn_data in SIGN_TXN_TESTS:
+                input = txn_data['input']
+                rslt = jadeapi.sign_tx(input['network'],
+                                       input['txn'],
+                                       input['inputs'],
+                                       input['change'])
+                assert rslt == txn_data['expected_output']
+    finally:
+        jadeapi.txn_chunk_threshold = DEFAULT_TXN_CHUNK_THRESHOLD
+
+    # Sign Tx failures - host pre-flight validation
+    # (Cases which need the hw keys to detect, eg. bad change scripts, pass)
+    for txn_data in SIGN_TXN_FAIL_CASES:
+        try:
+            input = txn_data['input']
+            validate_sign_tx(input['network'],
+                             input['txn'],
+                             input['inputs'],
+                             input['change'])
+            assert txn_data["expected_error"] in HOST_UNDETECTABLE_SIGN_TXN_ERRORS, \
+                "Expected exception from host validation of bad sign_tx test case"
+        except JadeError as err:
+            assert err.message == txn_data["expected_error"]
+
     # Sign Tx failures
     for txn_data in SIGN_TXN_FAIL_CASES:
         try:
@@ -1206,6 +1316,18 @@ def run_api_tests(jadeapi, authuser=False):
     rslt = jadeapi.get_shared_nonce(TEST_SCRIPT, TEST_THEIR_PK)
     assert rslt == EXPECTED_SHARED_SECRET
 
+    # Get several Liquid shared nonces in one call
+    rslt = jadeapi.get_shared_nonces([(TEST_SCRIPT, TEST_THEIR_PK)] * 3)
+    assert rslt == [EXPECTED_SHARED_SECRET] * 3
+
+    # Batch several large (multi-output) shared nonce requests - more than fit in one
+    # batch reply, so some are deferred and resent
+    with jadeapi.batch() as batch:
+        rslts = [batch.get_shared_nonces([(TEST_SCRIPT, TEST_THEIR_PK)] * n)
+                 for n in (64, 40, 64, 1, 20)]
+    for rslt, n in zip(rslts, (64, 40, 64, 1, 20)):
+        assert rslt.result() == [EXPECTED_SHARED_SECRET] * n
+
     # Get Liquid blinding factor
     rslt = jadeapi.get_blinding_factor(TEST_HASH_PREVOUTS, 0, 'ASSET')
     assert rslt == EXPECTED_LIQ_COMMITMENT_1['abf']
@@ -1233,7 +1355,8 @@ def run_api_tests(jadeapi, authuser=False):
                                       input['txn'],
                                       input['inputs'],
                                       input['trusted_commitments'],
-                                      input['change'])
+                                      input['change'],
+                                      validate=True)
 
         assert rslt == txn_data['expected_output']
         for sig in rslt:
@@ -1314,14 +1437,19 @@ def run_interface_tests(jadeapi,
     # Negative tests
     if negative:
         logger.info("Negative tests")
-        test_bad_message(jadeapi.jade)
-        test_very_bad_message(jadeapi.jade)
-        test_split_message(jadeapi.jade)
-        test_concatenated_messages(jadeapi.jade)
-        test_unknown_method(jadeapi.jade)
-        test_unexpected_method(jadeapi.jade)
-        test_bad_params(jadeapi.jade)
-        test_bad_params_liquid(jadeapi.jade)
+        with jadeapi.perf_stats() as stats:
+            test_bad_message(jadeapi.jade)
+            test_very_bad_message(jadeapi.jade)
+            test_split_message(jadeapi.jade)
+            test_concatenated_messages(jadeapi.jade)
+            test_unknown_method(jadeapi.jade)
+            test_unexpected_method(jadeapi.jade)
+            test_bad_params(jadeapi.jade)
+            test_bad_params_liquid(jadeapi.jade)
+
+        log_perf_stats(stats)
+        assert stats['methods']['sign_tx']['count'] > 0
+        assert stats['timers']['wire_framing']['count'] > 0
 
     time.sleep(1)  # Lets idle tasks clean up
     endinfo = jadeapi.get_version_info()
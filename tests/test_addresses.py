@@ -0,0 +1,119 @@
+import pytest
+import wallycore as wally
+
+from jadepy.addresses import NETWORK_PARAMS, VARIANT_P2PKH, VARIANT_P2WPKH, \
+    JadeAddressDeriver, JadeAddressIndex, derive_scripts
+
+H = 0x80000000
+
+
+def test_network_params_match_wally():
+    # The literal address prefixes are wally's
+    for network, prefixes in [
+            ('mainnet', ('P2PKH_MAINNET', 'P2SH_MAINNET', None)),
+            ('testnet', ('P2PKH_TESTNET', 'P2SH_TESTNET', None)),
+            ('regtest', ('P2PKH_TESTNET', 'P2SH_TESTNET', None)),
+            ('localtest', ('P2PKH_TESTNET', 'P2SH_TESTNET', None)),
+            ('liquid', ('P2PKH_LIQUID', 'P2SH_LIQUID', 'LIQUID')),
+            ('localtest-liquid', ('P2PKH_LIQUID_REGTEST', 'P2SH_LIQUID_REGTEST',
+                                  'LIQUID_REGTEST'))]:
+        p2pkh, p2sh, ca = prefixes
+        params = NETWORK_PARAMS[network]
+        assert params[0] == getattr(wally, 'WALLY_ADDRESS_VERSION_' + p2pkh)
+        assert params[1] == getattr(wally, 'WALLY_ADDRESS_VERSION_' + p2sh)
+        assert params[3] == (getattr(wally, 'WALLY_CA_PREFIX_' + ca) if ca else None)
+
+
+# Minimal JadeAPI which returns a fixed account xpub
+class FakeJade:
+    def __init__(self):
+        key = wally.bip32_key_from_seed(bytes(range(32)), wally.BIP32_VER_TEST_PRIVATE,
+                                        wally.BIP32_FLAG_SKIP_HASH)
+        self.xpub = wally.bip32_key_to_base58(key, wally.BIP32_FLAG_KEY_PUBLIC)
+
+    def get_xpub(self, network, path):
+        return self.xpub
+
+
+# Deriver which records the ranges derived
+class CountingDeriver(JadeAddressDeriver):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.derived = []
+
+    def get_scripts(self, branch, start, count):
+        self.derived.append((list(branch), start, count))
+        return super().get_scripts(branch, start, count)
+
+
+def _deriver(variant=VARIANT_P2WPKH):
+    return CountingDeriver(FakeJade(), 'testnet', [H + 84, H + 1, H], variant)
+
+
+def _script(branch, child, variant=VARIANT_P2WPKH):
+    return derive_scripts(FakeJade().xpub, variant, branch, child, 1)[0][1]
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / 'index.sqlite')
+
+
+def test_index_observe_extends_gap_limit(filename):
+    deriver = _deriver()
+    index = JadeAddressIndex(deriver, filename, gap_limit=10)
+    assert deriver.derived == [([0], 0, 10), ([1], 0, 10)]
+    assert index.get_path(_script([0], 9)) == [0, 9]
+    assert index.get_path(_script([0], 15)) is None
+
+    # Observing index 8 extends receive to 19 - so the script at 15 (observed in the
+    # same call) is then found, extending to 26.  Change is unaffected.
+    assert index.observe([_script([0], 15), _script([0], 8)]) == [[0, 15], [0, 8]]
+    assert index.derived == {(0,): 26, (1,): 10}
+    assert index.used == {(0,): 16, (1,): 0}
+    assert index.get_path(_script([0], 25)) == [0, 25]
+
+    # Observing lower indexes does not extend further
+    deriver.derived = []
+    index.observe([_script([0], 3), _script([1], 0)])
+    assert deriver.derived == [([1], 10, 1)]
+    assert index.derived == {(0,): 26, (1,): 11}
+    index.close()
+
+
+def test_index_unknown_script(filename):
+    index = JadeAddressIndex(_deriver(), filename, gap_limit=5)
+    unknown = [_script([0], 100), _script([2], 0), _script([0], 0, VARIANT_P2PKH)]
+
+    assert index.observe(unknown) == [None, None, None]
+    assert index.derived == {(0,): 5, (1,): 5}
+    for script in unknown:
+        assert index.get_path(script) is None
+        assert index.get_full_path(script) is None
+
+    known = _script([1], 2)
+    assert index.get_change(unknown[:1] + [known]) == [
+        None, {'path': [H + 84, H + 1, H, 1, 2], 'variant': VARIANT_P2WPKH}]
+    index.close()
+
+
+def test_index_persists(filename):
+    index = JadeAddressIndex(_deriver(), filename, gap_limit=5)
+    index.observe([_script([0], 4)])
+    paths, derived, used = index.paths, index.derived, index.used
+    index.close()
+
+    # Reloaded without deriving anything
+    deriver = _deriver()
+    index = JadeAddressIndex(deriver, filename, gap_limit=5)
+    assert deriver.derived == []
+    assert (index.paths, index.derived, index.used) == (paths, derived, used)
+    index.close()
+
+    # Another account in the same file is indexed separately
+    deriver = _deriver(VARIANT_P2PKH)
+    index = JadeAddressIndex(deriver, filename, gap_limit=5)
+    assert deriver.derived == [([0], 0, 5), ([1], 0, 5)]
+    assert index.get_path(_script([0], 7)) is None
+    assert index.get_path(_script([0], 4, VARIANT_P2PKH)) == [0, 4]
+    index.close()
@@ -0,0 +1,113 @@
+import pytest
+import wallycore as wally
+
+from jadepy.jade import JadeAPI, JadeInterface
+from jadepy.cache import JadeCache
+
+ROOT_XPUB = wally.bip32_key_to_base58(
+    wally.bip32_key_from_seed(bytes(range(32)), wally.BIP32_VER_TEST_PRIVATE,
+                              wally.BIP32_FLAG_SKIP_HASH),
+    wally.BIP32_FLAG_KEY_PUBLIC)
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def test_get_put(filename):
+    cache = JadeCache(filename)
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [1]}) is None
+
+    cache.put('dev', 'wallet', 'get_xpub', {'path': [1]}, 'xpub1')
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [1]}) == 'xpub1'
+    assert cache.get('dev', 'other', 'get_xpub', {'path': [1]}) is None
+
+    # Replacing an entry does not add to the count
+    cache.put('dev', 'wallet', 'get_xpub', {'path': [1]}, 'xpub1b')
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [1]}) == 'xpub1b'
+    assert cache.count == 1
+    cache.close()
+
+    # Entries and count persisted
+    cache = JadeCache(filename)
+    assert cache.count == 1
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [1]}) == 'xpub1b'
+    cache.close()
+
+
+def test_evicts_least_recently_used(filename):
+    cache = JadeCache(filename, max_entries=3)
+    for i in range(3):
+        cache.put('dev', 'wallet', 'get_xpub', {'path': [i]}, 'xpub{}'.format(i))
+
+    # Hits on the oldest entry are only held in memory, but still count when evicting
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [0]}) == 'xpub0'
+    cache.put('dev', 'wallet', 'get_xpub', {'path': [3]}, 'xpub3')
+
+    assert cache.count == 3
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [0]}) == 'xpub0'
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [1]}) is None
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [2]}) == 'xpub2'
+    assert cache.get('dev', 'wallet', 'get_xpub', {'path': [3]}) == 'xpub3'
+    cache.close()
+
+
+def test_wallet_change_and_invalidate(filename):
+    cache = JadeCache(filename)
+    cache.set_device_wallet('dev1', 'wallet1')
+    cache.set_device_wallet('dev2', 'wallet2')
+    cache.put('dev1', 'wallet1', 'get_xpub', {'path': [1]}, 'xpub1')
+    cache.put('dev2', 'wallet2', 'get_xpub', {'path': [2]}, 'xpub2')
+    cache.put('dev2', 'wallet2', 'get_xpub', {'path': [3]}, 'xpub3')
+
+    cache.set_device_wallet('dev1', 'wallet3')
+    assert cache.get('dev1', 'wallet1', 'get_xpub', {'path': [1]}) is None
+    assert cache.count == 2
+
+    cache.invalidate('dev2')
+    assert cache.get('dev2', 'wallet2', 'get_xpub', {'path': [2]}) is None
+    assert cache.count == 0
+    cache.close()
+
+
+# Minimal JadeInterface which records the methods called, and returns canned results
+class FakeJade:
+    def __init__(self):
+        self.calls = []
+
+    build_request = staticmethod(JadeInterface.build_request)
+
+    def make_rpc_call(self, request, long_timeout=False):
+        method, params = request['method'], request.get('params')
+        self.calls.append(method)
+        if method == 'get_version_info':
+            result = {'EFUSEMAC': 'AABBCCDDEEFF'}
+        elif method == 'get_xpub' and params['path'] == []:
+            result = ROOT_XPUB
+        elif method == 'get_blinding_key':
+            result = bytes(33)
+        else:
+            result = True
+        return {'id': request['id'], 'result': result}
+
+
+def test_blinding_key_cached_after_auth_user(filename):
+    jade = FakeJade()
+    api = JadeAPI(jade, JadeCache(filename))
+
+    # No network to identify the wallet - not cached
+    api.get_blinding_key(b'script')
+    api.get_blinding_key(b'script')
+    assert jade.calls.count('get_blinding_key') == 2
+
+    # Once the wallet is unlocked for a network the call is cached
+    api.auth_user('localtest-liquid')
+    api.get_blinding_key(b'script')
+    api.get_blinding_key(b'script')
+    assert jade.calls.count('get_blinding_key') == 3
+
+    # Or the network can be passed explicitly
+    api._reset_cache_keys()
+    api.get_blinding_key(b'script', 'localtest-liquid')
+    assert jade.calls.count('get_blinding_key') == 3
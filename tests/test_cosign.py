@@ -0,0 +1,98 @@
+import time
+import threading
+
+import pytest
+
+from jadepy.jade import JadeError
+from jadepy.cosign import JadeCosigningCoordinator
+
+INPUTS = [{'is_witness': True, 'script': b'script0', 'satoshi': 1000},
+          {'is_witness': True, 'script': b'script1', 'satoshi': 2000}]
+
+
+# Minimal JadeAPI signer - returns a signature per input (or fails), optionally hanging
+# (as if awaiting its user) until disconnected
+class FakeSigner:
+    def __init__(self, name, fail=False, hang=False):
+        self.name = name
+        self.fail = fail
+        self.hang = hang
+        self.disconnected = threading.Event()
+        self.inputs = None
+
+    def sign_tx(self, network, txn, inputs, change):
+        self.inputs = inputs
+        if self.hang:
+            self.disconnected.wait()
+            raise IOError('Disconnected')
+        if self.fail:
+            raise JadeError(3, 'User declined to sign transaction', None)
+        return ['{}-sig{}'.format(self.name, i).encode() if 'path' in txinput else b''
+                for i, txinput in enumerate(inputs)]
+
+    def disconnect(self, drain=False):
+        self.disconnected.set()
+
+
+def _paths(names):
+    return {name: [[i, 0], None] for i, name in enumerate(names)}
+
+
+def _await_not_busy(coordinator):
+    for _ in range(100):
+        if not coordinator.busy_cosigners():
+            return
+        time.sleep(0.01)
+    assert False, 'Cosigners still busy'
+
+
+def test_sign():
+    signers = {name: FakeSigner(name) for name in 'abc'}
+    coordinator = JadeCosigningCoordinator(signers, 2)
+    signed = coordinator.sign_tx('testnet', b'txn', INPUTS, _paths('abc'))
+
+    assert len(signed) == 2
+    for name, signatures in signed.items():
+        assert signatures == ['{}-sig0'.format(name).encode(), b'']
+
+    # Each cosigner is passed its own paths
+    assert signers['b'].inputs == [dict(INPUTS[0], path=[1, 0]), INPUTS[1]]
+    assert 'path' not in INPUTS[0]
+    _await_not_busy(coordinator)
+
+
+def test_threshold_not_met():
+    signers = {'a': FakeSigner('a'), 'b': FakeSigner('b', fail=True),
+               'c': FakeSigner('c', fail=True)}
+    coordinator = JadeCosigningCoordinator(signers, 2)
+    with pytest.raises(JadeError, match='threshold cannot be met') as e:
+        coordinator.sign_tx('testnet', b'txn', INPUTS, _paths('abc'))
+    assert e.value.data.keys() == {'b', 'c'}
+
+
+def test_timeout_and_cancel():
+    signers = {'a': FakeSigner('a'), 'b': FakeSigner('b', fail=True),
+               'c': FakeSigner('c', hang=True)}
+    coordinator = JadeCosigningCoordinator(signers, 2)
+    with pytest.raises(JadeError, match='timed out') as e:
+        coordinator.sign_tx('testnet', b'txn', INPUTS, _paths('abc'), timeout=0.2)
+    assert e.value.data == {'signed': ['a'], 'pending': ['c']}
+
+    # The straggler remains busy until cancelled
+    assert coordinator.busy_cosigners() == {'c'}
+    with pytest.raises(JadeError, match='still busy'):
+        coordinator.sign_tx('testnet', b'txn', INPUTS, _paths('abc'))
+
+    assert coordinator.cancel(['a', 'c']) == ['c']
+    assert signers['c'].disconnected.is_set()
+    _await_not_busy(coordinator)
+
+
+def test_cancel_stragglers():
+    signers = {'a': FakeSigner('a', hang=True), 'b': FakeSigner('b')}
+    coordinator = JadeCosigningCoordinator(signers, 1)
+    signed = coordinator.sign_tx('testnet', b'txn', INPUTS, _paths('ab'),
+                                 cancel_stragglers=True)
+    assert list(signed) == ['b']
+    assert signers['a'].disconnected.is_set()
+    _await_not_busy(coordinator)
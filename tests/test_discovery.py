@@ -0,0 +1,94 @@
+import collections
+
+import pytest
+
+from jadepy import discovery
+
+Port = collections.namedtuple('Port', ['device', 'hwid', 'vid', 'pid'])
+
+
+def _port(device, serial_number, vid=0x10c4, pid=0xea60):
+    hwid = 'USB VID:PID={:04X}:{:04X} SER={}'.format(vid, pid, serial_number)
+    return Port(device, hwid, vid, pid)
+
+
+# Fake serial ports, with the version info of the Jade attached to each
+class FakePorts:
+    def __init__(self, monkeypatch):
+        self.ports = {}
+        self.probed = []
+        monkeypatch.setattr(discovery.list_ports, 'comports', self.comports)
+        monkeypatch.setattr(discovery, 'probe_port', self.probe_port)
+
+    def attach(self, device, serial_number, efusemac, version='0.1.30', **kwargs):
+        info = {'EFUSEMAC': efusemac, 'JADE_VERSION': version} if efusemac else None
+        self.ports[device] = (_port(device, serial_number, **kwargs), info)
+
+    def comports(self):
+        return [port for port, info in self.ports.values()]
+
+    def probe_port(self, device, timeout=None):
+        self.probed.append(device)
+        return self.ports[device][1]
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    return FakePorts(monkeypatch)
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / 'inventory.json')
+
+
+def test_probe_ports(ports):
+    ports.attach('/dev/ttyUSB0', 'A1', 'AAAA')
+    ports.attach('/dev/ttyUSB1', 'B1', None)
+    ports.attach('/dev/ttyACM0', 'C1', 'CCCC', vid=0x1a86, pid=0x55d4)
+    ports.attach('/dev/ttyS0', 'D1', 'DDDD', vid=0x1234, pid=0x5678)
+
+    assert discovery.get_candidate_ports() == ['/dev/ttyACM0', '/dev/ttyUSB0', '/dev/ttyUSB1']
+    inventory = discovery.probe_ports()
+    assert sorted(inventory) == ['AAAA', 'CCCC']
+    assert inventory['AAAA']['port'] == '/dev/ttyUSB0'
+    assert inventory['AAAA']['JADE_VERSION'] == '0.1.30'
+    assert inventory['AAAA']['BOARD_TYPE'] is None
+
+
+def test_discover_cached(ports, cache_file):
+    ports.attach('/dev/ttyUSB0', 'A1', 'AAAA')
+    ports.attach('/dev/ttyUSB1', 'B1', 'BBBB')
+    inventory = discovery.discover(cache_file=cache_file)
+    assert sorted(inventory) == ['AAAA', 'BBBB']
+    assert len(ports.probed) == 2
+
+    # Unchanged - cached
+    assert discovery.discover(cache_file=cache_file) == inventory
+    assert len(ports.probed) == 2
+
+    # Refresh, expired or caching disabled - probed
+    discovery.discover(refresh=True, cache_file=cache_file)
+    discovery.discover(cache_file=cache_file, max_age=0)
+    discovery.discover(cache_file=False)
+    assert len(ports.probed) == 8
+
+
+def test_discover_port_changes(ports, cache_file):
+    ports.attach('/dev/ttyUSB0', 'A1', 'AAAA')
+    discovery.discover(cache_file=cache_file)
+
+    # A device added
+    ports.attach('/dev/ttyUSB1', 'B1', 'BBBB')
+    assert sorted(discovery.discover(cache_file=cache_file)) == ['AAAA', 'BBBB']
+
+    # A device swapped for another on the same port
+    ports.attach('/dev/ttyUSB0', 'C1', 'CCCC', version='1.0.0')
+    inventory = discovery.discover(cache_file=cache_file)
+    assert sorted(inventory) == ['BBBB', 'CCCC']
+    assert inventory['CCCC']['JADE_VERSION'] == '1.0.0'
+
+    # A device removed
+    del ports.ports['/dev/ttyUSB1']
+    assert sorted(discovery.discover(cache_file=cache_file)) == ['CCCC']
+    assert len(ports.probed) == 6
@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+from jadepy.jade import JadeError
+from jadepy.fleet import JadeFleet
+
+
+# Minimal JadeAPI - get_xpub returns the device name, optionally blocking until released
+# or failing (with a hw JadeError or as a broken connection)
+class FakeJade:
+    def __init__(self, name, config='BLE'):
+        self.name = name
+        self.config = config
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+        self.fail = None
+        self.fail_connect = False
+        self.connects = 0
+
+    def connect(self):
+        if self.fail_connect:
+            raise IOError('Cannot open port')
+        self.connects += 1
+
+    def disconnect(self, drain=False):
+        pass
+
+    def get_version_info(self):
+        return {'JADE_CONFIG': self.config}
+
+    def get_xpub(self, network, path):
+        self.started.set()
+        self.release.wait()
+        if self.fail:
+            raise self.fail
+        return self.name
+
+
+@pytest.fixture
+def jades():
+    return [FakeJade('a'), FakeJade('b', 'NORADIO'), FakeJade('c')]
+
+
+@pytest.fixture
+def fleet(jades):
+    with JadeFleet(jades, [jade.name for jade in jades]) as fleet:
+        yield fleet
+    for jade in jades:
+        jade.release.set()
+
+
+def test_least_loaded(fleet, jades):
+    # Each call goes to a different device while the others are busy
+    for jade in jades:
+        jade.release.clear()
+    futures = [fleet.get_xpub('testnet', []) for _ in jades]
+    for jade in jades:
+        assert jade.started.wait(5)
+        jade.release.set()
+    assert sorted(future.result() for future in futures) == ['a', 'b', 'c']
+
+    # Then the device with the lowest average latency is preferred
+    for device in fleet.devices:
+        device.busy_secs = {'a': 3.0, 'b': 1.0, 'c': 2.0}[device.name]
+    assert fleet.get_xpub('testnet', []).result() == 'b'
+
+
+def test_compatible(fleet):
+    def has_radio(device):
+        return device.info['JADE_CONFIG'] != 'NORADIO'
+
+    results = fleet.map('get_xpub', [('testnet', [])] * 10, compatible=has_radio)
+    assert set(results) == {'a', 'c'}
+
+    with pytest.raises(JadeError, match='No healthy compatible'):
+        fleet.get_xpub('testnet', [], compatible=lambda device: False)
+
+
+def test_unhealthy_and_reconnect(fleet, jades):
+    def only_a(device):
+        return device.name == 'a'
+
+    # An error reported by the hw leaves the device healthy
+    jades[0].fail = JadeError(3, 'User declined', None)
+    with pytest.raises(JadeError):
+        fleet.get_xpub('testnet', [], compatible=only_a).result()
+    assert fleet.devices[0].healthy
+
+    # Any other error marks it unhealthy
+    jades[0].fail = IOError('Device unplugged')
+    with pytest.raises(IOError):
+        fleet.get_xpub('testnet', [], compatible=only_a).result()
+    assert not fleet.devices[0].healthy
+    assert fleet.stats()['healthy'] == 2
+    assert set(fleet.map('get_xpub', [('testnet', [])] * 10)) == {'b', 'c'}
+    with pytest.raises(JadeError, match='No healthy compatible'):
+        fleet.get_xpub('testnet', [], compatible=only_a)
+
+    # Cannot recover while the device cannot be connected
+    jades[0].fail = None
+    jades[0].fail_connect = True
+    assert fleet.recover() == []
+    assert not fleet.devices[0].healthy
+
+    # Recovered once it can be reconnected
+    jades[0].fail_connect = False
+    assert fleet.recover() == ['a']
+    assert jades[0].connects == 2
+    assert fleet.get_xpub('testnet', [], compatible=only_a).result() == 'a'
+
+    # Or explicitly
+    assert fleet.reconnect('a')
+    assert jades[0].connects == 3
+
+
+def test_connect_failure(jades):
+    jades[1].fail_connect = True
+    with JadeFleet(jades) as fleet:
+        assert [device.healthy for device in fleet.devices] == [True, False, True]
+        jades[1].fail_connect = False
+        assert fleet.recover() == ['1']
+
+    for jade in jades:
+        jade.fail_connect = True
+    with pytest.raises(JadeError, match='No fleet devices connected'):
+        JadeFleet(jades).connect()
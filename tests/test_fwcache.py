@@ -0,0 +1,160 @@
+import os
+import sys
+import hashlib
+import threading
+import http.server
+import concurrent.futures
+
+import pytest
+
+import jade_ota
+from jade_ota import FirmwareCache
+
+
+# Minimal firmware server - serves 'files' with ETags, honouring If-None-Match
+class FirmwareServer(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FirmwareRequestHandler)
+        self.files = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/bin'.format(self.server_address[1])
+
+
+class FirmwareRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        name = self.path[len('/bin/'):]
+        with self.server.lock:
+            self.server.requests.append((name, self.headers.get('If-None-Match')))
+            data = self.server.files.get(name)
+
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = '"{}"'.format(hashlib.sha256(data).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FirmwareServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(jade_ota, 'FWSERVER_URL_ROOT', server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_miss_then_hit(server, tmp_path):
+    server.files['jade/LATEST'] = b'fw1.bin fw2.bin'
+    cache = FirmwareCache(str(tmp_path))
+
+    assert cache.lookup('jade/LATEST') is None
+    assert cache.get('jade/LATEST') == b'fw1.bin fw2.bin'
+    assert server.requests == [('jade/LATEST', None)]
+
+    # Revalidated with the server (which replies 304), and served from the cache
+    assert cache.get('jade/LATEST') == b'fw1.bin fw2.bin'
+    assert server.requests[1][1] is not None
+    assert cache.lookup('jade/LATEST') == b'fw1.bin fw2.bin'
+
+    # Changed on the server
+    server.files['jade/LATEST'] = b'fw3.bin'
+    assert cache.get('jade/LATEST') == b'fw3.bin'
+    assert cache.lookup('jade/LATEST') == b'fw3.bin'
+
+    # Not on the server
+    assert cache.get('jade/missing') is None
+    assert cache.lookup('jade/missing') is None
+
+
+def test_offline_and_unreachable(server, tmp_path, monkeypatch):
+    server.files['jade/LATEST'] = b'fw1.bin'
+    assert FirmwareCache(str(tmp_path)).get('jade/LATEST') == b'fw1.bin'
+
+    offline = FirmwareCache(str(tmp_path), offline=True)
+    assert offline.get('jade/LATEST') == b'fw1.bin'
+    assert offline.get('jade/other') is None
+    assert len(server.requests) == 1
+
+    # Server cannot be reached - uses the cached copy
+    monkeypatch.setattr(jade_ota, 'FWSERVER_URL_ROOT', 'http://127.0.0.1:1/bin')
+    assert FirmwareCache(str(tmp_path)).get('jade/LATEST') == b'fw1.bin'
+
+
+def test_corrupt_cached_file(server, tmp_path):
+    server.files['jade/fw.bin'] = b'firmware' * 1000
+    cache = FirmwareCache(str(tmp_path))
+    assert cache.get('jade/fw.bin') == b'firmware' * 1000
+
+    blob = os.path.join(str(tmp_path), hashlib.sha256(b'firmware' * 1000).hexdigest())
+    with open(blob, 'wb') as f:
+        f.write(b'corrupt')
+
+    # Discarded and downloaded again - unconditionally
+    assert cache.get('jade/fw.bin') == b'firmware' * 1000
+    assert server.requests[-1] == ('jade/fw.bin', None)
+    with open(blob, 'rb') as f:
+        assert f.read() == b'firmware' * 1000
+
+    # Missing cached file
+    os.remove(blob)
+    assert cache.lookup('jade/fw.bin') is None
+    assert cache.get('jade/fw.bin') == b'firmware' * 1000
+
+
+def test_concurrent_fetches(server, tmp_path):
+    files = {'jade/fw{}.bin'.format(i): os.urandom(10000) for i in range(8)}
+    server.files.update(files)
+
+    # Several 'stations' sharing the cache directory
+    names = sorted(files) * 4
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda name: FirmwareCache(str(tmp_path)).get(name), names))
+    assert results == [files[name] for name in names]
+
+    cache = FirmwareCache(str(tmp_path), offline=True)
+    for name, data in files.items():
+        assert cache.lookup(name) == data
+    assert not [f for f in os.listdir(str(tmp_path)) if f.endswith('.tmp')]
+
+
+def test_evicts_least_recently_used(server, tmp_path):
+    server.files.update({'a': b'a' * 100, 'b': b'b' * 100, 'c': b'c' * 100})
+    cache = FirmwareCache(str(tmp_path), max_size=250)
+    cache.get('a')
+    cache.get('b')
+    cache.lookup('a')
+    cache.get('c')
+
+    assert cache.lookup('a') == b'a' * 100
+    assert cache.lookup('b') is None
+    assert cache.lookup('c') == b'c' * 100
+
+
+def test_without_fcntl(server, tmp_path, monkeypatch):
+    # eg. on Windows - the index is locked within the process only
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    server.files['jade/LATEST'] = b'fw1.bin'
+    cache = FirmwareCache(str(tmp_path))
+    assert cache.get('jade/LATEST') == b'fw1.bin'
+    assert cache.lookup('jade/LATEST') == b'fw1.bin'
+    assert not os.path.exists(os.path.join(str(tmp_path), FirmwareCache.LOCK_FILE))
@@ -0,0 +1,92 @@
+import random
+import struct
+import zlib
+
+import pytest
+
+from fwprep import create_patch, apply_patch, PATCH_MAGIC, PATCH_OP_ADD, PATCH_OP_INSERT, \
+    APP_ELF_SHA256_OFFSET, APP_ELF_SHA256_LEN
+
+
+def _random_bytes(rng, n):
+    return bytes(bytearray(rng.getrandbits(8) for _ in range(n)))
+
+
+# A random 'firmware' and a modified version of it - with bytes changed, a range
+# inserted, a range removed, a new app_elf_sha256 and data appended.
+def _make_base_and_target(seed=0, size=64 * 1024):
+    rng = random.Random(seed)
+    base = _random_bytes(rng, size)
+
+    target = bytearray(base)
+    for _ in range(200):
+        target[rng.randrange(len(target))] = rng.getrandbits(8)
+    target[20000:20000] = _random_bytes(rng, 3000)
+    del target[40000:41000]
+    target[APP_ELF_SHA256_OFFSET:APP_ELF_SHA256_OFFSET + APP_ELF_SHA256_LEN] = \
+        _random_bytes(rng, APP_ELF_SHA256_LEN)
+    target.extend(_random_bytes(rng, 5000))
+    return base, bytes(target)
+
+
+def _header(base):
+    elf_sha256 = base[APP_ELF_SHA256_OFFSET:APP_ELF_SHA256_OFFSET + APP_ELF_SHA256_LEN]
+    return PATCH_MAGIC + struct.pack('<I', len(base)) + elf_sha256
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_patch_round_trip(seed):
+    base, target = _make_base_and_target(seed)
+    patch = create_patch(base, target)
+    assert apply_patch(base, patch) == target
+
+    # Mostly matched against the base (so mostly zero deltas) rather than inserted
+    assert len(zlib.compress(patch)) < len(target) / 4
+
+
+def test_patch_round_trip_unrelated():
+    rng = random.Random(3)
+    base, target = _random_bytes(rng, 8192), _random_bytes(rng, 4096)
+    assert apply_patch(base, create_patch(base, target)) == target
+
+
+def test_patch_wrong_base():
+    base, target = _make_base_and_target()
+    patch = create_patch(base, target)
+
+    # Another firmware of the same length, but with a different app_elf_sha256
+    other = bytearray(base)
+    other[APP_ELF_SHA256_OFFSET] ^= 0xFF
+    with pytest.raises(AssertionError, match='not based on this firmware'):
+        apply_patch(bytes(other), patch)
+
+    # A firmware of a different length
+    with pytest.raises(AssertionError, match='length mismatch'):
+        apply_patch(base[:-1], patch)
+
+
+def test_patch_truncated():
+    base, target = _make_base_and_target()
+    patch = create_patch(base, target)
+
+    for length in [len(PATCH_MAGIC) + 4, len(_header(base)) + 3, len(patch) - 1]:
+        with pytest.raises(AssertionError, match='Truncated'):
+            apply_patch(base, patch[:length])
+
+
+def test_patch_add_beyond_base():
+    base, _ = _make_base_and_target()
+    patch = _header(base) + PATCH_OP_ADD + struct.pack('<II', len(base) - 4, 16) + bytes(16)
+    with pytest.raises(AssertionError, match='beyond the base'):
+        apply_patch(base, patch)
+
+    # Up to the end of the base is fine
+    patch = _header(base) + PATCH_OP_ADD + struct.pack('<II', len(base) - 16, 16) + bytes(16)
+    assert apply_patch(base, patch) == base[-16:]
+
+
+def test_patch_bad_op():
+    base, _ = _make_base_and_target()
+    patch = _header(base) + PATCH_OP_INSERT + struct.pack('<I', 4) + b'abcd' + b'X'
+    with pytest.raises(AssertionError, match='Bad patch op'):
+        apply_patch(base, patch)
@@ -0,0 +1,225 @@
+import pytest
+import wallycore as wally
+
+from jadepy.psbt import JadePsbtSigner, psbt_to_sign_tx_request, merge_psbt_signatures
+
+# The master key of the BIP174 test vectors (fingerprint d90c6a4f)
+BIP174_MASTER = 'tprv8ZgxMBicQKsPd9TeAdPADNnSyH9SSUUbTVeFszDE23Ki6TBB5nCefAdHkK8Fm3qMQR6sHwA56z' \
+                'qRmKmxnHk37JkiFzvncDqoKmPWubu7hDF'
+
+# BIP174 test vector: P2WSH 2-of-2 multisig input, both keypaths from BIP174_MASTER
+BIP174_P2WSH = (
+    'cHNidP8BAFICAAAAAZ38ZijCbFiZ/hvT3DOGZb/VXXraEPYiCXPfLTht7BJ2AQAAAAD/////AfA9zR0AAAAA'
+    'FgAUezoAv9wU0neVwrdJAdCdpu8TNXkAAAAATwEENYfPAto/0AiAAAAAlwSLGtBEWx7IJ1UXcnyHtOTrwYog'
+    'P/oPlMAVZr046QADUbdDiH7h1A3DKmBDck8tZFmztaTXPa7I+64EcvO8Q+IM2QxqT64AAIAAAACATwEENYfP'
+    'Ato/0AiAAAABuQRSQnE5zXjCz/JES+NTzVhgXj5RMoXlKLQH+uP2FzUD0wpel8itvFV9rCrZp+OcFyLrrGnm'
+    'aLbyZnzB1nHIPKsM2QxqT64AAIABAACAAAEBKwBlzR0AAAAAIgAgLFSGEmxJeAeagU4TcV1l82RZ5NbMre0m'
+    'bQUIZFuvpjIBBUdSIQKdoSzbWyNWkrkVNq/v5ckcOrlHPY5DtTODarRWKZyIcSEDNys0I07Xz5wf6l0F1EFV'
+    'eSe+lUKxYusC4ass6AIkwAtSriIGAp2hLNtbI1aSuRU2r+/lyRw6uUc9jkO1M4NqtFYpnIhxENkMak+uAACA'
+    'AAAAgAAAAAAiBgM3KzQjTtfPnB/qXQXUQVV5J76VQrFi6wLhqyzoAiTACxDZDGpPrgAAgAEAAIAAAAAAACIC'
+    'A57/H1R6HV+S36K6evaslxpL0DukpzSwMVaiVritOh75EO3kXMUAAACAAAAAgAEAAIAA'
+)
+
+# BIP174 test vector: P2PKH and P2SH-P2WPKH inputs, both (p2pkh) outputs with keypaths
+# for the wallet with fingerprint b4a6ba67
+BIP174_P2PKH_OUTPUTS = (
+    'cHNidP8BAKACAAAAAqsJSaCMWvfEm4IS9Bfi8Vqz9cM9zxU4IagTn4d6W3vkAAAAAAD+////qwlJoIxa98Sb'
+    'ghL0F+LxWrP1wz3PFTghqBOfh3pbe+QBAAAAAP7///8CYDvqCwAAAAAZdqkUdopAu9dAy+gdmI5x3ipNXHE5'
+    'ax2IrI4kAAAAAAAAGXapFG9GILVT+glechue4O/p+gOcykWXiKwAAAAAAAEA3wIAAAABJoFxNx7f8oXpN63u'
+    'pLN7eAAMBWbLs61kZBcTykIXG/YAAAAAakcwRAIgcLIkUSPmv0dNYMW1DAQ9TGkaXSQ18Jo0p2YqncJReQoC'
+    'IAEynKnazygL3zB0DsA5BCJCLIHLRYOUV663b8Eu3ZWzASECZX0RjTNXuOD0ws1G23s59tnDjZpwq8ubLeXc'
+    'jb/kzjH+////AtPf9QUAAAAAGXapFNDFmQPFusKGh2DpD9UhpGZap2UgiKwA4fUFAAAAABepFDVF5uM7gyxH'
+    'BQ8k0+65PJwDlIvHh7MuEwAAAQEgAOH1BQAAAAAXqRQ1RebjO4MsRwUPJNPuuTycA5SLx4cBBBYAFIXRNTfy'
+    '4mVAWjTbr6nj3aAfuCMIACICAurVlmh8qAYEPtw94RbN8p1eklfBls0FXPaYyNAr8k6ZELSmumcAAACAAAAA'
+    'gAIAAIAAIgIDlPYr6d8ZlSxVh3aK63aYBhrSxKJciU9H2MFitNchPQUQtKa6ZwAAAIABAACAAgAAgAA='
+)
+
+H = 0x80000000
+P2WPKH_PATH = [H + 84, H + 1, H, 0, 0]
+P2SH_P2WPKH_PATH = [H + 49, H + 1, H, 0, 0]
+P2PKH_PATH = [H + 44, H + 1, H, 0, 0]
+CHANGE_PATH = [H + 84, H + 1, H, 1, 0]
+OTHER_FINGERPRINT = bytes.fromhex('01020304')
+
+
+def _master():
+    return wally.bip32_key_from_base58(BIP174_MASTER)
+
+
+def _pubkey(path):
+    key = wally.bip32_key_from_parent_path(_master(), path, wally.BIP32_FLAG_KEY_PRIVATE)
+    return wally.bip32_key_get_pub_key(key)
+
+
+def _p2wpkh(pubkey):
+    return wally.witness_program_from_bytes(pubkey, wally.WALLY_SCRIPT_HASH160)
+
+
+def _keypaths(*keypaths):
+    keypath_map = wally.map_keypath_public_key_init(len(keypaths))
+    for pubkey, fingerprint, path in keypaths:
+        wally.map_keypath_add(keypath_map, pubkey, fingerprint, path)
+    return keypath_map
+
+
+# A PSBT spending p2wpkh, p2sh-p2wpkh and p2pkh inputs of the BIP174_MASTER wallet, and
+# a p2wpkh input of another wallet - to a change output, an external output, and an
+# output of the other wallet.
+def _make_singlesig_psbt():
+    fingerprint = wally.bip32_key_get_fingerprint(_master())
+    wpkh, sh_wpkh, pkh = _pubkey(P2WPKH_PATH), _pubkey(P2SH_P2WPKH_PATH), _pubkey(P2PKH_PATH)
+    other = _pubkey([1])
+    redeem_script = _p2wpkh(sh_wpkh)
+
+    prev_tx = wally.tx_init(2, 0, 1, 1)
+    wally.tx_add_raw_input(prev_tx, bytes(32), 0, 0xffffffff, None, None, 0)
+    wally.tx_add_raw_output(prev_tx, 30000, wally.scriptpubkey_p2pkh_from_bytes(
+        pkh, wally.WALLY_SCRIPT_HASH160), 0)
+
+    tx = wally.tx_init(2, 0, 4, 3)
+    for txid in [bytes([1]) * 32, bytes([2]) * 32,
+                 wally.sha256d(wally.tx_to_bytes(prev_tx, 0)), bytes([3]) * 32]:
+        wally.tx_add_raw_input(tx, txid, 0, 0xffffffff, None, None, 0)
+    wally.tx_add_raw_output(tx, 50000, _p2wpkh(_pubkey(CHANGE_PATH)), 0)
+    wally.tx_add_raw_output(tx, 40000, _p2wpkh(bytes([2]) + bytes(32)), 0)
+    wally.tx_add_raw_output(tx, 30000, _p2wpkh(other), 0)
+
+    psbt = wally.psbt_from_tx(tx, 0, 0)
+    wally.psbt_set_input_witness_utxo(psbt, 0, wally.tx_output_init(100000, _p2wpkh(wpkh)))
+    wally.psbt_set_input_keypaths(psbt, 0, _keypaths((wpkh, fingerprint, P2WPKH_PATH)))
+    wally.psbt_set_input_witness_utxo(psbt, 1, wally.tx_output_init(
+        20000, wally.scriptpubkey_p2sh_from_bytes(redeem_script, wally.WALLY_SCRIPT_HASH160)))
+    wally.psbt_set_input_redeem_script(psbt, 1, redeem_script)
+    wally.psbt_set_input_keypaths(psbt, 1, _keypaths((sh_wpkh, fingerprint, P2SH_P2WPKH_PATH)))
+    wally.psbt_set_input_utxo(psbt, 2, prev_tx)
+    wally.psbt_set_input_keypaths(psbt, 2, _keypaths((pkh, fingerprint, P2PKH_PATH)))
+    wally.psbt_set_input_witness_utxo(psbt, 3, wally.tx_output_init(10000, _p2wpkh(other)))
+    wally.psbt_set_input_keypaths(psbt, 3, _keypaths((other, OTHER_FINGERPRINT, [1])))
+    wally.psbt_set_output_keypaths(psbt, 0, _keypaths((_pubkey(CHANGE_PATH), fingerprint,
+                                                       CHANGE_PATH)))
+    wally.psbt_set_output_keypaths(psbt, 2, _keypaths((other, OTHER_FINGERPRINT, [1])))
+    return wally.psbt_to_base64(psbt, 0)
+
+
+# Fake hw - signs sign_tx inputs as the hw does, with the keys of the BIP174_MASTER wallet
+class FakeJade:
+    def __init__(self):
+        self.master = _master()
+        self.sign_tx_calls = []
+
+    def get_xpub(self, network, path):
+        assert path == []
+        return wally.bip32_key_to_base58(self.master, wally.BIP32_FLAG_KEY_PUBLIC)
+
+    def sign_tx(self, network, txn, inputs, change, validate=False):
+        self.sign_tx_calls.append((inputs, change))
+        tx = wally.tx_from_bytes(txn, 0)
+        signatures = []
+        for i, txinput in enumerate(inputs):
+            if 'path' not in txinput:
+                signatures.append(None)
+                continue
+
+            if 'satoshi' in txinput:
+                satoshi = txinput['satoshi']
+            else:
+                input_tx = wally.tx_from_bytes(txinput['input_tx'], 0)
+                satoshi = wally.tx_get_output_satoshi(input_tx, wally.tx_get_input_index(tx, i))
+            flags = wally.WALLY_TX_FLAG_USE_WITNESS if txinput['is_witness'] else 0
+            sighash = wally.tx_get_btc_signature_hash(tx, i, txinput['script'], satoshi,
+                                                      wally.WALLY_SIGHASH_ALL, flags)
+
+            key = wally.bip32_key_from_parent_path(self.master, txinput['path'],
+                                                   wally.BIP32_FLAG_KEY_PRIVATE)
+            signature = wally.ec_sig_from_bytes(wally.bip32_key_get_priv_key(key), sighash,
+                                                wally.EC_FLAG_ECDSA | wally.EC_FLAG_GRIND_R)
+            signatures.append(wally.ec_sig_to_der(signature) + bytes([wally.WALLY_SIGHASH_ALL]))
+        return signatures
+
+
+def _has_signature(psbt_b64, index, pubkey):
+    psbt = wally.psbt_from_base64(psbt_b64, 0)
+    return wally.psbt_find_input_signature(psbt, index, pubkey) != 0
+
+
+def test_singlesig_request():
+    fingerprint = wally.bip32_key_get_fingerprint(_master())
+    request = psbt_to_sign_tx_request(_make_singlesig_psbt(), fingerprint)
+
+    assert [txinput.get('path') for txinput in request.inputs] == \
+        [P2WPKH_PATH, P2SH_P2WPKH_PATH, P2PKH_PATH, None]
+    assert [txinput['is_witness'] for txinput in request.inputs] == [True, True, False, True]
+    assert request.inputs[0]['satoshi'] == 100000
+    assert 'input_tx' in request.inputs[2]
+    assert [sighash is not None for sighash in request.sighashes] == [True, True, True, False]
+
+    # Only the single-sig output with a keypath for the wallet is change
+    assert request.change == [{'path': CHANGE_PATH, 'variant': 'wpkh(k)'}, None, None]
+
+
+def test_sign_singlesig():
+    psbt = _make_singlesig_psbt()
+    jade = FakeJade()
+    signed = JadePsbtSigner(jade, 'testnet').sign_psbt(psbt)
+
+    assert _has_signature(signed, 0, _pubkey(P2WPKH_PATH))
+    assert _has_signature(signed, 1, _pubkey(P2SH_P2WPKH_PATH))
+    assert _has_signature(signed, 2, _pubkey(P2PKH_PATH))
+    assert wally.psbt_get_input_signatures_size(wally.psbt_from_base64(signed, 0), 3) == 0
+
+    # The wallet's inputs can then be finalized
+    finalized = wally.psbt_from_base64(signed, 0)
+    wally.psbt_finalize(finalized, 0)
+    assert wally.psbt_get_input_final_witness(finalized, 0)
+    assert wally.psbt_get_input_final_scriptsig_len(finalized, 1)
+    assert wally.psbt_get_input_final_scriptsig_len(finalized, 2)
+    assert not wally.psbt_get_input_final_scriptsig_len(finalized, 3)
+
+
+def test_sign_bip174_p2wsh_multisig():
+    # Signs with the first of the wallet's keypaths for the input
+    signed = JadePsbtSigner(FakeJade(), 'testnet').sign_psbt(BIP174_P2WSH)
+    assert _has_signature(signed, 0, _pubkey([H + 174, H, 0]))
+    assert not _has_signature(signed, 0, _pubkey([H + 174, H + 1, 0]))
+
+
+def test_bip174_change_detection():
+    # Both outputs are p2pkh with keypaths for the b4a6ba67 wallet
+    request = psbt_to_sign_tx_request(BIP174_P2PKH_OUTPUTS, bytes.fromhex('b4a6ba67'))
+    assert request.change == [{'path': [H, H, H + 2], 'variant': 'pkh(k)'},
+                              {'path': [H, H + 1, H + 2], 'variant': 'pkh(k)'}]
+    assert request.sighashes == [None, None]
+
+    # Not change for another wallet
+    request = psbt_to_sign_tx_request(BIP174_P2PKH_OUTPUTS, wally.bip32_key_get_fingerprint(
+        _master()))
+    assert request.change is None
+
+
+def test_sign_stream():
+    psbts = [_make_singlesig_psbt(), BIP174_P2WSH, BIP174_P2PKH_OUTPUTS]
+    jade = FakeJade()
+    signed = list(JadePsbtSigner(jade, 'testnet', max_workers=2, max_pending=1).sign(psbts))
+
+    assert len(signed) == len(psbts) == len(jade.sign_tx_calls)
+    assert _has_signature(signed[0], 2, _pubkey(P2PKH_PATH))
+    assert _has_signature(signed[1], 0, _pubkey([H + 174, H, 0]))
+    assert signed[2] == BIP174_P2PKH_OUTPUTS
+
+
+def test_malformed_psbt():
+    fingerprint = wally.bip32_key_get_fingerprint(_master())
+    with pytest.raises(ValueError):
+        psbt_to_sign_tx_request('cHNidP8BAKACAAAAAqsJSaCM', fingerprint)
+
+
+def test_signature_not_matching_keypaths():
+    fingerprint = wally.bip32_key_get_fingerprint(_master())
+    psbt = _make_singlesig_psbt()
+    request = psbt_to_sign_tx_request(psbt, fingerprint)
+    signatures = FakeJade().sign_tx('testnet', request.txn, request.inputs, request.change)
+
+    # Signature for one input merged into another
+    signatures[0], signatures[1] = signatures[1], signatures[0]
+    with pytest.raises(ValueError):
+        merge_psbt_signatures(psbt, request.sighashes, signatures)
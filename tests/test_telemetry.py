@@ -0,0 +1,48 @@
+import pytest
+
+from jadepy.telemetry import summarise_samples
+
+
+def _sample(time, rpc, free_dram, largest_dram):
+    return {'time': time, 'rpc': rpc, 'JADE_FREE_HEAP': free_dram,
+            'JADE_FREE_DRAM': free_dram, 'JADE_LARGEST_DRAM': largest_dram,
+            'JADE_FREE_SPIRAM': None, 'JADE_LARGEST_SPIRAM': None}
+
+
+def test_summarise_no_samples():
+    assert summarise_samples([]) == {}
+
+
+def test_summarise_single_sample():
+    summary = summarise_samples([_sample(10.0, 'start', 1000, 500)])
+    assert summary['num_samples'] == 1
+    assert summary['duration'] == 0
+    assert summary['JADE_FREE_DRAM'] == {'initial': 1000, 'min': 1000, 'min_rpc': 'start',
+                                         'final': 1000, 'peak_use': 0, 'trend': 0}
+    assert summary['dram_fragmentation'] == {'initial': 0.5, 'max': 0.5, 'final': 0.5,
+                                             'trend': 0}
+
+    # No spiram values sampled
+    assert 'JADE_FREE_SPIRAM' not in summary
+    assert 'spiram_fragmentation' not in summary
+
+
+def test_summarise_samples():
+    samples = [_sample(0.0, 'start', 1000, 1000),
+               _sample(1.0, 'sign_tx', 600, 300),
+               _sample(2.0, 'get_xpub', 800, 400),
+               _sample(3.0, 'get_xpub', 700, 700)]
+    summary = summarise_samples(samples)
+    assert summary['num_samples'] == 4
+    assert summary['duration'] == 3.0
+
+    stats = summary['JADE_FREE_DRAM']
+    assert (stats['initial'], stats['min'], stats['min_rpc'], stats['final']) == \
+        (1000, 600, 'sign_tx', 700)
+    assert stats['peak_use'] == 400
+    assert stats['trend'] == pytest.approx(-70.0)
+
+    fragmentation = summary['dram_fragmentation']
+    assert (fragmentation['initial'], fragmentation['max'], fragmentation['final']) == \
+        (0, 0.5, 0)
+    assert fragmentation['trend'] == pytest.approx(0.0)